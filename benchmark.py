@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import pickle
+import platform
+import sys
+import time
+import numpy as np
+import main
+
+# (train file, features classes of its model, files to decode with the model)
+DEFAULT_SUITES = [('train1.wtag', main.MODEL_1_CLASSES, ['test1.wtag', 'comp1.words']),
+                  ('train2.wtag', main.MODEL_2_CLASSES, ['comp1.words'])]
+
+
+def timed(function, repeat=1):
+    """
+    :return: minimal wall time of repeat calls of function, result of the last call
+    """
+    best, result = np.inf, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def build_features_indices(c: main.ClassStatistics, classes):
+    f = main.Feature2Id(c)
+    f.set_all_classes_index(classes)
+    return f
+
+
+def benchmark_train_file(train_file, classes, decode_files, beams, n_sentences, repeat):
+    """
+    time every stage of training on train_file and of decoding decode_files, each stage separately
+    :return: dict of the results of the stages
+    """
+    stages = dict()
+    seconds, corpus = timed(lambda: main.Corpus(train_file), repeat)
+    stages['corpus'] = {'seconds': seconds, 'n_sentences': len(corpus), 'n_words': corpus.n_words()}
+
+    def statistics():
+        c = main.ClassStatistics(train_file, corpus)
+        c.set_all_classes_dicts(classes)
+        return c
+    seconds, c = timed(statistics, repeat)
+    stages['statistics'] = {'seconds': seconds}
+
+    seconds, f = timed(lambda: build_features_indices(c, classes), repeat)
+    stages['indexing'] = {'seconds': seconds, 'n_features': f.n_total_features}
+
+    # every word with all the tags is one history. a new words shapes cache every time, as in a new training
+    seconds, (features_matrix, _) = timed(
+        lambda: main.build_features_matrix(corpus, c, f, shape_cache=main.WordShapeCache()), repeat)
+    stages['feature_extraction'] = {'seconds': seconds, 'histories_per_second': corpus.n_words() / seconds,
+                                    'nnz': int(features_matrix.nnz)}
+
+    trainer = main.Trainer(corpus, 0.1, c, f)
+    trainer.build()
+    v = np.random.RandomState(0).randn(f.n_total_features)
+    seconds, _ = timed(lambda: trainer.function_l_and_gradient_l(v), repeat)
+    stages['objective_and_gradient'] = {'seconds': seconds}
+
+    # the trained weights of the model if they are in the repository, else the random weights
+    weights_path = rf'weights_trained_on_{train_file}.pkl'
+    weights = v
+    if os.path.exists(weights_path):
+        with open(weights_path, 'rb') as file:
+            trained_weights = pickle.load(file)
+        if len(trained_weights) == f.n_total_features:
+            weights = trained_weights
+
+    viterbi = list()
+    for decode_file in decode_files:
+        decode_corpus = main.Corpus(decode_file)
+        sentences = [decode_corpus.words(s) for s in range(min(n_sentences, len(decode_corpus)))]
+        n_tokens = sum(len(words) for words in sentences)
+        for beam in beams:
+            seconds, _ = timed(lambda: [main.memm_viterbi(weights, f, words, c, beam) for words in sentences], repeat)
+            viterbi.append({'file': decode_file, 'beam': beam, 'n_sentences': len(sentences), 'n_tokens': n_tokens,
+                            'seconds': seconds, 'tokens_per_second': n_tokens / seconds})
+
+    return {'train_file': train_file, 'classes': classes, 'trained_weights': weights is not v, 'stages': stages,
+            'viterbi': viterbi}
+
+
+if __name__ == "__main__":
+    """ ------------------------------------------------------ """
+    """ BENCHMARK THE STAGES OF TRAINING AND TAGGING TO JSON """
+    # e.g. python benchmark.py --output benchmark.json --beams 1 5 50 --n-sentences 100
+
+    parser = argparse.ArgumentParser(description='benchmark the hot paths of training and tagging')
+    parser.add_argument('--output', default='benchmark.json', help='path of the JSON results file, - for stdout')
+    parser.add_argument('--beams', type=int, nargs='+', default=[1, 5, 10, 50], help='beam sizes for Viterbi')
+    parser.add_argument('--n-sentences', type=int, default=100, help='number of sentences to decode from each file')
+    parser.add_argument('--repeat', type=int, default=1, help='repeat every stage, the minimal time is reported')
+    parser.add_argument('--train-files', nargs='+', default=None,
+                        help='train files of the default suites to run (default all: train1.wtag train2.wtag)')
+    args = parser.parse_args()
+
+    suites = [suite for suite in DEFAULT_SUITES if args.train_files is None or suite[0] in args.train_files]
+    results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+               'numpy': np.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+               'beams': args.beams, 'n_sentences': args.n_sentences, 'repeat': args.repeat, 'suites': list()}
+    for train_file, classes, decode_files in suites:
+        print(f'benchmarking {train_file}', file=sys.stderr)
+        results['suites'].append(benchmark_train_file(train_file, classes, decode_files, args.beams,
+                                                      args.n_sentences, args.repeat))
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
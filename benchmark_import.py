@@ -0,0 +1,33 @@
+import subprocess
+import sys
+import os
+
+# modules only training and ConfusionMatrix need - importing main for tagging should not load them
+HEAVY_MODULES = ['scipy.optimize', 'scipy.sparse', 'scipy.special', 'matplotlib', 'seaborn', 'pandas']
+
+# runs in a fresh interpreter every time, prints the import time and the heavy modules that were loaded
+IMPORT_CODE = ("import sys, time\n"
+               "start = time.perf_counter()\n"
+               "import main\n"
+               "print(time.perf_counter() - start)\n"
+               f"print(','.join([name for name in {HEAVY_MODULES!r} if name in sys.modules]))\n")
+
+if __name__ == "__main__":
+    """ ------------------------------------------- """
+    """ TIME A COLD `import main` (TAGGER STARTUP) """
+    # e.g. python benchmark_import.py 10
+
+    n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times, loaded = list(), set()
+    for _ in range(n_runs):
+        result = subprocess.run([sys.executable, '-c', IMPORT_CODE], cwd=directory, capture_output=True, text=True,
+                                check=True)
+        import_time, heavy = result.stdout.splitlines()
+        times.append(float(import_time))
+        loaded.update(filter(None, heavy.split(',')))
+
+    times.sort()
+    print(f'import main: min {times[0] * 1000:.1f} ms, median {times[len(times) // 2] * 1000:.1f} ms '
+          f'({n_runs} runs)')
+    print('heavy modules loaded:', ', '.join(sorted(loaded)) if loaded else 'none')
@@ -1,22 +1,34 @@
-import pickle
+import os
 import main
-from main import ClassStatistics
-from main import Feature2Id
+from main import ClassStatistics  # needed for loading the pickled objects
+from main import Feature2Id  # needed for loading the pickled objects
+
+
+def load_tagging_model(train_file_path_: str):
+    """
+    load the inference model file saved by training (model_trained_on_<train file>.memm, see main.save_model).
+    models that were only pickled are read from the .pkl files one time and their model file is written, the next
+    runs load the model file
+    :param train_file_path_: train file of the model e.g: 'train2.wtag'
+    :return: ClassStatistics object, Feature2Id object, weights
+    """
+    model_path = rf'model_trained_on_{train_file_path_}.memm'
+    if os.path.exists(model_path):
+        return main.load_model(model_path)
+
+    c, f, weights = main.load_pickled_model(train_file_path_)
+    # hashed features have no keys to save, they are tagged from the .pkl files
+    if not isinstance(f, main.HashedFeature2Id):
+        main.save_model(model_path, c, f, weights)
+    return c, f, weights
+
 
 if __name__ == "__main__":
     """ -------------------------------- """
     """ PREPARE COMP 1 FILE FROM WEIGHTS """
 
-    # Load trained weights (and extra objects needed) for our model
-    c_path = rf'c_object_trained_on_train1test1.wtag.pkl'
-    f_path = rf'f_object_trained_on_train1test1.wtag.pkl'
-    weights_path = rf'weights_trained_on_train1test1.wtag.pkl'
-    with open(c_path, 'rb') as file:
-        c = pickle.load(file)
-    with open(f_path, 'rb') as file:
-        f = pickle.load(file)
-    with open(weights_path, 'rb') as file:
-        weights = pickle.load(file)
+    # Load trained weights (and the tags and features index needed) for our model
+    c, f, weights = load_tagging_model('train1test1.wtag')
 
     # Run inference on competition 1 data file and write results to file according to .wtag format (described in HW1)
     main.inference(path_file_to_tag=r'comp1.words', path_result=r'comp_m1_308044296.wtag', weights=weights,
@@ -25,16 +37,8 @@ if __name__ == "__main__":
     """ -------------------------------- """
     """ PREPARE COMP 2 FILE FROM WEIGHTS """
 
-    # Load trained weights (and extra objects needed) for our model
-    c_path = rf'c_object_trained_on_train2.wtag.pkl'
-    f_path = rf'f_object_trained_on_train2.wtag.pkl'
-    weights_path = rf'weights_trained_on_train2.wtag.pkl'
-    with open(c_path, 'rb') as file:
-        c = pickle.load(file)
-    with open(f_path, 'rb') as file:
-        f = pickle.load(file)
-    with open(weights_path, 'rb') as file:
-        weights = pickle.load(file)
+    # Load trained weights (and the tags and features index needed) for our model
+    c, f, weights = load_tagging_model('train2.wtag')
 
     # Run inference on competition 2 data file and write results to file according to .wtag format (described in HW1)
     main.inference(path_file_to_tag=r'comp2.words', path_result=r'comp_m2_308044296.wtag', weights=weights,
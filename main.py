@@ -1,15 +1,258 @@
 from collections import OrderedDict
+from collections.abc import Mapping
 import re
 import numpy as np
-from scipy import optimize
 import pickle
-import scipy.special as special
-import matplotlib.pyplot as plt
-from matplotlib import colors
-import seaborn as sns
-import pandas as pd
+import mmap
+import zlib
+import struct
 import time
+import contextlib
+import itertools
+import cProfile
 import os
+import sys
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+# features classes used by each model
+MODEL_1_CLASSES = [100, 101, 102, 103, 104, 105, 106, 107, 108, 109, 110]
+MODEL_2_CLASSES = [100, 101, 102, 103, 104, 105, 106, 107, 108, 109, 111]
+
+# binary model file (see save_model)
+MODEL_FILE_MAGIC = b'MEMMTAG\0'
+MODEL_FILE_VERSION = 3
+# magic, version, reserved, n_tags, n_templates, n_entries, n_features, n_hash_slots, tags blob size, keys blob size
+MODEL_FILE_HEADER = struct.Struct('<8sIIQQQQQQQ')
+
+
+class Profiler:
+    """
+    opt-in named timers and counters for the stages of training and tagging (see train_model_1, inference).
+    one stage can also be run under cProfile (all its calls are collected together). the summary is printed by report
+    """
+
+    def __init__(self, enabled=True, profile_stage=None):
+        """
+        :param enabled: False for a profiler that does nothing (the default of the stages functions)
+        :param profile_stage: name of a stage to run under cProfile e.g: 'objective', None for no cProfile
+        """
+        self.enabled = enabled
+        self.profile_stage = profile_stage
+        self.timers = OrderedDict()  # {stage: [calls, total seconds, max seconds]}
+        self.counters = OrderedDict()  # {counter: total}
+        self.profile = None  # cProfile.Profile of profile_stage
+
+    def stage(self, name):
+        """
+        :return: context manager that times a call of the stage
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed_stage(name)
+
+    @contextlib.contextmanager
+    def _timed_stage(self, name):
+        profile = None
+        if name == self.profile_stage:
+            if self.profile is None:
+                self.profile = cProfile.Profile()
+            profile = self.profile
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+            timer = self.timers.setdefault(name, [0, 0., 0.])
+            timer[0] += 1
+            timer[1] += elapsed
+            timer[2] = max(timer[2], elapsed)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self, file=None, n_profile_lines=25):
+        """
+        print the timers, the counters and the n_profile_lines most expensive functions (cumulative time) of the
+        cProfile stage
+        :param file: file to print to, None for stdout
+        """
+        if not self.enabled:
+            return
+        file = file if file is not None else sys.stdout
+        print(f'{"stage":<24}{"calls":>8}{"total s":>12}{"mean ms":>12}{"max ms":>12}', file=file)
+        for name, (calls, total, maximum) in self.timers.items():
+            print(f'{name:<24}{calls:>8}{total:>12.3f}{total / calls * 1000:>12.3f}{maximum * 1000:>12.3f}', file=file)
+        for name, total in self.counters.items():
+            print(f'{name:<24}{total:>8}', file=file)
+        if self.profile is not None:
+            import pstats
+
+            print(f'cProfile of stage {self.profile_stage}:', file=file)
+            pstats.Stats(self.profile, stream=file).sort_stats('cumulative').print_stats(n_profile_lines)
+
+
+# profiler of the stages functions when none is given
+NO_PROFILER = Profiler(enabled=False)
+
+
+class Corpus:
+    """
+    sentences of a .wtag / .words file parsed once into interned word ids and tag ids
+    """
+
+    def __init__(self, file_path=None):
+        """
+        :param file_path: full path of the file to read (tagged or not tagged). None for an empty corpus
+        """
+        self.file_path = file_path
+
+        self.words_list = list()  # word id -> word
+        self.word_to_id = dict()  # word -> word id
+        self.tags_list = list()  # tag id -> tag
+        self.tag_to_id = dict()  # tag -> tag id
+
+        # all the sentences flattened, words of sentence s are in [offsets[s], offsets[s + 1])
+        self.word_ids = np.zeros(0, dtype=np.int32)
+        self.tag_ids = np.zeros(0, dtype=np.int32)  # -1 for words without a tag (.words files)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.ends_with_newline = True  # whether the last line in the file ends with '\n'
+
+        if file_path is not None:
+            with open(file_path) as f:
+                self.add_lines(f)
+
+    def add_lines(self, lines):
+        """
+        parse lines of text and append them as sentences to the corpus
+        :param lines: iterable of lines e.g. "The_DT Treasury_NNP is_VBZ still_RB ._.\n"
+        """
+        word_ids, tag_ids, offsets = self.word_ids.tolist(), self.tag_ids.tolist(), self.offsets.tolist()
+        for line in lines:
+            splited_words = re.split(' |[\n]', line)
+            self.ends_with_newline = splited_words[-1] == ""
+            if self.ends_with_newline:
+                del splited_words[-1]  # remove \n
+            for word_tag_str in splited_words:
+                word_tag_list = word_tag_str.split('_')
+                word_ids.append(self._intern(word_tag_list[0], self.word_to_id, self.words_list))
+                tag_ids.append(self._intern(word_tag_list[1], self.tag_to_id, self.tags_list)
+                               if len(word_tag_list) > 1 else -1)
+            offsets.append(len(word_ids))
+
+        self.word_ids = np.array(word_ids, dtype=np.int32)
+        self.tag_ids = np.array(tag_ids, dtype=np.int32)
+        self.offsets = np.array(offsets, dtype=np.int64)
+
+    @staticmethod
+    def _intern(string, string_to_id, strings_list):
+        if string not in string_to_id:
+            string_to_id[string] = len(strings_list)
+            strings_list.append(sys.intern(string))
+        return string_to_id[string]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def n_words(self):
+        return len(self.word_ids)
+
+    def words(self, s):
+        """
+        :param s: sentence index
+        :return: [list of words in order]
+        """
+        return [self.words_list[i] for i in self.word_ids[self.offsets[s]:self.offsets[s + 1]].tolist()]
+
+    def tags(self, s):
+        """
+        :param s: sentence index
+        :return: [list of tags in order] (None for words without a tag)
+        """
+        return [self.tags_list[i] if i >= 0 else None
+                for i in self.tag_ids[self.offsets[s]:self.offsets[s + 1]].tolist()]
+
+    def sentence(self, s):
+        """
+        :param s: sentence index
+        :return: [list of words in order], [list of tags in order]
+        """
+        return self.words(s), self.tags(s)
+
+    def sentences(self):
+        """
+        generator of (words, tags) for all the sentences in order
+        """
+        for s in range(len(self)):
+            yield self.sentence(s)
+
+    def line(self, s):
+        """
+        :param s: sentence index
+        :return: the sentence in .wtag format (or .words format if not tagged), with '\n' at the end
+        """
+        words, tags = self.sentence(s)
+        return ' '.join([word if tag is None else f'{word}_{tag}' for word, tag in zip(words, tags)]) + '\n'
+
+    def subset(self, sentences_indices):
+        """
+        :param sentences_indices: indices of sentences of this corpus
+        :return: new Corpus of the given sentences in the given order (the words and tags ids are kept)
+        """
+        subset = Corpus()
+        subset.words_list, subset.word_to_id = list(self.words_list), dict(self.word_to_id)
+        subset.tags_list, subset.tag_to_id = list(self.tags_list), dict(self.tag_to_id)
+        sentences_indices = np.asarray(sentences_indices, dtype=np.int64)
+        starts, ends = self.offsets[sentences_indices], self.offsets[sentences_indices + 1]
+        subset.offsets = np.zeros(len(sentences_indices) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=subset.offsets[1:])
+        words_positions = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)] or
+                                         [np.zeros(0, dtype=np.int64)])
+        subset.word_ids = self.word_ids[words_positions]
+        subset.tag_ids = self.tag_ids[words_positions]
+        return subset
+
+
+class HeldOutCounts(Mapping):
+    """
+    read only counts dict of a corpus without some of its sentences - the counts of the corpus minus the counts of
+    the held out sentences, the counts of the corpus are not copied. keys with count 0 are skipped, the order is the
+    order of the counts of the corpus
+    """
+
+    def __init__(self, counts: dict, held_out_counts: dict):
+        """
+        :param counts: counts dict of the corpus e.g. class_statistics.class100_dict
+        :param held_out_counts: counts dict of the same class of the held out sentences
+        """
+        self.counts = counts
+        self.held_out_counts = held_out_counts
+        self.removed = set(key for key, value in held_out_counts.items() if counts[key] == value)  # count 0 keys
+
+    def __getitem__(self, key):
+        if key in self.removed:
+            raise KeyError(key)
+        return self.counts[key] - self.held_out_counts.get(key, 0)
+
+    def __iter__(self):
+        removed = self.removed
+        return (key for key in self.counts if key not in removed)
+
+    def __len__(self):
+        return len(self.counts) - len(self.removed)
+
+    def items(self):
+        held_out_counts, removed = self.held_out_counts, self.removed
+        for key, value in self.counts.items():
+            if key not in held_out_counts:
+                yield key, value
+            elif key not in removed:
+                yield key, value - held_out_counts[key]
 
 
 class ClassStatistics:
@@ -17,11 +260,13 @@ class ClassStatistics:
     define classes of features and its statistics (e.g. counts)
     """
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, corpus: Corpus = None):
         """
         :param file_path: full path of the train file to read
+        :param corpus: already parsed Corpus of the train file. if None the file is parsed when counting
         """
         self.file_path = file_path
+        self.corpus = corpus
         self.Y = set()  # all the different tags we saw in training
 
         # Init all features classes dictionaries
@@ -46,151 +291,186 @@ class ClassStatistics:
         self.class110_dict = OrderedDict()  # {(110.x, tag): # times seen}
         self.class111_dict = OrderedDict()  # {(111.x, tag): # times seen}
 
+    def _count_file(self, *update_functions):
+        """
+            Go over the train corpus once and call every update function for every word in it
+            :param update_functions: functions with signature (words, tags, word_idx)
+        """
+        corpus = self.corpus if self.corpus is not None else Corpus(self.file_path)
+        for words, tags in corpus.sentences():
+            for word_idx in range(len(words)):
+                for update_function in update_functions:
+                    update_function(words, tags, word_idx)
+
+    def __getstate__(self):
+        # the parsed corpus is not needed after counting, don't save it with the statistics
+        state = self.__dict__.copy()
+        state['corpus'] = None
+        return state
+
+    def set_all_classes_dicts(self, classes):
+        """
+            Create counts dicts for all the given classes in a single pass over the train file.
+            gives exactly the same counts as calling set_class<n>_dict for every class one after another
+            :param classes: list of classes numbers e.g. [100, 101, ..., 110]
+        """
+        self._count_file(*[getattr(self, f'_update_class{n}_dict') for n in classes])
+        if 100 in classes:
+            self.Y = sorted(list(self.Y))
+
+    def subtract(self, held_out_statistics):
+        """
+            Statistics of the train corpus without some of its sentences, from the counts of these sentences only
+            (e.g. a cross validation fold). the counts dicts are read only views of these counts minus the held out
+            counts (see HeldOutCounts), so the cost is in the number of held out keys and these statistics are not
+            changed. gives the same counts as counting the remaining sentences (in the keys order of these
+            statistics), keys with count 0 are skipped. only the threshold pass of Feature2Id over the views is
+            still in the number of keys of the whole corpus
+            :param held_out_statistics: ClassStatistics of the removed sentences, with the same classes counted
+            :return: new ClassStatistics object
+        """
+        statistics = ClassStatistics(self.file_path)
+        for n in [100, 101, 102, 103, 104, 105, 106, 107, 108, 109, 110, 111]:
+            setattr(statistics, f'class{n}_dict', HeldOutCounts(getattr(self, f'class{n}_dict'),
+                                                                getattr(held_out_statistics, f'class{n}_dict')))
+        if self.class100_dict:
+            # tags of the held out sentences that are left with no words, from the tags counts if class 105 is
+            # counted
+            if self.class105_dict:
+                removed_tags = set(key[-1] for key in statistics.class105_dict.removed)
+            else:
+                tags = set(key[-1] for key in statistics.class100_dict)
+                removed_tags = set(tag for tag in held_out_statistics.Y if tag not in tags)
+            statistics.Y = [tag for tag in self.Y if tag not in removed_tags]
+        return statistics
+
+    def set_Y(self):
+        """
+            Collect only the tags (Y) of the train file, without counting any feature (enough for HashedFeature2Id)
+        """
+        corpus = self.corpus if self.corpus is not None else Corpus(self.file_path)
+        self.Y = sorted(set(tag for _, tags in corpus.sentences() for tag in tags))
+
     def set_class100_dict(self):
         """
             Create counts dict for class 100 features
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_word, cur_tag = splited_words[word_idx].split('_')
-                    self.Y.add(cur_tag)
-                    if (100, cur_word, cur_tag) not in self.class100_dict:
-                        self.class100_dict[(100, cur_word, cur_tag)] = 1
-                    else:
-                        self.class100_dict[(100, cur_word, cur_tag)] += 1
+        self._count_file(self._update_class100_dict)
         self.Y = sorted(list(self.Y))
 
+    def _update_class100_dict(self, words, tags, word_idx):
+        cur_word, cur_tag = words[word_idx], tags[word_idx]
+        self.Y.add(cur_tag)
+        if (100, cur_word, cur_tag) not in self.class100_dict:
+            self.class100_dict[(100, cur_word, cur_tag)] = 1
+        else:
+            self.class100_dict[(100, cur_word, cur_tag)] += 1
+
     def set_class101_dict(self):
         """
             Create counts dict for class 101 features
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_word, cur_tag = splited_words[word_idx].split('_')
-                    if not re.match('^[0-9]+([-,.:]?[0-9]?)*$', cur_word) and not re.match('^[0-9]+\\\\/[0-9]+$',
-                                                                                           cur_word):
-                        n = min(len(cur_word) - 1, 7)
-                        for suffix_length in range(1, n + 1):
-                            if not re.match('^[0-9]+$', cur_word[-suffix_length:]):
-                                if (101, cur_word[-suffix_length:], cur_tag) not in self.class101_dict:
-                                    self.class101_dict[(101, cur_word[-suffix_length:], cur_tag)] = 1
-                                else:
-                                    self.class101_dict[(101, cur_word[-suffix_length:], cur_tag)] += 1
+        self._count_file(self._update_class101_dict)
+
+    def _update_class101_dict(self, words, tags, word_idx):
+        cur_word, cur_tag = words[word_idx], tags[word_idx]
+        if not re.match('^[0-9]+([-,.:]?[0-9]?)*$', cur_word) and not re.match('^[0-9]+\\\\/[0-9]+$',
+                                                                               cur_word):
+            n = min(len(cur_word) - 1, 7)
+            for suffix_length in range(1, n + 1):
+                if not re.match('^[0-9]+$', cur_word[-suffix_length:]):
+                    if (101, cur_word[-suffix_length:], cur_tag) not in self.class101_dict:
+                        self.class101_dict[(101, cur_word[-suffix_length:], cur_tag)] = 1
+                    else:
+                        self.class101_dict[(101, cur_word[-suffix_length:], cur_tag)] += 1
 
     def set_class102_dict(self):
         """
             Create counts dict for class 102 features
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_word, cur_tag = splited_words[word_idx].split('_')
-                    if not re.match('^[0-9]+([-,.:]*[0-9]*)*$', cur_word) and not re.match('^[0-9]+\\\\/[0-9]+$',
-                                                                                           cur_word):
-                        n = min(len(cur_word) - 1, 7)
-                        for prefix_length in range(1, n + 1):
-                            if not re.match('^[0-9]+$', cur_word[:prefix_length]):
-                                if (102, cur_word[:prefix_length], cur_tag) not in self.class102_dict:
-                                    self.class102_dict[(102, cur_word[:prefix_length], cur_tag)] = 1
-                                else:
-                                    self.class102_dict[(102, cur_word[:prefix_length], cur_tag)] += 1
+        self._count_file(self._update_class102_dict)
+
+    def _update_class102_dict(self, words, tags, word_idx):
+        cur_word, cur_tag = words[word_idx], tags[word_idx]
+        if not re.match('^[0-9]+([-,.:]*[0-9]*)*$', cur_word) and not re.match('^[0-9]+\\\\/[0-9]+$',
+                                                                               cur_word):
+            n = min(len(cur_word) - 1, 7)
+            for prefix_length in range(1, n + 1):
+                if not re.match('^[0-9]+$', cur_word[:prefix_length]):
+                    if (102, cur_word[:prefix_length], cur_tag) not in self.class102_dict:
+                        self.class102_dict[(102, cur_word[:prefix_length], cur_tag)] = 1
+                    else:
+                        self.class102_dict[(102, cur_word[:prefix_length], cur_tag)] += 1
 
     def set_class103_dict(self):
         """
             Create counts dict for class 103 features
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_tag = splited_words[word_idx].split('_')[1]
-                    prev_tag = splited_words[word_idx - 1].split('_')[1] if word_idx > 0 else ''
-                    prev_prev_tag = splited_words[word_idx - 2].split('_')[1] if word_idx - 1 > 0 else ''
-                    if (103, prev_prev_tag, prev_tag, cur_tag) not in self.class103_dict:
-                        self.class103_dict[(103, prev_prev_tag, prev_tag, cur_tag)] = 1
-                    else:
-                        self.class103_dict[(103, prev_prev_tag, prev_tag, cur_tag)] += 1
+        self._count_file(self._update_class103_dict)
+
+    def _update_class103_dict(self, words, tags, word_idx):
+        cur_tag = tags[word_idx]
+        prev_tag = tags[word_idx - 1] if word_idx > 0 else ''
+        prev_prev_tag = tags[word_idx - 2] if word_idx - 1 > 0 else ''
+        if (103, prev_prev_tag, prev_tag, cur_tag) not in self.class103_dict:
+            self.class103_dict[(103, prev_prev_tag, prev_tag, cur_tag)] = 1
+        else:
+            self.class103_dict[(103, prev_prev_tag, prev_tag, cur_tag)] += 1
 
     def set_class104_dict(self):
         """
             Create counts dict for class 104 features
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_tag = splited_words[word_idx].split('_')[1]
-                    prev_tag = splited_words[word_idx - 1].split('_')[1] if word_idx > 0 else ''
-                    if (104, prev_tag, cur_tag) not in self.class104_dict:
-                        self.class104_dict[(104, prev_tag, cur_tag)] = 1
-                    else:
-                        self.class104_dict[(104, prev_tag, cur_tag)] += 1
+        self._count_file(self._update_class104_dict)
+
+    def _update_class104_dict(self, words, tags, word_idx):
+        cur_tag = tags[word_idx]
+        prev_tag = tags[word_idx - 1] if word_idx > 0 else ''
+        if (104, prev_tag, cur_tag) not in self.class104_dict:
+            self.class104_dict[(104, prev_tag, cur_tag)] = 1
+        else:
+            self.class104_dict[(104, prev_tag, cur_tag)] += 1
 
     def set_class105_dict(self):
         """
             Create counts dict for class 105 features
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_tag = splited_words[word_idx].split('_')[1]
-                    if (105, cur_tag) not in self.class105_dict:
-                        self.class105_dict[(105, cur_tag)] = 1
-                    else:
-                        self.class105_dict[(105, cur_tag)] += 1
+        self._count_file(self._update_class105_dict)
+
+    def _update_class105_dict(self, words, tags, word_idx):
+        cur_tag = tags[word_idx]
+        if (105, cur_tag) not in self.class105_dict:
+            self.class105_dict[(105, cur_tag)] = 1
+        else:
+            self.class105_dict[(105, cur_tag)] += 1
 
     def set_class106_dict(self):
         """
             Create counts dict for class 106 features
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_tag = splited_words[word_idx].split('_')[1]
-                    prev_word = splited_words[word_idx - 1].split('_')[0] if word_idx != 0 else '*'
-                    if (106, prev_word, cur_tag) not in self.class106_dict:
-                        self.class106_dict[(106, prev_word, cur_tag)] = 1
-                    else:
-                        self.class106_dict[(106, prev_word, cur_tag)] += 1
+        self._count_file(self._update_class106_dict)
+
+    def _update_class106_dict(self, words, tags, word_idx):
+        cur_tag = tags[word_idx]
+        prev_word = words[word_idx - 1] if word_idx != 0 else '*'
+        if (106, prev_word, cur_tag) not in self.class106_dict:
+            self.class106_dict[(106, prev_word, cur_tag)] = 1
+        else:
+            self.class106_dict[(106, prev_word, cur_tag)] += 1
 
     def set_class107_dict(self):
         """
             Create counts dict for class 107 features
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_tag = splited_words[word_idx].split('_')[1]
-                    next_word = splited_words[word_idx + 1].split('_')[0] if \
-                        word_idx != len(splited_words) - 1 else 'STOP'
-                    if (107, next_word, cur_tag) not in self.class107_dict:
-                        self.class107_dict[(107, next_word, cur_tag)] = 1
-                    else:
-                        self.class107_dict[(107, next_word, cur_tag)] += 1
+        self._count_file(self._update_class107_dict)
+
+    def _update_class107_dict(self, words, tags, word_idx):
+        cur_tag = tags[word_idx]
+        next_word = words[word_idx + 1] if word_idx != len(words) - 1 else 'STOP'
+        if (107, next_word, cur_tag) not in self.class107_dict:
+            self.class107_dict[(107, next_word, cur_tag)] = 1
+        else:
+            self.class107_dict[(107, next_word, cur_tag)] += 1
 
     def set_class108_dict(self):
         """
@@ -210,88 +490,85 @@ class ClassStatistics:
                 by division to the final three chars is letters or not
                 and amount of '-' chars
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_tag = splited_words[word_idx].split('_')[1]
-                    cur_word = splited_words[word_idx].split('_')[0]
-                    hyphen_count = cur_word.count('-')
-                    if re.search(r'\d', cur_word):
-                        splited_cur_word = re.split('-', cur_word)
-                        no_category = True
-                        if re_match_words('^[0-9]+$', re.split('[-]|[,]|[.]|[:]|[\\\\]|[/]|[%]', cur_word)):
-                            if (108.1, cur_tag) not in self.class108_dict:
-                                self.class108_dict[(108.1, cur_tag)] = 1
-                            else:
-                                self.class108_dict[(108.1, cur_tag)] += 1
-                            no_category = False
-
-                        elif hyphen_count > 1 and re_match_letters_numbers(['^[A-Za-z]+$', '^[0-9]+$'],
-                                                                           splited_cur_word) \
-                                and not cur_word.startswith('mid'):
-                            if re.match('^[A-Za-z]+$', splited_cur_word[-1]):
-                                if (108.21, cur_tag) not in self.class108_dict:
-                                    self.class108_dict[(108.21, cur_tag)] = 1
-                                else:
-                                    self.class108_dict[(108.21, cur_tag)] += 1
-                            else:
-                                if (108.22, cur_tag) not in self.class108_dict:
-                                    self.class108_dict[(108.22, cur_tag)] = 1
-                                else:
-                                    self.class108_dict[(108.22, cur_tag)] += 1
-                            no_category = False
-
-                        elif hyphen_count == 1 and re_match_letters_numbers(['^[A-Za-z]+$', '^[0-9]+$'],
-                                                                            splited_cur_word):
-                            if re.match('^[a-z]$', cur_word[0]):
-                                if (108.31, cur_tag) not in self.class108_dict:
-                                    self.class108_dict[(108.31, cur_tag)] = 1
-                                else:
-                                    self.class108_dict[(108.31, cur_tag)] += 1
-                            else:
-                                if (108.32, cur_tag) not in self.class108_dict:
-                                    self.class108_dict[(108.32, cur_tag)] = 1
-                                else:
-                                    self.class108_dict[(108.32, cur_tag)] += 1
-                            no_category = False
-
-                        elif hyphen_count > 1 and re_match_numbers_letters(['^[0-9]+$', '^[A-Za-z]+$'],
-                                                                           splited_cur_word):
-                            if (108.4, cur_tag) not in self.class108_dict:
-                                self.class108_dict[(108.4, cur_tag)] = 1
-                            else:
-                                self.class108_dict[(108.4, cur_tag)] += 1
-                            no_category = False
-
-                        elif hyphen_count == 1 and re_match_numbers_letters(['^[0-9]+$', '^[A-Za-z]+$'],
-                                                                            splited_cur_word):
-                            if (108.5, cur_tag) not in self.class108_dict:
-                                self.class108_dict[(108.5, cur_tag)] = 1
-                            else:
-                                self.class108_dict[(108.5, cur_tag)] += 1
-                            no_category = False
-
-                        if re.match('^([a-zA-Z]*(-)?[0-9][0-9][0-9][0-9](s?))$|^(\'[0-9][0-9]s)$', cur_word):
-                            if (108.6, cur_tag) not in self.class108_dict:
-                                self.class108_dict[(108.6, cur_tag)] = 1
-                            else:
-                                self.class108_dict[(108.6, cur_tag)] += 1
-                            no_category = False
-
-                        if no_category:
-                            if re.match('^[A-Za-z]+$', splited_cur_word[-1]):
-                                if (108.7, hyphen_count, cur_tag) not in self.class108_dict:
-                                    self.class108_dict[(108.7, hyphen_count, cur_tag)] = 1
-                                else:
-                                    self.class108_dict[(108.7, hyphen_count, cur_tag)] += 1
-                            else:
-                                if (108.8, hyphen_count, cur_tag) not in self.class108_dict:
-                                    self.class108_dict[(108.8, hyphen_count, cur_tag)] = 1
-                                else:
-                                    self.class108_dict[(108.8, hyphen_count, cur_tag)] += 1
+        self._count_file(self._update_class108_dict)
+
+    def _update_class108_dict(self, words, tags, word_idx):
+        cur_tag = tags[word_idx]
+        cur_word = words[word_idx]
+        hyphen_count = cur_word.count('-')
+        if re.search(r'\d', cur_word):
+            splited_cur_word = re.split('-', cur_word)
+            no_category = True
+            if re_match_words('^[0-9]+$', re.split('[-]|[,]|[.]|[:]|[\\\\]|[/]|[%]', cur_word)):
+                if (108.1, cur_tag) not in self.class108_dict:
+                    self.class108_dict[(108.1, cur_tag)] = 1
+                else:
+                    self.class108_dict[(108.1, cur_tag)] += 1
+                no_category = False
+
+            elif hyphen_count > 1 and re_match_letters_numbers(['^[A-Za-z]+$', '^[0-9]+$'],
+                                                               splited_cur_word) \
+                    and not cur_word.startswith('mid'):
+                if re.match('^[A-Za-z]+$', splited_cur_word[-1]):
+                    if (108.21, cur_tag) not in self.class108_dict:
+                        self.class108_dict[(108.21, cur_tag)] = 1
+                    else:
+                        self.class108_dict[(108.21, cur_tag)] += 1
+                else:
+                    if (108.22, cur_tag) not in self.class108_dict:
+                        self.class108_dict[(108.22, cur_tag)] = 1
+                    else:
+                        self.class108_dict[(108.22, cur_tag)] += 1
+                no_category = False
+
+            elif hyphen_count == 1 and re_match_letters_numbers(['^[A-Za-z]+$', '^[0-9]+$'],
+                                                                splited_cur_word):
+                if re.match('^[a-z]$', cur_word[0]):
+                    if (108.31, cur_tag) not in self.class108_dict:
+                        self.class108_dict[(108.31, cur_tag)] = 1
+                    else:
+                        self.class108_dict[(108.31, cur_tag)] += 1
+                else:
+                    if (108.32, cur_tag) not in self.class108_dict:
+                        self.class108_dict[(108.32, cur_tag)] = 1
+                    else:
+                        self.class108_dict[(108.32, cur_tag)] += 1
+                no_category = False
+
+            elif hyphen_count > 1 and re_match_numbers_letters(['^[0-9]+$', '^[A-Za-z]+$'],
+                                                               splited_cur_word):
+                if (108.4, cur_tag) not in self.class108_dict:
+                    self.class108_dict[(108.4, cur_tag)] = 1
+                else:
+                    self.class108_dict[(108.4, cur_tag)] += 1
+                no_category = False
+
+            elif hyphen_count == 1 and re_match_numbers_letters(['^[0-9]+$', '^[A-Za-z]+$'],
+                                                                splited_cur_word):
+                if (108.5, cur_tag) not in self.class108_dict:
+                    self.class108_dict[(108.5, cur_tag)] = 1
+                else:
+                    self.class108_dict[(108.5, cur_tag)] += 1
+                no_category = False
+
+            if re.match('^([a-zA-Z]*(-)?[0-9][0-9][0-9][0-9](s?))$|^(\'[0-9][0-9]s)$', cur_word):
+                if (108.6, cur_tag) not in self.class108_dict:
+                    self.class108_dict[(108.6, cur_tag)] = 1
+                else:
+                    self.class108_dict[(108.6, cur_tag)] += 1
+                no_category = False
+
+            if no_category:
+                if re.match('^[A-Za-z]+$', splited_cur_word[-1]):
+                    if (108.7, hyphen_count, cur_tag) not in self.class108_dict:
+                        self.class108_dict[(108.7, hyphen_count, cur_tag)] = 1
+                    else:
+                        self.class108_dict[(108.7, hyphen_count, cur_tag)] += 1
+                else:
+                    if (108.8, hyphen_count, cur_tag) not in self.class108_dict:
+                        self.class108_dict[(108.8, hyphen_count, cur_tag)] = 1
+                    else:
+                        self.class108_dict[(108.8, hyphen_count, cur_tag)] += 1
 
     def set_class109_dict(self):
         """
@@ -311,109 +588,105 @@ class ClassStatistics:
             13. if just has some capital somewhere, and count number of '-' chars
             14. if word has capital after small letter
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_tag = splited_words[word_idx].split('_')[1]
-                    cur_word = splited_words[word_idx].split('_')[0]
-                    prev_word = splited_words[word_idx - 1].split('_')[0] if word_idx > 0 else '*'
-                    prev_tag = splited_words[word_idx - 1].split('_')[1] if word_idx > 0 else ''
-                    next_word = splited_words[word_idx + 1].split('_')[0] if word_idx + 1 < len(
-                        splited_words) - 1 else 'STOP'
-                    hyphen_count = cur_word.count('-')
-                    if word_idx > 0 and re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', next_word) \
-                            and re.match('^[A-Z]', prev_word):
-                        if (109.1, prev_tag, cur_tag) not in self.class109_dict:
-                            self.class109_dict[(109.1, prev_tag, cur_tag)] = 1
-                        else:
-                            self.class109_dict[(109.1, prev_tag, cur_tag)] += 1
-
-                    elif word_idx > 0 and re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', prev_word):
-                        if (109.2, prev_tag, cur_tag) not in self.class109_dict:
-                            self.class109_dict[(109.2, prev_tag, cur_tag)] = 1
-                        else:
-                            self.class109_dict[(109.2, prev_tag, cur_tag)] += 1
-
-                    elif word_idx > 0 and re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word):
-                        if (109.3, prev_tag, cur_tag) not in self.class109_dict:
-                            self.class109_dict[(109.3, prev_tag, cur_tag)] = 1
-                        else:
-                            self.class109_dict[(109.3, prev_tag, cur_tag)] += 1
-
-                    elif word_idx > 0 and re.match('^[A-Z]', cur_word) and re.match('^[A-Z]', next_word) \
-                            and re.match('^[A-Z]', prev_word):
-                        if (109.4, prev_tag, cur_tag) not in self.class109_dict:
-                            self.class109_dict[(109.4, prev_tag, cur_tag)] = 1
-                        else:
-                            self.class109_dict[(109.4, prev_tag, cur_tag)] += 1
-
-                    elif word_idx == 0 or (word_idx > 0 and prev_word in ['``', '.']):
-                        if re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', next_word) \
-                                and re.match('^[A-Z]', prev_word):
-                            if (109.5, prev_tag, cur_tag) not in self.class109_dict:
-                                self.class109_dict[(109.5, prev_tag, cur_tag)] = 1
-                            else:
-                                self.class109_dict[(109.5, prev_tag, cur_tag)] += 1
-
-                    elif word_idx == 0 or (word_idx > 0 and prev_word in ['``', '.']):
-                        if re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', next_word):
-                            if (109.6, prev_tag, cur_tag) not in self.class109_dict:
-                                self.class109_dict[(109.6, prev_tag, cur_tag)] = 1
-                            else:
-                                self.class109_dict[(109.6, prev_tag, cur_tag)] += 1
-
-                    elif word_idx == 0 or (word_idx > 0 and prev_word in ['``', '.']):
-                        if re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word):
-
-                            if (109.7, prev_tag, cur_tag) not in self.class109_dict:
-                                self.class109_dict[(109.7, prev_tag, cur_tag)] = 1
-                            else:
-                                self.class109_dict[(109.7, prev_tag, cur_tag)] += 1
-
-                    elif word_idx == 0 or (word_idx > 0 and prev_word in ['``', '.']):
-                        if re.match('^[A-Z]', cur_word) and re.match('^[A-Z]', next_word) \
-                                and re.match('^[A-Z]', prev_word):
-                            if (109.8, prev_tag, cur_tag) not in self.class109_dict:
-                                self.class109_dict[(109.8, prev_tag, cur_tag)] = 1
-                            else:
-                                self.class109_dict[(109.8, prev_tag, cur_tag)] += 1
-
-                    elif re.match('^[A-Z][A-Z]+$', cur_word) and re.match('^[A-Z][A-Z]+$', next_word) and re.match(
-                            '^[A-Z][A-Z]+$', prev_word):
-                        if (109.9, prev_tag, cur_tag) not in self.class109_dict:
-                            self.class109_dict[(109.9, prev_tag, cur_tag)] = 1
-                        else:
-                            self.class109_dict[(109.9, prev_tag, cur_tag)] += 1
-
-                    elif re.match('^[A-Z][A-Z]+$', cur_word) and re.match('^[A-Z][A-Z]+$', next_word):
-
-                        if (109.11, prev_tag, cur_tag) not in self.class109_dict:
-                            self.class109_dict[(109.11, prev_tag, cur_tag)] = 1
-                        else:
-                            self.class109_dict[(109.11, prev_tag, cur_tag)] += 1
-
-                    elif re.match('^[A-Z][A-Z]+$', cur_word):
-
-                        if (109.12, prev_tag, cur_tag) not in self.class109_dict:
-                            self.class109_dict[(109.12, prev_tag, cur_tag)] = 1
-                        else:
-                            self.class109_dict[(109.12, prev_tag, cur_tag)] += 1
-
-                    if re.match('[A-Z]', cur_word):
-
-                        if (109.13, hyphen_count, prev_tag, cur_tag) not in self.class109_dict:
-                            self.class109_dict[(109.13, hyphen_count, prev_tag, cur_tag)] = 1
-                        else:
-                            self.class109_dict[(109.13, hyphen_count, prev_tag, cur_tag)] += 1
-
-                    if re.match('(.*?)[a-z](.*?)[A-Z]', cur_word):
-                        if (109.14, prev_tag, cur_tag) not in self.class109_dict:
-                            self.class109_dict[(109.14, prev_tag, cur_tag)] = 1
-                        else:
-                            self.class109_dict[(109.14, prev_tag, cur_tag)] += 1
+        self._count_file(self._update_class109_dict)
+
+    def _update_class109_dict(self, words, tags, word_idx):
+        cur_tag = tags[word_idx]
+        cur_word = words[word_idx]
+        prev_word = words[word_idx - 1] if word_idx > 0 else '*'
+        prev_tag = tags[word_idx - 1] if word_idx > 0 else ''
+        next_word = words[word_idx + 1] if word_idx + 1 < len(words) - 1 else 'STOP'
+        hyphen_count = cur_word.count('-')
+        if word_idx > 0 and re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', next_word) \
+                and re.match('^[A-Z]', prev_word):
+            if (109.1, prev_tag, cur_tag) not in self.class109_dict:
+                self.class109_dict[(109.1, prev_tag, cur_tag)] = 1
+            else:
+                self.class109_dict[(109.1, prev_tag, cur_tag)] += 1
+
+        elif word_idx > 0 and re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', prev_word):
+            if (109.2, prev_tag, cur_tag) not in self.class109_dict:
+                self.class109_dict[(109.2, prev_tag, cur_tag)] = 1
+            else:
+                self.class109_dict[(109.2, prev_tag, cur_tag)] += 1
+
+        elif word_idx > 0 and re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word):
+            if (109.3, prev_tag, cur_tag) not in self.class109_dict:
+                self.class109_dict[(109.3, prev_tag, cur_tag)] = 1
+            else:
+                self.class109_dict[(109.3, prev_tag, cur_tag)] += 1
+
+        elif word_idx > 0 and re.match('^[A-Z]', cur_word) and re.match('^[A-Z]', next_word) \
+                and re.match('^[A-Z]', prev_word):
+            if (109.4, prev_tag, cur_tag) not in self.class109_dict:
+                self.class109_dict[(109.4, prev_tag, cur_tag)] = 1
+            else:
+                self.class109_dict[(109.4, prev_tag, cur_tag)] += 1
+
+        elif word_idx == 0 or (word_idx > 0 and prev_word in ['``', '.']):
+            if re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', next_word) \
+                    and re.match('^[A-Z]', prev_word):
+                if (109.5, prev_tag, cur_tag) not in self.class109_dict:
+                    self.class109_dict[(109.5, prev_tag, cur_tag)] = 1
+                else:
+                    self.class109_dict[(109.5, prev_tag, cur_tag)] += 1
+
+        elif word_idx == 0 or (word_idx > 0 and prev_word in ['``', '.']):
+            if re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', next_word):
+                if (109.6, prev_tag, cur_tag) not in self.class109_dict:
+                    self.class109_dict[(109.6, prev_tag, cur_tag)] = 1
+                else:
+                    self.class109_dict[(109.6, prev_tag, cur_tag)] += 1
+
+        elif word_idx == 0 or (word_idx > 0 and prev_word in ['``', '.']):
+            if re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word):
+
+                if (109.7, prev_tag, cur_tag) not in self.class109_dict:
+                    self.class109_dict[(109.7, prev_tag, cur_tag)] = 1
+                else:
+                    self.class109_dict[(109.7, prev_tag, cur_tag)] += 1
+
+        elif word_idx == 0 or (word_idx > 0 and prev_word in ['``', '.']):
+            if re.match('^[A-Z]', cur_word) and re.match('^[A-Z]', next_word) \
+                    and re.match('^[A-Z]', prev_word):
+                if (109.8, prev_tag, cur_tag) not in self.class109_dict:
+                    self.class109_dict[(109.8, prev_tag, cur_tag)] = 1
+                else:
+                    self.class109_dict[(109.8, prev_tag, cur_tag)] += 1
+
+        elif re.match('^[A-Z][A-Z]+$', cur_word) and re.match('^[A-Z][A-Z]+$', next_word) and re.match(
+                '^[A-Z][A-Z]+$', prev_word):
+            if (109.9, prev_tag, cur_tag) not in self.class109_dict:
+                self.class109_dict[(109.9, prev_tag, cur_tag)] = 1
+            else:
+                self.class109_dict[(109.9, prev_tag, cur_tag)] += 1
+
+        elif re.match('^[A-Z][A-Z]+$', cur_word) and re.match('^[A-Z][A-Z]+$', next_word):
+
+            if (109.11, prev_tag, cur_tag) not in self.class109_dict:
+                self.class109_dict[(109.11, prev_tag, cur_tag)] = 1
+            else:
+                self.class109_dict[(109.11, prev_tag, cur_tag)] += 1
+
+        elif re.match('^[A-Z][A-Z]+$', cur_word):
+
+            if (109.12, prev_tag, cur_tag) not in self.class109_dict:
+                self.class109_dict[(109.12, prev_tag, cur_tag)] = 1
+            else:
+                self.class109_dict[(109.12, prev_tag, cur_tag)] += 1
+
+        if re.match('[A-Z]', cur_word):
+
+            if (109.13, hyphen_count, prev_tag, cur_tag) not in self.class109_dict:
+                self.class109_dict[(109.13, hyphen_count, prev_tag, cur_tag)] = 1
+            else:
+                self.class109_dict[(109.13, hyphen_count, prev_tag, cur_tag)] += 1
+
+        if re.match('(.*?)[a-z](.*?)[A-Z]', cur_word):
+            if (109.14, prev_tag, cur_tag) not in self.class109_dict:
+                self.class109_dict[(109.14, prev_tag, cur_tag)] = 1
+            else:
+                self.class109_dict[(109.14, prev_tag, cur_tag)] += 1
 
     def set_class110_dict(self):
         """
@@ -432,104 +705,101 @@ class ClassStatistics:
             110.7. if the word is from common pattern of 'JJ' tag (number + hyphen + letters)
             110.9. if the word contains dot (common pattern of 'NNP' tag)
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_tag = splited_words[word_idx].split('_')[1]
-                    cur_word = splited_words[word_idx].split('_')[0]
-                    if len(cur_word) >= 13:
-                        if re.search('ally$', cur_word) or re.search('ely$', cur_word) or \
-                                re.search('tly$', cur_word):
-                            if (110.12, cur_tag) not in self.class110_dict:  # RB tag
-                                self.class110_dict[(110.12, cur_tag)] = 1
-                            else:
-                                self.class110_dict[(110.12, cur_tag)] += 1
-
-                        elif re.search('tant$', cur_word) or \
-                                re.search('cal$', cur_word) or \
-                                re.search('ic$', cur_word) or \
-                                re.search('ive$', cur_word) or \
-                                re.search('nal$', cur_word) or \
-                                re.search('-dependent$', cur_word) or \
-                                re.search('-sensitive$', cur_word) or \
-                                re.search('-specific$', cur_word) or \
-                                re.search('tly$', cur_word):
-                            if re.match('^[A-Z]$', cur_word[0]):  # NNP tag
-                                if (110.135, cur_tag) not in self.class110_dict:
-                                    self.class110_dict[(110.135, cur_tag)] = 1
-                                else:
-                                    self.class110_dict[(110.135, cur_tag)] += 1
-                        elif not (re.search('[\-]', cur_word)):  # NN + NNS tags
-                            if cur_word[-1] == 's' and not \
-                                    re.search('ness$', cur_word) and not re.match('^[A-Z]$', cur_word[0]):
-                                if (110.2, cur_tag) not in self.class110_dict:
-                                    self.class110_dict[(110.2, cur_tag)] = 1
-                                else:
-                                    self.class110_dict[(110.2, cur_tag)] += 1
-                    if re.match('^[0-9\-,.:]*[][0-9]+[0-9\-,.:]*$', cur_word) or (cur_word in ["II", "III", "IV"] or
-                                                                                  re.match(
-                                                                                      '^[0-9\-.]+[L][R][B][0-9\-.]+[R][R][B][0-9\-.]+$',
-                                                                                      cur_word)):  # CD tag
-                        if cur_word in ["II", "III", "IV"]:  # in big model its NNP and not CD
-                            if (110.35, cur_tag) not in self.class110_dict:
-                                self.class110_dict[(110.35, cur_tag)] = 1
-                            else:
-                                self.class110_dict[(110.35, cur_tag)] += 1
-
-                        elif (110.3, cur_tag) not in self.class110_dict:
-                            self.class110_dict[(110.3, cur_tag)] = 1
-                        else:
-                            self.class110_dict[(110.3, cur_tag)] += 1
-
-                    elif (re.search('[\-]', cur_word) and not re.match('^[A-Z]', cur_word.split('-')[-1])) and \
-                            (re.search('ing$', cur_word.split('-')[-1]) or
-                             re.search('ed$', cur_word.split('-')[-1]) or
-                             re.search('ic$', cur_word.split('-')[-1]) or
-                             re.search('age$', cur_word.split('-')[-1]) or
-                             re.search('like$', cur_word.split('-')[-1]) or
-                             re.search('ive$', cur_word.split('-')[-1]) or
-                             re.search('ven$', cur_word.split('-')[-1]) or
-                             re.search('^pre', cur_word.split('-')[0]) or
-                             re.search('^anti', cur_word.split('-')[0]) or
-                             re.search('er$', cur_word.split('-')[0])):  # JJ tag. also ~40 NN get in.
-                        if (110.4, cur_tag) not in self.class110_dict:
-                            self.class110_dict[(110.4, cur_tag)] = 1
-                        else:
-                            self.class110_dict[(110.4, cur_tag)] += 1
-
-                    elif cur_word not in ["-LCB-", "-RCB-", "-LRB-", "-RRB-", "--", "...", "I", "A", ",", ".", ":"]:
-                        if (re.match('^[a-z]*[A-Z\-0-9.,]+[s]$', cur_word) and  # NNS tag
-                            len(cur_word) != 2) and not \
-                                re.match('^([a-zA-Z]*(-)?[0-9][0-9][0-9][0-9](s?))$|^([a-zA-Z]*(-)?[0-9][0-9]s)$',
-                                         cur_word):
-                            if (110.5, cur_tag) not in self.class110_dict:
-                                self.class110_dict[(110.5, cur_tag)] = 1
-                            else:
-                                self.class110_dict[(110.5, cur_tag)] += 1
-
-                        if re.match('^[A-Z\-0-9.,]+$', cur_word) or \
-                                re.search('[a-z\-][A-Z]', cur_word) or \
-                                re.match('^[A-Za-z][\-][a-z]+$', cur_word):  # NNP tag
-                            if (110.6, cur_tag) not in self.class110_dict:
-                                self.class110_dict[(110.6, cur_tag)] = 1
-                            else:
-                                self.class110_dict[(110.6, cur_tag)] += 1
-
-                        if re.match('^[0-9\-.,]+[\-][a-zA-Z]+$', cur_word):  # JJ tag
-                            if (110.7, cur_tag) not in self.class110_dict:
-                                self.class110_dict[(110.7, cur_tag)] = 1
-                            else:
-                                self.class110_dict[(110.7, cur_tag)] += 1
-
-                        if re.search('\.$', cur_word) and cur_word not in [".",
-                                                                           "No."]:  # in big model its NNP, and not FW
-                            if (110.9, cur_tag) not in self.class110_dict:
-                                self.class110_dict[(110.9, cur_tag)] = 1
-                            else:
-                                self.class110_dict[(110.9, cur_tag)] += 1
+        self._count_file(self._update_class110_dict)
+
+    def _update_class110_dict(self, words, tags, word_idx):
+        cur_tag = tags[word_idx]
+        cur_word = words[word_idx]
+        if len(cur_word) >= 13:
+            if re.search('ally$', cur_word) or re.search('ely$', cur_word) or \
+                    re.search('tly$', cur_word):
+                if (110.12, cur_tag) not in self.class110_dict:  # RB tag
+                    self.class110_dict[(110.12, cur_tag)] = 1
+                else:
+                    self.class110_dict[(110.12, cur_tag)] += 1
+
+            elif re.search('tant$', cur_word) or \
+                    re.search('cal$', cur_word) or \
+                    re.search('ic$', cur_word) or \
+                    re.search('ive$', cur_word) or \
+                    re.search('nal$', cur_word) or \
+                    re.search('-dependent$', cur_word) or \
+                    re.search('-sensitive$', cur_word) or \
+                    re.search('-specific$', cur_word) or \
+                    re.search('tly$', cur_word):
+                if re.match('^[A-Z]$', cur_word[0]):  # NNP tag
+                    if (110.135, cur_tag) not in self.class110_dict:
+                        self.class110_dict[(110.135, cur_tag)] = 1
+                    else:
+                        self.class110_dict[(110.135, cur_tag)] += 1
+            elif not (re.search('[\-]', cur_word)):  # NN + NNS tags
+                if cur_word[-1] == 's' and not \
+                        re.search('ness$', cur_word) and not re.match('^[A-Z]$', cur_word[0]):
+                    if (110.2, cur_tag) not in self.class110_dict:
+                        self.class110_dict[(110.2, cur_tag)] = 1
+                    else:
+                        self.class110_dict[(110.2, cur_tag)] += 1
+        if re.match('^[0-9\-,.:]*[][0-9]+[0-9\-,.:]*$', cur_word) or (cur_word in ["II", "III", "IV"] or
+                                                                      re.match(
+                                                                          '^[0-9\-.]+[L][R][B][0-9\-.]+[R][R][B][0-9\-.]+$',
+                                                                          cur_word)):  # CD tag
+            if cur_word in ["II", "III", "IV"]:  # in big model its NNP and not CD
+                if (110.35, cur_tag) not in self.class110_dict:
+                    self.class110_dict[(110.35, cur_tag)] = 1
+                else:
+                    self.class110_dict[(110.35, cur_tag)] += 1
+
+            elif (110.3, cur_tag) not in self.class110_dict:
+                self.class110_dict[(110.3, cur_tag)] = 1
+            else:
+                self.class110_dict[(110.3, cur_tag)] += 1
+
+        elif (re.search('[\-]', cur_word) and not re.match('^[A-Z]', cur_word.split('-')[-1])) and \
+                (re.search('ing$', cur_word.split('-')[-1]) or
+                 re.search('ed$', cur_word.split('-')[-1]) or
+                 re.search('ic$', cur_word.split('-')[-1]) or
+                 re.search('age$', cur_word.split('-')[-1]) or
+                 re.search('like$', cur_word.split('-')[-1]) or
+                 re.search('ive$', cur_word.split('-')[-1]) or
+                 re.search('ven$', cur_word.split('-')[-1]) or
+                 re.search('^pre', cur_word.split('-')[0]) or
+                 re.search('^anti', cur_word.split('-')[0]) or
+                 re.search('er$', cur_word.split('-')[0])):  # JJ tag. also ~40 NN get in.
+            if (110.4, cur_tag) not in self.class110_dict:
+                self.class110_dict[(110.4, cur_tag)] = 1
+            else:
+                self.class110_dict[(110.4, cur_tag)] += 1
+
+        elif cur_word not in ["-LCB-", "-RCB-", "-LRB-", "-RRB-", "--", "...", "I", "A", ",", ".", ":"]:
+            if (re.match('^[a-z]*[A-Z\-0-9.,]+[s]$', cur_word) and  # NNS tag
+                len(cur_word) != 2) and not \
+                    re.match('^([a-zA-Z]*(-)?[0-9][0-9][0-9][0-9](s?))$|^([a-zA-Z]*(-)?[0-9][0-9]s)$',
+                             cur_word):
+                if (110.5, cur_tag) not in self.class110_dict:
+                    self.class110_dict[(110.5, cur_tag)] = 1
+                else:
+                    self.class110_dict[(110.5, cur_tag)] += 1
+
+            if re.match('^[A-Z\-0-9.,]+$', cur_word) or \
+                    re.search('[a-z\-][A-Z]', cur_word) or \
+                    re.match('^[A-Za-z][\-][a-z]+$', cur_word):  # NNP tag
+                if (110.6, cur_tag) not in self.class110_dict:
+                    self.class110_dict[(110.6, cur_tag)] = 1
+                else:
+                    self.class110_dict[(110.6, cur_tag)] += 1
+
+            if re.match('^[0-9\-.,]+[\-][a-zA-Z]+$', cur_word):  # JJ tag
+                if (110.7, cur_tag) not in self.class110_dict:
+                    self.class110_dict[(110.7, cur_tag)] = 1
+                else:
+                    self.class110_dict[(110.7, cur_tag)] += 1
+
+            if re.search('\.$', cur_word) and cur_word not in [".",
+                                                               "No."]:  # in big model its NNP, and not FW
+                if (110.9, cur_tag) not in self.class110_dict:
+                    self.class110_dict[(110.9, cur_tag)] = 1
+                else:
+                    self.class110_dict[(110.9, cur_tag)] += 1
 
     def set_class111_dict(self):
         """
@@ -554,140 +824,137 @@ class ClassStatistics:
             110.92. if the word contains dot (common pattern of 'FW' tag)
             110.93. if the word contains dot (common pattern of 'LS' tag)
         """
-        with open(self.file_path) as f:
-            for line in f:
-                splited_words = re.split(' |[\n]', line)
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                for word_idx in range(len(splited_words)):
-                    cur_tag = splited_words[word_idx].split('_')[1]
-                    cur_word = splited_words[word_idx].split('_')[0]
-                    if len(cur_word) >= 13:
-                        if re.search('ing$', cur_word) and not (re.search('[\-]', cur_word)):
-                            if (111.11, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.11, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.11, cur_tag)] += 1
-
-                        elif re.search('ed$', cur_word) and not (re.search('[\-]', cur_word)):
-                            if (111.14, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.14, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.14, cur_tag)] += 1
-
-                        elif re.search('ally$', cur_word) or re.search('ely$', cur_word) or \
-                                re.search('tly$', cur_word):
-                            if (111.12, cur_tag) not in self.class111_dict:  # RB tag
-                                self.class111_dict[(111.12, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.12, cur_tag)] += 1
-
-                        elif re.search('tant$', cur_word) or \
-                                re.search('cal$', cur_word) or \
-                                re.search('ic$', cur_word) or \
-                                re.search('ive$', cur_word) or \
-                                re.search('nal$', cur_word) or \
-                                re.search('-dependent$', cur_word) or \
-                                re.search('-sensitive$', cur_word) or \
-                                re.search('-specific$', cur_word) or \
-                                re.search('tly$', cur_word):  # JJ tag
-                            if (111.13, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.13, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.13, cur_tag)] += 1
-                        else:  # NN + NNS tags
-                            if cur_word[-1] == 's':
-                                if (111.2, cur_tag) not in self.class111_dict:
-                                    self.class111_dict[(111.2, cur_tag)] = 1
-                                else:
-                                    self.class111_dict[(111.2, cur_tag)] += 1
-
-                            if (111.1, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.1, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.1, cur_tag)] += 1
-
-                    if re.match('^[0-9\-,.:]*[][0-9]+[0-9\-,.:]*$', cur_word) or (cur_word in ["II", "III", "IV"] or
-                                                                                  re.match(
-                                                                                      '^[0-9\-.]+[L][R][B][0-9\-.]+[R][R][B][0-9\-.]+$',
-                                                                                      cur_word)):  # CD tag
-                        if (111.3, cur_tag) not in self.class111_dict:
-                            self.class111_dict[(111.3, cur_tag)] = 1
-                        else:
-                            self.class111_dict[(111.3, cur_tag)] += 1
-
-                    elif ((re.search('[\-]', cur_word) and
-                           (re.search('ing$', cur_word.split('-')[-1]) or
-                            re.search('ed$', cur_word.split('-')[-1]) or
-                            re.search('ic$', cur_word.split('-')[-1]) or
-                            re.search('age$', cur_word.split('-')[-1]) or
-                            re.search('like$', cur_word.split('-')[-1]) or
-                            re.search('ive$', cur_word.split('-')[-1]) or
-                            re.search('ven$', cur_word.split('-')[-1]) or
-                            re.search('^pre', cur_word.split('-')[0]) or
-                            re.search('^anti', cur_word.split('-')[0]) or
-                            re.search('er$', cur_word.split('-')[0]))) or
-                          re.search('kDa$', cur_word)):  # JJ tag
-                        if (111.4, cur_tag) not in self.class111_dict:
-                            self.class111_dict[(111.4, cur_tag)] = 1
-                        else:
-                            self.class111_dict[(111.4, cur_tag)] += 1
+        self._count_file(self._update_class111_dict)
+
+    def _update_class111_dict(self, words, tags, word_idx):
+        cur_tag = tags[word_idx]
+        cur_word = words[word_idx]
+        if len(cur_word) >= 13:
+            if re.search('ing$', cur_word) and not (re.search('[\-]', cur_word)):
+                if (111.11, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.11, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.11, cur_tag)] += 1
+
+            elif re.search('ed$', cur_word) and not (re.search('[\-]', cur_word)):
+                if (111.14, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.14, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.14, cur_tag)] += 1
 
+            elif re.search('ally$', cur_word) or re.search('ely$', cur_word) or \
+                    re.search('tly$', cur_word):
+                if (111.12, cur_tag) not in self.class111_dict:  # RB tag
+                    self.class111_dict[(111.12, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.12, cur_tag)] += 1
+
+            elif re.search('tant$', cur_word) or \
+                    re.search('cal$', cur_word) or \
+                    re.search('ic$', cur_word) or \
+                    re.search('ive$', cur_word) or \
+                    re.search('nal$', cur_word) or \
+                    re.search('-dependent$', cur_word) or \
+                    re.search('-sensitive$', cur_word) or \
+                    re.search('-specific$', cur_word) or \
+                    re.search('tly$', cur_word):  # JJ tag
+                if (111.13, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.13, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.13, cur_tag)] += 1
+            else:  # NN + NNS tags
+                if cur_word[-1] == 's':
+                    if (111.2, cur_tag) not in self.class111_dict:
+                        self.class111_dict[(111.2, cur_tag)] = 1
                     else:
-                        if re.match('^[a-z]*[A-Z\-0-9.,]+[s]$', cur_word):  # NNS tag
-                            if (111.5, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.5, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.5, cur_tag)] += 1
-
-                        if (re.match('^[A-Z\-0-9.,]+$', cur_word) and cur_word not in ["I", "A", ",", ".", ":"]) or \
-                                re.search('[a-z\-][A-Z]', cur_word) or \
-                                re.match('^[A-Za-z][\-][a-z]+$', cur_word) or \
-                                re.match('^[a-z\-]+[0-9]+$', cur_word) or \
-                                re.search('coid$', cur_word) or \
-                                re.search('ness$', cur_word):  # NN tag
-                            if (111.6, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.6, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.6, cur_tag)] += 1
-
-                        if re.match('^[0-9\-.,]+[\-][a-zA-Z]+$', cur_word):  # might be JJ tag
-                            if (111.7, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.7, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.7, cur_tag)] += 1
-
-                        if re.match('^[A-Z]?[a-z]+[\-][0-9\-.,]+$', cur_word):  # might be NN tag
-                            if (111.8, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.8, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.8, cur_tag)] += 1
-
-                        if re.search('\.$', cur_word) and cur_word != ".":  # might be FW tag, but not only
-                            if (111.9, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.9, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.9, cur_tag)] += 1
-
-                        if cur_word in ['Treponema', 'cerevisiae', 'pallidum', 'Borrelia', 'burgdorferi',
-                                        'vitro', 'vivo', 'i.e.', 'e.g.']:  # FW tag
-                            if (111.92, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.92, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.92, cur_tag)] += 1
-                        if cur_word in ['in', 'In'] and word_idx != len(splited_words) - 1:  # FW tag
-                            next_word = splited_words[word_idx + 1].split('_')[0]
-                            if next_word in ['vitro', 'vivo']:
-                                if (111.92, cur_tag) not in self.class111_dict:
-                                    self.class111_dict[(111.92, cur_tag)] = 1
-                                else:
-                                    self.class111_dict[(111.92, cur_tag)] += 1
-
-                        if cur_word in ['i', 'ii', 'iii', 'iv']:  # LS tag
-                            if (111.93, cur_tag) not in self.class111_dict:
-                                self.class111_dict[(111.93, cur_tag)] = 1
-                            else:
-                                self.class111_dict[(111.93, cur_tag)] += 1
+                        self.class111_dict[(111.2, cur_tag)] += 1
+
+                if (111.1, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.1, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.1, cur_tag)] += 1
+
+        if re.match('^[0-9\-,.:]*[][0-9]+[0-9\-,.:]*$', cur_word) or (cur_word in ["II", "III", "IV"] or
+                                                                      re.match(
+                                                                          '^[0-9\-.]+[L][R][B][0-9\-.]+[R][R][B][0-9\-.]+$',
+                                                                          cur_word)):  # CD tag
+            if (111.3, cur_tag) not in self.class111_dict:
+                self.class111_dict[(111.3, cur_tag)] = 1
+            else:
+                self.class111_dict[(111.3, cur_tag)] += 1
+
+        elif ((re.search('[\-]', cur_word) and
+               (re.search('ing$', cur_word.split('-')[-1]) or
+                re.search('ed$', cur_word.split('-')[-1]) or
+                re.search('ic$', cur_word.split('-')[-1]) or
+                re.search('age$', cur_word.split('-')[-1]) or
+                re.search('like$', cur_word.split('-')[-1]) or
+                re.search('ive$', cur_word.split('-')[-1]) or
+                re.search('ven$', cur_word.split('-')[-1]) or
+                re.search('^pre', cur_word.split('-')[0]) or
+                re.search('^anti', cur_word.split('-')[0]) or
+                re.search('er$', cur_word.split('-')[0]))) or
+              re.search('kDa$', cur_word)):  # JJ tag
+            if (111.4, cur_tag) not in self.class111_dict:
+                self.class111_dict[(111.4, cur_tag)] = 1
+            else:
+                self.class111_dict[(111.4, cur_tag)] += 1
+
+        else:
+            if re.match('^[a-z]*[A-Z\-0-9.,]+[s]$', cur_word):  # NNS tag
+                if (111.5, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.5, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.5, cur_tag)] += 1
+
+            if (re.match('^[A-Z\-0-9.,]+$', cur_word) and cur_word not in ["I", "A", ",", ".", ":"]) or \
+                    re.search('[a-z\-][A-Z]', cur_word) or \
+                    re.match('^[A-Za-z][\-][a-z]+$', cur_word) or \
+                    re.match('^[a-z\-]+[0-9]+$', cur_word) or \
+                    re.search('coid$', cur_word) or \
+                    re.search('ness$', cur_word):  # NN tag
+                if (111.6, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.6, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.6, cur_tag)] += 1
+
+            if re.match('^[0-9\-.,]+[\-][a-zA-Z]+$', cur_word):  # might be JJ tag
+                if (111.7, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.7, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.7, cur_tag)] += 1
+
+            if re.match('^[A-Z]?[a-z]+[\-][0-9\-.,]+$', cur_word):  # might be NN tag
+                if (111.8, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.8, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.8, cur_tag)] += 1
+
+            if re.search('\.$', cur_word) and cur_word != ".":  # might be FW tag, but not only
+                if (111.9, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.9, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.9, cur_tag)] += 1
+
+            if cur_word in ['Treponema', 'cerevisiae', 'pallidum', 'Borrelia', 'burgdorferi',
+                            'vitro', 'vivo', 'i.e.', 'e.g.']:  # FW tag
+                if (111.92, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.92, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.92, cur_tag)] += 1
+            if cur_word in ['in', 'In'] and word_idx != len(words) - 1:  # FW tag
+                next_word = words[word_idx + 1]
+                if next_word in ['vitro', 'vivo']:
+                    if (111.92, cur_tag) not in self.class111_dict:
+                        self.class111_dict[(111.92, cur_tag)] = 1
+                    else:
+                        self.class111_dict[(111.92, cur_tag)] += 1
+
+            if cur_word in ['i', 'ii', 'iii', 'iv']:  # LS tag
+                if (111.93, cur_tag) not in self.class111_dict:
+                    self.class111_dict[(111.93, cur_tag)] = 1
+                else:
+                    self.class111_dict[(111.93, cur_tag)] += 1
 
 
 class Feature2Id:
@@ -737,6 +1004,8 @@ class Feature2Id:
         self.class111_feature_index_dict = OrderedDict()
         self.n_class111 = 0
 
+        self.templates_index_dict = dict()  # {key without the tag: (tags indices, features indices)}
+
     def set_index_class100(self, threshold=0):
         """
             Extract out of text all word/tag pairs
@@ -845,6 +1114,17 @@ class Feature2Id:
                 self.n_class111 += 1
         self.n_total_features += self.n_class111
 
+    def set_all_classes_index(self, classes):
+        """
+            Set the indices of all the given classes (default thresholds) and build the final features dictionary.
+            same as calling set_index_class<n> for every class one after another and then
+            build_all_classes_feature_index_dict
+            :param classes: list of classes numbers e.g. [100, 101, ..., 110]
+        """
+        for n in classes:
+            getattr(self, f'set_index_class{n}')()
+        self.build_all_classes_feature_index_dict()
+
     def build_all_classes_feature_index_dict(self):
         self.all_feature_index_dict.update(self.class100_feature_index_dict)
         self.all_feature_index_dict.update(self.class101_feature_index_dict)
@@ -858,6 +1138,139 @@ class Feature2Id:
         self.all_feature_index_dict.update(self.class109_feature_index_dict)
         self.all_feature_index_dict.update(self.class110_feature_index_dict)
         self.all_feature_index_dict.update(self.class111_feature_index_dict)
+        self.build_templates_index_dict()
+
+    def build_templates_index_dict(self):
+        """
+            Group the final features by their key without the tag (template), for extracting the features of all
+            the tags at once (see f_xi_all_y)
+            {template: ((tag index in Y, ...), (feature index, ...))}
+        """
+        tag_to_index = {tag: y for y, tag in enumerate(self.feature_statistics.Y)}
+        templates_index_dict = dict()
+        for key, index in self.all_feature_index_dict.items():
+            template_tags, template_indices = templates_index_dict.setdefault(key[:-1], (list(), list()))
+            template_tags.append(tag_to_index[key[-1]])
+            template_indices.append(index)
+        self.templates_index_dict = {template: (tuple(template_tags), tuple(template_indices))
+                                     for template, (template_tags, template_indices) in templates_index_dict.items()}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'templates_index_dict' not in state:  # objects saved before the templates index existed
+            self.build_templates_index_dict()
+
+
+class HashedFeature2Id:
+    """
+    hashed features mode - every feature (template + (tag, )) is mapped by its hash to one of 2 ** n_bits weights,
+    no key is stored. a feature is fired only if its bucket was seen in training with the given classes (thresholds
+    are not applied - every seen feature is used), so the number of weights and the memory of the index are fixed
+    whatever the train corpus size. features that share a bucket share a weight (see collision_statistics).
+    used in place of Feature2Id - it has the same templates_index_dict lookups (the index is the object itself)
+    """
+    # fibonacci hashing multipliers (64 bits) for the buckets and the fingerprints of the features
+    BUCKET_MULTIPLIER = 0x9E3779B97F4A7C15
+    FINGERPRINT_MULTIPLIER = 0xC2B2AE3D27D4EB4F
+
+    def __init__(self, feature_statistics: ClassStatistics, n_bits=18, classes=MODEL_1_CLASSES):
+        """
+        :param feature_statistics: ClassStatistics object, only its tags (Y) are used (see ClassStatistics.set_Y)
+        :param n_bits: the number of weights is 2 ** n_bits
+        :param classes: features classes of the model e.g: MODEL_1_CLASSES
+        """
+        self.feature_statistics = feature_statistics
+        self.n_bits = n_bits
+        self.n_total_features = 2 ** n_bits
+        self.classes = set(classes)
+        self.templates_index_dict = self
+
+        # high 32 bits of the hashed value of every tag, the template hash is in the low 32 bits
+        self.tags_keys = [zlib.crc32(tag.encode('utf-8')) << 32 for tag in feature_statistics.Y]
+        self.tags_keys_array = np.array(self.tags_keys, dtype=np.uint64)
+        self.tags_range = np.arange(len(feature_statistics.Y), dtype=np.int64)
+
+        self.seen = np.zeros(self.n_total_features, dtype=bool)  # buckets of the features seen in training
+        self.fingerprints = np.zeros(self.n_total_features, dtype=np.uint32)  # for collision_statistics only
+        self.collided = np.zeros(self.n_total_features, dtype=bool)
+
+    def _template_hash(self, template):
+        """
+        :return: tuple or None - (hash, key bytes) of the template, None if its class is not in the model
+        """
+        if int(template[0]) not in self.classes:
+            return None
+        key = _encode_template(template).encode('utf-8')
+        return zlib.crc32(key), key
+
+    def set_seen_features(self, corpus: Corpus):
+        """
+            Mark the buckets of all the features of the train corpus (the features of the words with their true tags)
+            :param corpus: train Corpus
+        """
+        tag_to_index = {tag: y for y, tag in enumerate(self.feature_statistics.Y)}
+        shift = 64 - self.n_bits
+        for words, tags in corpus.sentences():
+            for i in range(len(words)):
+                tag_key = self.tags_keys[tag_to_index[tags[i]]]
+                class100_templates, templates = f_xi_templates(words, tags, i)
+                for template in [class100_templates[0]] + templates:  # as counted, class 100 is the word as is
+                    template_hash = self._template_hash(template)
+                    if template_hash is None:
+                        continue
+                    base, key = template_hash
+                    bucket = (((tag_key ^ base) * self.BUCKET_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> shift
+                    fingerprint = ((((tag_key ^ zlib.adler32(key)) * self.FINGERPRINT_MULTIPLIER)
+                                    & 0xFFFFFFFFFFFFFFFF) >> 32) | 1
+                    if not self.seen[bucket]:
+                        self.seen[bucket] = True
+                        self.fingerprints[bucket] = fingerprint
+                    elif self.fingerprints[bucket] != fingerprint:
+                        self.collided[bucket] = True
+
+    def collision_statistics(self):
+        """
+        :return: dict - number of weights, number of used buckets, number of buckets shared by more than one seen
+                 feature (features with equal fingerprints are counted as one) and the load factor
+        """
+        n_used = int(np.count_nonzero(self.seen))
+        return {'n_weights': self.n_total_features, 'n_used': n_used,
+                'n_collided': int(np.count_nonzero(self.collided)), 'load_factor': n_used / self.n_total_features}
+
+    def get(self, template, default=None):
+        """
+        :return: (tags indices, features indices) of the seen features of the template, default if there are none
+        """
+        template_hash = self._template_hash(template)
+        if template_hash is None:
+            return default
+        buckets = ((self.tags_keys_array ^ np.uint64(template_hash[0])) * np.uint64(self.BUCKET_MULTIPLIER)) \
+            >> np.uint64(64 - self.n_bits)
+        buckets = buckets.astype(np.int64)
+        seen = self.seen[buckets]
+        if not seen.any():
+            return default
+        return self.tags_range[seen], buckets[seen]
+
+    def __contains__(self, template):
+        return self.get(template) is not None
+
+    def __getitem__(self, template):
+        value = self.get(template)
+        if value is None:
+            raise KeyError(template)
+        return value
+
+    def __getstate__(self):
+        # fingerprints are needed only for the collision statistics of the training
+        state = self.__dict__.copy()
+        state['templates_index_dict'] = None
+        state['fingerprints'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.templates_index_dict = self
 
 
 class ConfusionMatrix:
@@ -881,6 +1294,11 @@ class ConfusionMatrix:
         :param high: parameter for normalization
         :return: color map to apply
         """
+        # visualization modules are imported only when used, they are slow to import
+        import matplotlib.pyplot as plt
+        from matplotlib import colors
+        import seaborn as sns
+
         cmap = sns.light_palette("red", as_cmap=True)
         if self.m is None:
             self.m = s.min().min()
@@ -929,6 +1347,8 @@ class ConfusionMatrix:
         :param colored: if True will save .html file with colored confusion matrix
         :return: None
         """
+        import pandas as pd
+
         # create dict for wrong tagging in the format ->  true_tag : total amount of mistakes
         conf_matrix_dict_wrong_tagging = dict()
         for (true, pred), amount_mistakes in self.conf_mat.items():
@@ -986,6 +1406,43 @@ class ConfusionMatrix:
             html.write('<font size="10" face="Courier New" >' + style.render() + '</font>')
 
 
+# Precompiled patterns for the words predicates of classes 108 - 111 (as used by f_xi_yi)
+RE_DIGIT = re.compile(r'\d')
+RE_NUMBER_SEPARATORS = re.compile(r'[-]|[,]|[.]|[:]|[\\]|[/]|[%]')
+RE_NUMBER_INNER_SEPARATORS = re.compile(r'[,]|[:]|[\\]|[/]|[%]')
+RE_ONLY_NUMBERS = re.compile('^[0-9]+$')
+RE_ONLY_LETTERS = re.compile('^[A-Za-z]+$')
+RE_LOWER_CHAR = re.compile('^[a-z]$')
+RE_YEAR = re.compile('^([a-zA-Z]*(-)?[0-9][0-9][0-9][0-9](s?))$|^(\'[0-9][0-9]s)$')
+RE_STARTS_CAPITAL = re.compile('^[A-Z]')
+RE_CAPITAL_WITH_SEPARATOR = re.compile('^[A-Z](.*?)[-.]+(.*?)')
+RE_ONLY_CAPITALS = re.compile('^[A-Z][A-Z]+$')
+RE_LOWER_THEN_CAPITAL = re.compile('(.*?)[a-z](.*?)[A-Z]')
+RE_CAPITAL_CHAR = re.compile('^[A-Z]$')
+RE_HYPHEN = re.compile(r'[\-]')
+RE_RB_SUFFIX = re.compile('ally$|ely$|tly$')
+RE_JJ_SUFFIX = re.compile('tant$|cal$|ic$|ive$|nal$|-dependent$|-sensitive$|-specific$|tly$')
+RE_NESS_SUFFIX = re.compile('ness$')
+RE_CD = re.compile(r'^[0-9\-,.:]*[0-9]+[0-9\-,.:]*$')
+RE_CD_BRACKETS = re.compile(r'^[0-9\-.]+[L][R][B][0-9\-.]+[R][R][B][0-9\-.]+$')
+RE_HYPHEN_LAST_JJ_SUFFIX = re.compile('ing$|ed$|ic$|age$|like$|ive$|ven$')
+RE_HYPHEN_FIRST_JJ_PATTERN = re.compile('^pre|^anti|er$')
+RE_NNS = re.compile(r'^[a-z]*[A-Z\-0-9.,]+[s]$')
+RE_NNS_YEAR = re.compile('^([a-zA-Z]*(-)?[0-9][0-9][0-9][0-9](s?))$|^([a-zA-Z]*(-)?[0-9][0-9]s)$')
+RE_CAPITALS_NUMBERS = re.compile(r'^[A-Z\-0-9.,]+$')
+RE_NNP_INNER_CAPITAL = re.compile(r'[a-z\-][A-Z]')
+RE_NNP_HYPHEN = re.compile(r'^[A-Za-z][\-][a-z]+$')
+RE_NUMBERS_HYPHEN_LETTERS = re.compile(r'^[0-9\-.,]+[\-][a-zA-Z]+$')
+RE_ENDS_WITH_DOT = re.compile(r'\.$')
+RE_ING_SUFFIX = re.compile('ing$')
+RE_ED_SUFFIX = re.compile('ed$')
+RE_KDA_SUFFIX = re.compile('kDa$')
+RE_INNER_CAPITAL = re.compile('[a-z][A-Z]')
+RE_NN_HYPHEN = re.compile(r'[A-Za-z][\-][A-Za-z0-9.,\-]+$')
+RE_COID_OR_NESS_SUFFIX = re.compile('coid$|ness$')
+RE_LETTERS_HYPHEN_NUMBERS = re.compile(r'^[A-Z]?[a-z]+[\-][0-9\-.,]+$')
+
+
 # Auxiliary function for class f108
 def re_match_words(regular_exp: str, lst):
     if not [w for w in lst if w != '']:
@@ -1003,7 +1460,7 @@ def re_match_letters_numbers(regular_exps: list, lst):
             if word != '' and not re.match(regular_exps[i % 2], word):
                 return False
         else:
-            if word != '' and not re_match_words(regular_exps[i % 2], re.split('[,]|[:]|[\\\\]|[/]|[%]', word)):
+            if word != '' and not re_match_words(regular_exps[i % 2], RE_NUMBER_INNER_SEPARATORS.split(word)):
                 return False
     return True
 
@@ -1012,7 +1469,7 @@ def re_match_letters_numbers(regular_exps: list, lst):
 def re_match_numbers_letters(regular_exps: list, lst):
     for i, word in enumerate(lst):
         if i % 2 == 0:
-            if word != '' and not re_match_words(regular_exps[i % 2], re.split('[,]|[:]|[\\\\]|[/]|[%]', word)):
+            if word != '' and not re_match_words(regular_exps[i % 2], RE_NUMBER_INNER_SEPARATORS.split(word)):
                 return False
         else:
             if word != '' and not re.match(regular_exps[i % 2], word):
@@ -1020,521 +1477,670 @@ def re_match_numbers_letters(regular_exps: list, lst):
     return True
 
 
+class WordShape:
+    """
+    all the regex predicates of a single word that f_xi_yi needs for classes 108 - 111.
+    the keys are the features keys without the tag (the tag is added by f_xi_yi)
+    """
+    __slots__ = ('hyphen_count', 'starts_capital', 'capital_with_separator', 'only_capitals',
+                 'lower_then_capital', 'class108_keys', 'class110_keys', 'class111_keys', 'class111_in_vitro')
+
+    def __init__(self, word):
+        self.hyphen_count = word.count('-')
+
+        # class 109 predicates (the class itself depends also on the neighbours, see f_xi_yi)
+        self.starts_capital = bool(RE_STARTS_CAPITAL.match(word))
+        self.capital_with_separator = bool(RE_CAPITAL_WITH_SEPARATOR.match(word))
+        self.only_capitals = bool(RE_ONLY_CAPITALS.match(word))
+        self.lower_then_capital = bool(RE_LOWER_THEN_CAPITAL.match(word))
+
+        self.class108_keys = self.get_class108_keys(word, self.hyphen_count)
+        self.class110_keys = self.get_class110_keys(word)
+        self.class111_keys, self.class111_in_vitro = self.get_class111_keys(word)
+
+    @staticmethod
+    def get_class108_keys(word, hyphen_count):
+        keys = list()
+        if RE_DIGIT.search(word):
+            splited_word = word.split('-')
+            no_category = True
+            if re_match_words(RE_ONLY_NUMBERS, RE_NUMBER_SEPARATORS.split(word)):
+                keys.append((108.1,))
+                no_category = False
+
+            elif hyphen_count > 1 and re_match_letters_numbers([RE_ONLY_LETTERS, RE_ONLY_NUMBERS], splited_word) \
+                    and not word.startswith('mid'):
+                keys.append((108.21,) if RE_ONLY_LETTERS.match(splited_word[-1]) else (108.22,))
+                no_category = False
+
+            elif hyphen_count == 1 and re_match_letters_numbers([RE_ONLY_LETTERS, RE_ONLY_NUMBERS], splited_word):
+                keys.append((108.31,) if RE_LOWER_CHAR.match(word[0]) else (108.32,))
+                no_category = False
+
+            elif hyphen_count > 1 and re_match_numbers_letters([RE_ONLY_NUMBERS, RE_ONLY_LETTERS], splited_word):
+                keys.append((108.4,))
+                no_category = False
+
+            elif hyphen_count == 1 and re_match_numbers_letters([RE_ONLY_NUMBERS, RE_ONLY_LETTERS], splited_word):
+                keys.append((108.5,))
+                no_category = False
+
+            if RE_YEAR.match(word):
+                keys.append((108.6,))
+                no_category = False
+
+            if no_category:
+                if RE_ONLY_LETTERS.match(splited_word[-1]):
+                    keys.append((108.7, hyphen_count))
+                else:
+                    keys.append((108.8, hyphen_count))
+        return tuple(keys)
+
+    @staticmethod
+    def get_class110_keys(word):
+        keys = list()
+        if len(word) >= 13:
+            if RE_RB_SUFFIX.search(word):  # RB tag
+                keys.append((110.12,))
+            elif RE_JJ_SUFFIX.search(word):
+                if RE_CAPITAL_CHAR.match(word[0]):  # NNP tag
+                    keys.append((110.135,))
+            elif not RE_HYPHEN.search(word):  # NN + NNS tags
+                if word[-1] == 's' and not RE_NESS_SUFFIX.search(word) and not RE_CAPITAL_CHAR.match(word[0]):
+                    keys.append((110.2,))
+
+        if RE_CD.match(word) or word in ["II", "III", "IV"] or RE_CD_BRACKETS.match(word):  # CD tag
+            if word in ["II", "III", "IV"]:  # in big model its NNP and not CD
+                keys.append((110.35,))
+            else:
+                keys.append((110.3,))
+
+        elif (RE_HYPHEN.search(word) and not RE_STARTS_CAPITAL.match(word.split('-')[-1])) and \
+                (RE_HYPHEN_LAST_JJ_SUFFIX.search(word.split('-')[-1]) or
+                 RE_HYPHEN_FIRST_JJ_PATTERN.search(word.split('-')[0])):  # JJ tag
+            keys.append((110.4,))
+
+        elif word not in ["-LCB-", "-RCB-", "-LRB-", "-RRB-", "--", "...", "I", "A", ",", ".", ":"]:
+            if (RE_NNS.match(word) and len(word) != 2) and not RE_NNS_YEAR.match(word):  # NNS tag
+                keys.append((110.5,))
+            if RE_CAPITALS_NUMBERS.match(word) or RE_NNP_INNER_CAPITAL.search(word) or \
+                    RE_NNP_HYPHEN.match(word):  # NNP tag
+                keys.append((110.6,))
+            if RE_NUMBERS_HYPHEN_LETTERS.match(word):  # JJ tag
+                keys.append((110.7,))
+            if RE_ENDS_WITH_DOT.search(word) and word not in [".", "No."]:  # in big model its NNP, and not FW
+                keys.append((110.9,))
+        return tuple(keys)
+
+    @staticmethod
+    def get_class111_keys(word):
+        """
+        :return: tuple of keys, and whether (111.92, ) fires when the next word is 'vitro' / 'vivo'
+        """
+        keys = list()
+        in_vitro = False
+        if len(word) >= 13:
+            if RE_ING_SUFFIX.search(word) and not RE_HYPHEN.search(word):
+                keys.append((111.11,))
+            elif RE_ED_SUFFIX.search(word) and not RE_HYPHEN.search(word):
+                keys.append((111.14,))
+            elif RE_RB_SUFFIX.search(word):  # RB tag
+                keys.append((111.12,))
+            elif RE_JJ_SUFFIX.search(word):  # JJ tag
+                keys.append((111.13,))
+            else:  # NN + NNS tags
+                if word[-1] == 's':
+                    keys.append((111.2,))
+                keys.append((111.1,))
+
+        if RE_CD.match(word) or word in ["II", "III", "IV"] or RE_CD_BRACKETS.match(word):  # CD tag
+            keys.append((111.3,))
+
+        elif (RE_HYPHEN.search(word) and
+              (RE_HYPHEN_LAST_JJ_SUFFIX.search(word.split('-')[-1]) or
+               RE_HYPHEN_FIRST_JJ_PATTERN.search(word.split('-')[0]))) or \
+                RE_KDA_SUFFIX.search(word):  # JJ tag
+            keys.append((111.4,))
+        else:
+            if RE_NNS.match(word):  # NNS tag
+                keys.append((111.5,))
+            if (RE_CAPITALS_NUMBERS.match(word) and word not in ["I", "A", ",", ".", ":"]) or \
+                    RE_INNER_CAPITAL.search(word) or RE_NN_HYPHEN.match(word) or \
+                    RE_COID_OR_NESS_SUFFIX.search(word):  # NN tag
+                keys.append((111.6,))
+            if RE_NUMBERS_HYPHEN_LETTERS.match(word):  # might be JJ tag
+                keys.append((111.7,))
+            if RE_LETTERS_HYPHEN_NUMBERS.match(word):  # might be NN tag.
+                keys.append((111.8,))
+            if RE_ENDS_WITH_DOT.search(word) and word != ".":  # might be FW tag, but maybe more
+                keys.append((111.9,))
+            if word in ['Treponema', 'pallidum', 'Borrelia', 'burgdorferi', 'vitro', 'vivo']:  # FW tag
+                keys.append((111.92,))
+            in_vitro = word in ['in', 'In']  # FW tag, depends on the next word
+            if word in ['i', 'ii', 'iii', 'iv']:  # LS tag
+                keys.append((111.93,))
+        return tuple(keys), in_vitro
+
+
+class WordShapeCache:
+    """
+    bounded (least recently used) cache of WordShape objects, shared by all tags, positions and sentences
+    """
+
+    def __init__(self, maxsize=200000):
+        """
+        :param maxsize: maximum number of words to keep
+        """
+        self.maxsize = maxsize
+        self.shapes = OrderedDict()  # {word: WordShape}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, word):
+        """
+        :param word: a word
+        :return: WordShape of the word
+        """
+        shape = self.shapes.get(word)
+        if shape is not None:
+            self.hits += 1
+            self.shapes.move_to_end(word)
+            return shape
+
+        self.misses += 1
+        shape = WordShape(word)
+        self.shapes[word] = shape
+        if len(self.shapes) > self.maxsize:
+            self.shapes.popitem(last=False)
+        return shape
+
+    def clear(self):
+        self.shapes.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# default cache used by f_xi_yi
+word_shape_cache = WordShapeCache()
+
+
 """START OF SECTION FOR OBJECTIVE FUNCTION AND GRADIENT CALC"""
 
 
-def my_sum(obj):
-    if type(obj) == np.float64:
-        return obj
-    if type(obj) == np.ndarray:
-        if not obj.size > 0:
-            return 0
-    return sum(obj)
-
-
-# global variables for objective function optimization
-first_iteration = 1
-active_indices_sentences_i = 0
-flattened_f_xi_yi = 0
-gradient_left_sigma = 0
-all_active_indices = 0
-softmax_indices_for_gradient = 0
-
-
-def initialize_global_variables():
-    global first_iteration
-    global active_indices_sentences_i
-    global flattened_f_xi_yi
-    global gradient_left_sigma
-    global all_active_indices
-    global softmax_indices_for_gradient
-    first_iteration = 1
-    active_indices_sentences_i = 0
-    flattened_f_xi_yi = 0
-    gradient_left_sigma = 0
-    all_active_indices = 0
-    softmax_indices_for_gradient = 0
-
-
-def function_l_and_gradient_l(v: np.array, *args):
-    file_path = args[0]
-    lam = args[1]
-    feature_statistics = args[2]
-    features_indices = args[3]
-
-    # first part - saving all the needed 'f' values in the first iteration only (one time per train file)
-    global active_indices_sentences_i
-    global flattened_f_xi_yi
-    global gradient_left_sigma
-    global all_active_indices
-    global first_iteration
-    global softmax_indices_for_gradient
-    sentences = sum(1 for _ in open(file_path))
-
-    if first_iteration:
-        first_iteration = 0
-
-        # global variables defined in global scope
-        active_indices_sentences_i = [list() for _ in range(sentences)]  # true tag that really seen in tag
-        flattened_f_xi_yi = []  # all true tags flattened
-        gradient_left_sigma = np.zeros(len(v))
-        all_active_indices = [list() for _ in range(sentences)]  # every tag for every word in every sentence
-        # all_active_indices = [[list for every sentence]] -> :
-        # -> list of a sentence: [dict for i=0 {}, dict for i=1,....] (i = 0,...,num of words - 1)
-        # -> dict looks like {key = 'tag', value: [active indices]}
-
-        s = 0  # running count for lines processed
-        with open(file_path) as f:
-            for line in f:
-                words, tags = split_sentence_to_words_and_tags(line)
-                for i in range(len(words)):
-                    active = f_xi_yi(features_indices, words, tags, i)
-                    active_indices_sentences_i[s].append(active)
-                    gradient_left_sigma[active] += 1
-                    all_active_indices[s].append(dict())
-                    t_i = tags[i]
-                    for y in feature_statistics.Y:
-                        tags[i] = y
-                        all_active_indices[s][i][y] = f_xi_yi(features_indices, words, tags, i)
-                    tags[i] = t_i
-                s += 1
-
-        # used to calculate easily the left sigma in objective function
-        flattened_f_xi_yi = [value for list1 in active_indices_sentences_i for list2 in list1 for value in list2]
-
-        # used to calculate the right sigma of gradient
-        softmax_indices_for_gradient = [list() for _ in range(len(v))]
-        cnt_words = 0
-        for s in range(sentences):
-            for i in range(len(all_active_indices[s])):
-                for y in range(len(feature_statistics.Y)):
-                    for index in all_active_indices[s][i][feature_statistics.Y[y]]:
-                        softmax_indices_for_gradient[index].append((cnt_words, y))
-                cnt_words += 1
-
-        # finished collecting all data
-
-    # updates we need to make according to current 'v'
-    # ------ OBJECTIVE ------
-    objective_value = sum(v[flattened_f_xi_yi])  # left sigma objective (all sentences)
-    exponents = [
-        [my_sum(v[dict_indices]) for dict_indices in all_active_indices[s][i].values()] for s in range(sentences) for i
-        in range(len(all_active_indices[s]))]
-    logsumexp = special.logsumexp(exponents, axis=1, keepdims=True)
-    objective_value -= np.float64(sum(logsumexp))  # we subtract the right sigma (all sentences)
+def extract_sentences_features(sentences, features_indices: Feature2Id, shape_cache: WordShapeCache = None):
+    """
+    extract the features of every word in the given sentences with every candidate tag
+    :param sentences: list of (words, tags)
+    :param features_indices: relevant Feature2Id object
+    :param shape_cache: WordShapeCache to take the words predicates from. None for the module default cache
+    :return: rows_lengths - number of active features in every (word, tag in Y) row, indices - the active features of
+             all the rows one after another, true_indices - the active features of the words with their true tags
+    """
+    tag_to_index = {tag: y for y, tag in enumerate(features_indices.feature_statistics.Y)}
+    rows_lengths_list, indices_list, true_indices_list = list(), list(), list()
+    for words, tags in sentences:
+        for i in range(len(words)):
+            # features of all the tags at once, the true tag features are the slice of the true tag
+            indptr, indices = f_xi_all_y(features_indices, words, tags, i, shape_cache)
+            true_y = tag_to_index[tags[i]]
+            true_indices_list.append(indices[indptr[true_y]:indptr[true_y + 1]])
+            rows_lengths_list.append(np.diff(indptr))
+            indices_list.append(indices)
+
+    empty = np.zeros(0, dtype=np.int64)
+    return np.concatenate(rows_lengths_list or [empty]), np.concatenate(indices_list or [empty]), \
+        np.concatenate(true_indices_list or [empty])
+
+
+# features indices of the worker processes of build_features_matrix
+_features_worker_features_indices = None
+
+
+def _init_features_worker(features_indices: Feature2Id):
+    global _features_worker_features_indices
+    _features_worker_features_indices = features_indices
 
-    # ------ GRADIENT ------
-    gradient_value = np.array(gradient_left_sigma)  # left sigma gradient (all sentences)
-    gradient_right_sigma = np.zeros(len(v))  # (all sentences)
+
+def _features_worker(sentences):
+    return extract_sentences_features(sentences, _features_worker_features_indices)
+
+
+def build_features_matrix(corpus: Corpus, feature_statistics: ClassStatistics, features_indices: Feature2Id,
+                          shape_cache: WordShapeCache = None, n_jobs=1):
+    """
+    extract the features of every word in the corpus with every candidate tag
+    :param corpus: train Corpus
+    :param feature_statistics: relevant ClassStatistics object
+    :param features_indices: relevant Feature2Id object
+    :param shape_cache: WordShapeCache to take the words predicates from. None for the module default cache
+    :param n_jobs: number of worker processes to extract the features of chunks of sentences in.
+                   the result is identical to extracting them in this process (n_jobs=1)
+    :return: features_matrix - sparse matrix with a row for every (word, tag in Y) pair, row = word * |Y| + tag,
+             empirical_counts - number of times every feature is fired with the true tags
+    """
+    from scipy import sparse  # training modules are imported only when training
+
+    n_tags = len(feature_statistics.Y)
+    if n_jobs > 1 and len(corpus) > 1:
+        # about 4 chunks per worker, so the workers finish together. results are merged in the chunks order
+        chunk_size = max(1, -(-len(corpus) // (4 * n_jobs)))
+        chunks = [[corpus.sentence(s) for s in range(start, min(start + chunk_size, len(corpus)))]
+                  for start in range(0, len(corpus), chunk_size)]
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_features_worker,
+                                 initargs=(features_indices,)) as executor:
+            results = list(executor.map(_features_worker, chunks))
+        rows_lengths, indices, true_indices = [np.concatenate(arrays) for arrays in zip(*results)]
+    else:
+        rows_lengths, indices, true_indices = extract_sentences_features(corpus.sentences(), features_indices,
+                                                                         shape_cache)
+
+    indptr = np.zeros(len(rows_lengths) + 1, dtype=np.int64)
+    np.cumsum(rows_lengths, out=indptr[1:])
+    features_matrix = sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                        shape=(corpus.n_words() * n_tags, features_indices.n_total_features))
+    empirical_counts = np.bincount(true_indices, minlength=features_indices.n_total_features).astype(np.float64)
+    return features_matrix, empirical_counts
+
+
+def log_partition_and_expected_counts(features_matrix, v: np.array, n_tags):
+    """
+    the right sigmas of the objective function and of the gradient, for the words in features_matrix
+    :param features_matrix: features matrix (or rows of it for whole words), see build_features_matrix
+    :param v: weights vector
+    :param n_tags: |Y|
+    :return: sum of log-partition over the words, expected counts of every feature
+    """
+    import scipy.special as special
+
+    exponents = (features_matrix @ v).reshape(-1, n_tags)  # row for every word, column for every tag
+    logsumexp = special.logsumexp(exponents, axis=1, keepdims=True)
     softmax = np.exp(exponents - logsumexp)  # line from special.softmax documentation
-    # calculate right gradient sigma
-    for k in range(len(v)):
-        for indices in softmax_indices_for_gradient[k]:
-            gradient_right_sigma[k] += softmax[indices[0]][indices[1]]
-    gradient_value -= gradient_right_sigma
+    return np.sum(logsumexp), features_matrix.T @ softmax.ravel()
+
+
+def _objective_shard_worker(connection, shared_memory_name, shard, n_shards, n_features, n_tags, features_matrix):
+    """
+    worker process for Trainer with n_jobs > 1. for every message it evaluates the right sigmas on its shard with the
+    current weights vector (read from the shared memory) and writes the expected counts to its row of the shared
+    memory. a None message stops the worker
+    """
+    shared_memory_block = shared_memory.SharedMemory(name=shared_memory_name)
+    v = np.ndarray((n_features,), dtype=np.float64, buffer=shared_memory_block.buf)
+    expected_counts = np.ndarray((n_shards, n_features), dtype=np.float64,
+                                 buffer=shared_memory_block.buf, offset=n_features * 8)[shard]
+    while connection.recv() is not None:
+        log_partition, expected_counts[:] = log_partition_and_expected_counts(features_matrix, v, n_tags)
+        connection.send(log_partition)
+    del v, expected_counts  # release the views of the shared memory before closing it
+    shared_memory_block.close()
+
+
+class Trainer:
+    """
+    MEMM weights optimization on one train corpus. the trainer owns all the precomputed training state, so several
+    trainers can run in the same process / thread pool at the same time
+    """
 
-    return -1 * (objective_value - (lam / 2) * (np.linalg.norm(v) ** 2)), -1 * (gradient_value - lam * v)
+    def __init__(self, corpus: Corpus, lam, feature_statistics: ClassStatistics, features_indices: Feature2Id,
+                 n_jobs=1, profiler: Profiler = None):
+        """
+        :param corpus: train Corpus
+        :param lam: regularization parameter (lambda)
+        :param feature_statistics: relevant ClassStatistics object
+        :param features_indices: relevant Feature2Id object
+        :param n_jobs: number of worker processes that extract the features and then evaluate the objective function
+                       on shards of the sentences. 1 for doing everything in this process
+        :param profiler: Profiler for the stages 'feature_build' and 'objective' (every call). None for no profiling
+        """
+        self.corpus = corpus
+        self.lam = lam
+        self.feature_statistics = feature_statistics
+        self.features_indices = features_indices
+        self.n_jobs = n_jobs
+        self.profiler = profiler if profiler is not None else NO_PROFILER
+        self.shape_cache = WordShapeCache()
+
+        # built in the first call of the objective function (one time per train corpus)
+        self.features_matrix = None
+        self.empirical_counts = None
+
+        # worker processes (n_jobs > 1), started in the first call of the objective function
+        self.workers = list()  # [(process, connection)]
+        self.shared_memory_block = None
+        self.shared_v = None
+        self.shared_expected_counts = None
+
+    def build(self):
+        """
+        save all the needed 'f' values, if not saved already
+        """
+        if self.features_matrix is None:
+            with self.profiler.stage('feature_build'):
+                self.features_matrix, self.empirical_counts = build_features_matrix(
+                    self.corpus, self.feature_statistics, self.features_indices, self.shape_cache, self.n_jobs)
+            self.profiler.count('histories', self.corpus.n_words())
+
+    def shards_rows(self, n_shards):
+        """
+        split the sentences to n_shards continuous shards with about the same number of words
+        :return: list of (first row, last row + 1) in the features matrix of every shard
+        """
+        n_tags = len(self.feature_statistics.Y)
+        offsets = self.corpus.offsets
+        targets = np.linspace(0, offsets[-1], n_shards + 1)
+        bounds = np.unique(offsets[np.searchsorted(offsets, targets)])
+        return [(start * n_tags, stop * n_tags) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def start_workers(self):
+        """
+        start the worker processes, each one gets its own shard of the features matrix
+        """
+        shards = self.shards_rows(self.n_jobs)
+        n_features = self.features_indices.n_total_features
+        n_tags = len(self.feature_statistics.Y)
+
+        # shared memory: the weights vector, then expected counts row for every shard
+        self.shared_memory_block = shared_memory.SharedMemory(create=True, size=(1 + len(shards)) * n_features * 8)
+        self.shared_v = np.ndarray((n_features,), dtype=np.float64, buffer=self.shared_memory_block.buf)
+        self.shared_expected_counts = np.ndarray((len(shards), n_features), dtype=np.float64,
+                                                 buffer=self.shared_memory_block.buf, offset=n_features * 8)
+        for shard, (start, stop) in enumerate(shards):
+            parent_connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_objective_shard_worker, daemon=True,
+                args=(child_connection, self.shared_memory_block.name, shard, len(shards), n_features, n_tags,
+                      self.features_matrix[start:stop]))
+            process.start()
+            child_connection.close()
+            self.workers.append((process, parent_connection))
+
+    def close(self):
+        """
+        stop the worker processes and free the shared memory (they are started again if needed)
+        """
+        for process, connection in self.workers:
+            connection.send(None)
+            connection.close()
+            process.join()
+        self.workers = list()
+        if self.shared_memory_block is not None:
+            self.shared_v, self.shared_expected_counts = None, None
+            self.shared_memory_block.close()
+            self.shared_memory_block.unlink()
+            self.shared_memory_block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def function_l_and_gradient_l(self, v: np.array):
+        """
+        :param v: weights vector
+        :return: minus the regularized log-likelihood and its gradient at v
+        """
+        self.build()
+        n_tags = len(self.feature_statistics.Y)
+
+        with self.profiler.stage('objective'):
+            # right sigmas of objective and gradient (all sentences)
+            if self.n_jobs > 1:
+                if not self.workers:
+                    self.start_workers()
+                self.shared_v[:] = v
+                for _, connection in self.workers:
+                    connection.send(True)
+                log_partition = sum(connection.recv() for _, connection in self.workers)
+                gradient_right_sigma = self.shared_expected_counts.sum(axis=0)
+            else:
+                log_partition, gradient_right_sigma = log_partition_and_expected_counts(self.features_matrix, v,
+                                                                                        n_tags)
+
+            # ------ OBJECTIVE ------
+            objective_value = self.empirical_counts @ v - log_partition  # left sigma minus right sigma
+
+            # ------ GRADIENT ------
+            gradient_value = self.empirical_counts - gradient_right_sigma  # left sigma minus right sigma
+
+            return -1 * (objective_value - (self.lam / 2) * (np.linalg.norm(v) ** 2)), \
+                -1 * (gradient_value - self.lam * v)
+
+    def train(self, x0=None, factr=1e7):
+        """
+        run L-BFGS optimization
+        :param x0: initial weights vector. None for random initialization
+        :param factr: fmin_l_bfgs_b convergence parameter
+        :return: fmin_l_bfgs_b result - (optimal weights, objective value, info dict)
+        """
+        from scipy import optimize
+
+        if x0 is None:
+            x0 = np.random.randn(self.features_indices.n_total_features)
+        try:
+            return optimize.fmin_l_bfgs_b(func=self.function_l_and_gradient_l, x0=x0, factr=factr)
+        finally:
+            self.close()
 
 
 """END OF SECTION OBJECTIVE FUNCTION AND GRADIENT CALC"""
 
 
-def f_xi_yi(features_indices: Feature2Id, words, tags, i):
+def f_xi_words_templates(words, i, shape_cache: WordShapeCache = None):
     """
-    determine what features are fired for the given words and tags and location (history)
-    :param features_indices: object containing the features and their indices
+    determine the keys of the features that may be fired for the given words and location, for any previous tags and
+    any current tag. a key of a feature is its template + (cur_tag, )
     :param words: words in sentence
-    :param tags: tags
     :param i: location in sentence
-    :return: list of all active features for the given history
+    :param shape_cache: WordShapeCache to take the words predicates from. None for the module default cache
+    :return: [class 100 templates - only the first that exists for a tag is fired], [templates that depend only on
+             the words], [prefixes of templates that depend also on the previous tag - template = prefix + (prev_tag, )]
+             (class 103 template, (103, prev_prev_tag, prev_tag), is always fired and is not included)
     """
-    active_features_indices = list()
+    templates, prev_tag_prefixes = list(), [(104,)]
     cur_word = words[i]
     prev_word = words[i - 1] if i > 0 else '*'
     next_word = words[i + 1] if i < len(words) - 1 else 'STOP'
-    cur_tag = tags[i]
-    prev_tag = tags[i - 1] if i > 0 else ''
-    prev_prev_tag = tags[i - 2] if i - 1 > 0 else ''
 
-    # features fired in class 100
-    if (100, cur_word, cur_tag) in features_indices.class100_feature_index_dict:
-        active_features_indices.append(features_indices.all_feature_index_dict[(100, cur_word, cur_tag)])
-    elif (100, cur_word.lower(), cur_tag) in features_indices.class100_feature_index_dict:
-        active_features_indices.append(features_indices.all_feature_index_dict[(100, cur_word.lower(), cur_tag)])
-    elif (100, cur_word.upper(), cur_tag) in features_indices.class100_feature_index_dict:
-        active_features_indices.append(features_indices.all_feature_index_dict[(100, cur_word.upper(), cur_tag)])
-    elif (100, cur_word[0].upper() + cur_word[1:].lower(), cur_tag) in features_indices.class100_feature_index_dict:
-        active_features_indices.append(
-            features_indices.all_feature_index_dict[(100, cur_word[0].upper() + cur_word[1:].lower(), cur_tag)])
-
-    # features fired in class 101
+    # class 100 - the word as is, and if not seen then lower / upper / capitalized
+    class100_templates = [(100, cur_word), (100, cur_word.lower()), (100, cur_word.upper()),
+                          (100, cur_word[:1].upper() + cur_word[1:].lower())]
+
+    # class 101
     n = min(len(cur_word) - 1, 7)
     for suffix_length in range(1, n + 1):
-        if (101, cur_word[-suffix_length:], cur_tag) in features_indices.class101_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(101, cur_word[-suffix_length:], cur_tag)])
+        templates.append((101, cur_word[-suffix_length:]))
 
-    # features fired in class 102
+    # class 102
     for prefix_length in range(1, n + 1):
-        if (102, cur_word[:prefix_length], cur_tag) in features_indices.class102_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(102, cur_word[:prefix_length], cur_tag)])
-
-    # features fired in class 103
-
-    if (103, prev_prev_tag, prev_tag, cur_tag) in features_indices.class103_feature_index_dict:
-        active_features_indices.append(
-            features_indices.all_feature_index_dict[(103, prev_prev_tag, prev_tag, cur_tag)])
-
-    # features fired in class 104
-
-    if (104, prev_tag, cur_tag) in features_indices.class104_feature_index_dict:
-        active_features_indices.append(
-            features_indices.all_feature_index_dict[(104, prev_tag, cur_tag)])
-
-    # features fired in class 105
-    if (105, cur_tag) in features_indices.class105_feature_index_dict:
-        active_features_indices.append(
-            features_indices.all_feature_index_dict[(105, cur_tag)])
-
-    # features fired in class 106
-    if (106, prev_word, cur_tag) in features_indices.class106_feature_index_dict:
-        active_features_indices.append(
-            features_indices.all_feature_index_dict[(106, prev_word, cur_tag)])
-
-    # features fired in class 107
-
-    if (107, next_word, cur_tag) in features_indices.class107_feature_index_dict:
-        active_features_indices.append(
-            features_indices.all_feature_index_dict[(107, next_word, cur_tag)])
-
-    # features fired in class 108
-    hyphen_count = cur_word.count('-')
-    if re.search(r'\d', cur_word):
-        splited_cur_word = re.split('-', cur_word)
-        no_category = True
-        if re_match_words('^[0-9]+$', re.split('[-]|[,]|[.]|[:]|[\\\\]|[/]|[%]', cur_word)):
-            if (108.1, cur_tag) in features_indices.class108_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(108.1, cur_tag)])
-            no_category = False
-
-        elif hyphen_count > 1 and re_match_letters_numbers(['^[A-Za-z]+$', '^[0-9]+$'],
-                                                           splited_cur_word) \
-                and not cur_word.startswith('mid'):
-            if re.match('^[A-Za-z]+$', splited_cur_word[-1]):
-                if (108.21, cur_tag) in features_indices.class108_feature_index_dict:
-                    active_features_indices.append(features_indices.all_feature_index_dict[(108.21, cur_tag)])
-            else:
-                if (108.22, cur_tag) in features_indices.class108_feature_index_dict:
-                    active_features_indices.append(features_indices.all_feature_index_dict[(108.22, cur_tag)])
-            no_category = False
-
-        elif hyphen_count == 1 and re_match_letters_numbers(['^[A-Za-z]+$', '^[0-9]+$'],
-                                                            splited_cur_word):
-            if re.match('^[a-z]$', cur_word[0]):
-                if (108.31, cur_tag) in features_indices.class108_feature_index_dict:
-                    active_features_indices.append(features_indices.all_feature_index_dict[(108.31, cur_tag)])
-            else:
-                if (108.32, cur_tag) in features_indices.class108_feature_index_dict:
-                    active_features_indices.append(features_indices.all_feature_index_dict[(108.32, cur_tag)])
-
-            no_category = False
-
-        elif hyphen_count > 1 and re_match_numbers_letters(['^[0-9]+$', '^[A-Za-z]+$'],
-                                                           splited_cur_word):
-            if (108.4, cur_tag) in features_indices.class108_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(108.4, cur_tag)])
-            no_category = False
-
-        elif hyphen_count == 1 and re_match_numbers_letters(['^[0-9]+$', '^[A-Za-z]+$'],
-                                                            splited_cur_word):
-            if (108.5, cur_tag) in features_indices.class108_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(108.5, cur_tag)])
-            no_category = False
-
-        if re.match('^([a-zA-Z]*(-)?[0-9][0-9][0-9][0-9](s?))$|^(\'[0-9][0-9]s)$', cur_word):
-            if (108.6, cur_tag) in features_indices.class108_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(108.6, cur_tag)])
-            no_category = False
-
-        if no_category:
-            if re.match('^[A-Za-z]+$', splited_cur_word[-1]):
-                if (108.7, hyphen_count, cur_tag) in features_indices.class108_feature_index_dict:
-                    active_features_indices.append(
-                        features_indices.all_feature_index_dict[(108.7, hyphen_count, cur_tag)])
-            else:
-                if (108.8, hyphen_count, cur_tag) in features_indices.class108_feature_index_dict:
-                    active_features_indices.append(
-                        features_indices.all_feature_index_dict[(108.8, hyphen_count, cur_tag)])
-
-    # features fired in class 109
-    if i > 0 and re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', next_word) \
-            and re.match('^[A-Z]', prev_word):
-        if (109.1, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(109.1, prev_tag, cur_tag)])
-
-    elif i > 0 and re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', prev_word):
-        if (109.2, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(109.2, prev_tag, cur_tag)])
-
-    elif i > 0 and re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word):
-
-        if (109.3, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(109.3, prev_tag, cur_tag)])
-
-    elif i > 0 and re.match('^[A-Z]', cur_word) and re.match('^[A-Z]', next_word) \
-            and re.match('^[A-Z]', prev_word):
-        if (109.4, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(109.4, prev_tag, cur_tag)])
+        templates.append((102, cur_word[:prefix_length]))
 
-    elif i == 0 or (i > 0 and prev_word in ['``', '.']):
-        if re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', next_word) \
-                and re.match('^[A-Z]', prev_word):
-            if (109.5, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-                active_features_indices.append(
-                    features_indices.all_feature_index_dict[(109.5, prev_tag, cur_tag)])
+    # classes 105 - 107 (103 - 104 depend on the previous tags)
+    templates.append((105,))
+    templates.append((106, prev_word))
+    templates.append((107, next_word))
 
-    elif i == 0 or (i > 0 and prev_word in ['``', '.']):
-        if re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word) and re.match('^[A-Z]', next_word):
-            if (109.6, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-                active_features_indices.append(
-                    features_indices.all_feature_index_dict[(109.6, prev_tag, cur_tag)])
+    # classes 108 - 111 (predicates of the words are taken from the words shapes cache)
+    if shape_cache is None:
+        shape_cache = word_shape_cache
+    cur_shape = shape_cache.get(cur_word)
+    prev_shape = shape_cache.get(prev_word)
+    next_shape = shape_cache.get(next_word)
 
-    elif i == 0 or (i > 0 and prev_word in ['``', '.']):
-        if re.match('^[A-Z](.*?)[-.]+(.*?)', cur_word):
-            if (109.7, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-                active_features_indices.append(
-                    features_indices.all_feature_index_dict[(109.7, prev_tag, cur_tag)])
+    # class 108
+    templates.extend(cur_shape.class108_keys)
+
+    # class 109 (depends on the previous tag)
+    if i > 0 and cur_shape.capital_with_separator and next_shape.starts_capital and prev_shape.starts_capital:
+        prev_tag_prefixes.append((109.1,))
+
+    elif i > 0 and cur_shape.capital_with_separator and prev_shape.starts_capital:
+        prev_tag_prefixes.append((109.2,))
+
+    elif i > 0 and cur_shape.capital_with_separator:
+        prev_tag_prefixes.append((109.3,))
+
+    elif i > 0 and cur_shape.starts_capital and next_shape.starts_capital and prev_shape.starts_capital:
+        prev_tag_prefixes.append((109.4,))
 
     elif i == 0 or (i > 0 and prev_word in ['``', '.']):
-        if re.match('^[A-Z]', cur_word) and re.match('^[A-Z]', next_word) \
-                and re.match('^[A-Z]', prev_word):
-            if (109.8, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-                active_features_indices.append(
-                    features_indices.all_feature_index_dict[(109.8, prev_tag, cur_tag)])
-
-    elif re.match('^[A-Z][A-Z]+$', cur_word) and re.match('^[A-Z][A-Z]+$', next_word) and re.match(
-            '^[A-Z][A-Z]+$', prev_word):
-        if (109.9, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(109.9, prev_tag, cur_tag)])
-
-    elif re.match('^[A-Z][A-Z]+$', cur_word) and re.match('^[A-Z][A-Z]+$', next_word):
-        if (109.11, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(109.11, prev_tag, cur_tag)])
-
-    elif re.match('^[A-Z][A-Z]+$', cur_word):
-        if (109.12, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(109.12, prev_tag, cur_tag)])
-
-    if re.match('[A-Z]', cur_word):
-        if (109.13, hyphen_count, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(109.13, hyphen_count, prev_tag, cur_tag)])
-
-    if re.match('(.*?)[a-z](.*?)[A-Z]', cur_word):
-        if (109.14, prev_tag, cur_tag) in features_indices.class109_feature_index_dict:
-            active_features_indices.append(
-                features_indices.all_feature_index_dict[(109.14, prev_tag, cur_tag)])
-
-    # features fired in class 110
-    if len(cur_word) >= 13:
-        if re.search('ally$', cur_word) or re.search('ely$', cur_word) or re.search('tly$', cur_word):  # RB tag
-            if (110.12, cur_tag) in features_indices.class110_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(110.12, cur_tag)])
-
-        elif re.search('tant$', cur_word) or \
-                re.search('cal$', cur_word) or \
-                re.search('ic$', cur_word) or \
-                re.search('ive$', cur_word) or \
-                re.search('nal$', cur_word) or \
-                re.search('-dependent$', cur_word) or \
-                re.search('-sensitive$', cur_word) or \
-                re.search('-specific$', cur_word) or \
-                re.search('tly$', cur_word):
-            if re.match('^[A-Z]$', cur_word[0]):  # NNP tag
-                if (110.135, cur_tag) in features_indices.class110_feature_index_dict:
-                    active_features_indices.append(features_indices.all_feature_index_dict[(110.135, cur_tag)])
-
-        elif not (re.search('[\-]', cur_word)):  # NN + NNS tags
-            if cur_word[-1] == 's' and not \
-                    re.search('ness$', cur_word) and not re.match('^[A-Z]$', cur_word[0]):
-                if (110.2, cur_tag) in features_indices.class110_feature_index_dict:
-                    active_features_indices.append(features_indices.all_feature_index_dict[(110.2, cur_tag)])
-
-    if re.match('^[0-9\-,.:]*[0-9]+[0-9\-,.:]*$', cur_word) or cur_word in ["II", "III", "IV"] or \
-            re.match('^[0-9\-.]+[L][R][B][0-9\-.]+[R][R][B][0-9\-.]+$', cur_word):  # CD tag
-        if cur_word in ["II", "III", "IV"]:  # in big model its NNP and not CD
-            if (110.35, cur_tag) in features_indices.class110_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(110.35, cur_tag)])
-        elif (110.3, cur_tag) in features_indices.class110_feature_index_dict:
-            active_features_indices.append(features_indices.all_feature_index_dict[(110.3, cur_tag)])
-
-    elif (re.search('[\-]', cur_word) and not re.match('^[A-Z]', cur_word.split('-')[-1])) and \
-            (re.search('ing$', cur_word.split('-')[-1]) or
-             re.search('ed$', cur_word.split('-')[-1]) or
-             re.search('ic$', cur_word.split('-')[-1]) or
-             re.search('age$', cur_word.split('-')[-1]) or
-             re.search('like$', cur_word.split('-')[-1]) or
-             re.search('ive$', cur_word.split('-')[-1]) or
-             re.search('ven$', cur_word.split('-')[-1]) or
-             re.search('^pre', cur_word.split('-')[0]) or
-             re.search('^anti', cur_word.split('-')[0]) or
-             re.search('er$', cur_word.split('-')[0])):  # JJ tag
-        if (110.4, cur_tag) in features_indices.class110_feature_index_dict:
-            active_features_indices.append(features_indices.all_feature_index_dict[(110.4, cur_tag)])
-    elif cur_word not in ["-LCB-", "-RCB-", "-LRB-", "-RRB-", "--", "...", "I", "A", ",", ".", ":"]:
-        if (re.match('^[a-z]*[A-Z\-0-9.,]+[s]$', cur_word) and  # NNS tag
-            len(cur_word) != 2) and not \
-                re.match('^([a-zA-Z]*(-)?[0-9][0-9][0-9][0-9](s?))$|^([a-zA-Z]*(-)?[0-9][0-9]s)$', cur_word):
-            if (110.5, cur_tag) in features_indices.class110_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(110.5, cur_tag)])
-        if re.match('^[A-Z\-0-9.,]+$', cur_word) or \
-                re.search('[a-z\-][A-Z]', cur_word) or \
-                re.match('^[A-Za-z][\-][a-z]+$', cur_word):  # NNP tag
-            if (110.6, cur_tag) in features_indices.class110_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(110.6, cur_tag)])
-
-        if re.match('^[0-9\-.,]+[\-][a-zA-Z]+$', cur_word):  # JJ tag
-            if (110.7, cur_tag) in features_indices.class110_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(110.7, cur_tag)])
-
-        if re.search('\.$', cur_word) and cur_word not in [".", "No."]:  # in big model its NNP, and not FW
-            if (110.9, cur_tag) in features_indices.class110_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(110.9, cur_tag)])
-
-    # features fired in class 111
-    if len(cur_word) >= 13:
-        if re.search('ing$', cur_word) and not (re.search('[\-]', cur_word)):
-            if (111.11, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.11, cur_tag)])
-        elif re.search('ed$', cur_word) and not (re.search('[\-]', cur_word)):
-            if (111.14, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.14, cur_tag)])
-
-        elif re.search('ally$', cur_word) or re.search('ely$', cur_word) or re.search('tly$', cur_word):  # RB tag
-            if (111.12, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.12, cur_tag)])
-
-        elif re.search('tant$', cur_word) or \
-                re.search('cal$', cur_word) or \
-                re.search('ic$', cur_word) or \
-                re.search('ive$', cur_word) or \
-                re.search('nal$', cur_word) or \
-                re.search('-dependent$', cur_word) or \
-                re.search('-sensitive$', cur_word) or \
-                re.search('-specific$', cur_word) or \
-                re.search('tly$', cur_word):  # JJ tag
-            if (111.13, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.13, cur_tag)])
-        else:  # NN + NNS tags
-            if cur_word[-1] == 's':
-                if (111.2, cur_tag) in features_indices.class111_feature_index_dict:
-                    active_features_indices.append(features_indices.all_feature_index_dict[(111.2, cur_tag)])
-
-            if (111.1, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.1, cur_tag)])
-
-    if re.match('^[0-9\-,.:]*[0-9]+[0-9\-,.:]*$', cur_word) or cur_word in ["II", "III", "IV"] or \
-            re.match('^[0-9\-.]+[L][R][B][0-9\-.]+[R][R][B][0-9\-.]+$', cur_word):  # CD tag
-        if (111.3, cur_tag) in features_indices.class111_feature_index_dict:
-            active_features_indices.append(features_indices.all_feature_index_dict[(111.3, cur_tag)])
-
-    elif ((re.search('[\-]', cur_word) and
-           (re.search('ing$', cur_word.split('-')[-1]) or
-            re.search('ed$', cur_word.split('-')[-1]) or
-            re.search('ic$', cur_word.split('-')[-1]) or
-            re.search('age$', cur_word.split('-')[-1]) or
-            re.search('like$', cur_word.split('-')[-1]) or
-            re.search('ive$', cur_word.split('-')[-1]) or
-            re.search('ven$', cur_word.split('-')[-1]) or
-            re.search('^pre', cur_word.split('-')[0]) or
-            re.search('^anti', cur_word.split('-')[0]) or
-            re.search('er$', cur_word.split('-')[0]))) or
-          re.search('kDa$', cur_word)):  # JJ tag
-        if (111.4, cur_tag) in features_indices.class111_feature_index_dict:
-            active_features_indices.append(features_indices.all_feature_index_dict[(111.4, cur_tag)])
-    else:
-        if re.match('^[a-z]*[A-Z\-0-9.,]+[s]$', cur_word):  # NNS tag
-            if (111.5, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.5, cur_tag)])
-
-        if (re.match('^[A-Z\-0-9.,]+$', cur_word) and cur_word not in ["I", "A", ",", ".", ":"]) or \
-                re.search('[a-z][A-Z]', cur_word) or \
-                re.match('[A-Za-z][\-][A-Za-z0-9.,\-]+$', cur_word) or \
-                re.search('coid$', cur_word) or re.search('ness$', cur_word):  # NN tag
-            if (111.6, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.6, cur_tag)])
-
-        if re.match('^[0-9\-.,]+[\-][a-zA-Z]+$', cur_word):  # might be JJ tag
-            if (111.7, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.7, cur_tag)])
-
-        if re.match('^[A-Z]?[a-z]+[\-][0-9\-.,]+$', cur_word):  # might be NN tag.
-            if (111.8, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.8, cur_tag)])
-
-        if re.search('\.$', cur_word) and cur_word != ".":  # might be FW tag, but maybe more
-            if (111.9, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.9, cur_tag)])
-
-        if cur_word in ['Treponema', 'pallidum', 'Borrelia', 'burgdorferi', 'vitro', 'vivo']:  # FW tag
-            if (111.92, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.92, cur_tag)])
-
-        if cur_word in ['in', 'In'] and i != len(words) - 1:  # FW tag
-            next_word = words[i + 1]
-            if next_word in ['vitro', 'vivo']:
-                if (111.92, cur_tag) in features_indices.class111_feature_index_dict:
-                    active_features_indices.append(features_indices.all_feature_index_dict[(111.92, cur_tag)])
-
-        if cur_word in ['i', 'ii', 'iii', 'iv']:  # LS tag
-            if (111.93, cur_tag) in features_indices.class111_feature_index_dict:
-                active_features_indices.append(features_indices.all_feature_index_dict[(111.93, cur_tag)])
+        # as in ClassStatistics, only 109.5 can fire for the first word (109.6 - 109.8 are never reached)
+        if cur_shape.capital_with_separator and next_shape.starts_capital and prev_shape.starts_capital:
+            prev_tag_prefixes.append((109.5,))
 
-    return active_features_indices
+    elif cur_shape.only_capitals and next_shape.only_capitals and prev_shape.only_capitals:
+        prev_tag_prefixes.append((109.9,))
+
+    elif cur_shape.only_capitals and next_shape.only_capitals:
+        prev_tag_prefixes.append((109.11,))
+
+    elif cur_shape.only_capitals:
+        prev_tag_prefixes.append((109.12,))
+
+    if cur_shape.starts_capital:
+        prev_tag_prefixes.append((109.13, cur_shape.hyphen_count))
+
+    if cur_shape.lower_then_capital:
+        prev_tag_prefixes.append((109.14,))
 
+    # class 110
+    templates.extend(cur_shape.class110_keys)
 
-def split_sentence_to_words_and_tags(line: str):
+    # class 111
+    templates.extend(cur_shape.class111_keys)
+    if cur_shape.class111_in_vitro and i != len(words) - 1 and words[i + 1] in ['vitro', 'vivo']:  # FW tag
+        templates.append((111.92,))
+
+    return class100_templates, templates, prev_tag_prefixes
+
+
+def prev_tags_templates(prev_tag_prefixes, prev_prev_tag, prev_tag):
     """
-    Split the sentence with words and tags into 2 lists
-    :param line: input line from text file. e.g. "'The_DT Treasury_NNP is_VBZ still_RB ._.\n"
-    :return: [list of words in order], [list of tags in order]
+    :param prev_tag_prefixes: prefixes of templates that depend on the previous tag (see f_xi_words_templates)
+    :return: all the templates that depend on the previous tags
     """
-    splited_words = re.split(' |[\n]', line)
-    if splited_words[-1] == "":
-        del splited_words[-1]  # remove \n
+    return [(103, prev_prev_tag, prev_tag)] + [prefix + (prev_tag,) for prefix in prev_tag_prefixes]
+
+
+def f_xi_templates(words, tags, i, shape_cache: WordShapeCache = None):
+    """
+    determine the keys of the features that may be fired for the given words, previous tags and location (history)
+    for any current tag. a key of a feature is its template + (cur_tag, )
+    :param words: words in sentence
+    :param tags: tags (only the tags before location i are used)
+    :param i: location in sentence
+    :param shape_cache: WordShapeCache to take the words predicates from. None for the module default cache
+    :return: [class 100 templates - only the first that exists for a tag is fired], [all the other templates]
+    """
+    prev_tag = tags[i - 1] if i > 0 else ''
+    prev_prev_tag = tags[i - 2] if i - 1 > 0 else ''
+    class100_templates, templates, prev_tag_prefixes = f_xi_words_templates(words, i, shape_cache)
+    return class100_templates, templates + prev_tags_templates(prev_tag_prefixes, prev_prev_tag, prev_tag)
+
+
+def f_xi_yi(features_indices: Feature2Id, words, tags, i, shape_cache: WordShapeCache = None):
+    """
+    determine what features are fired for the given words and tags and location (history)
+    :param features_indices: object containing the features and their indices
+    :param words: words in sentence
+    :param tags: tags
+    :param i: location in sentence
+    :param shape_cache: WordShapeCache to take the words predicates from. None for the module default cache
+    :return: list of all active features for the given history
+    """
+    active_features_indices = list()
+    all_feature_index_dict = features_indices.all_feature_index_dict
+    cur_tag = tags[i]
+    class100_templates, templates = f_xi_templates(words, tags, i, shape_cache)
+
+    for template in class100_templates:
+        if template + (cur_tag,) in all_feature_index_dict:
+            active_features_indices.append(all_feature_index_dict[template + (cur_tag,)])
+            break
+
+    for template in templates:
+        if template + (cur_tag,) in all_feature_index_dict:
+            active_features_indices.append(all_feature_index_dict[template + (cur_tag,)])
+
+    return active_features_indices
 
-    words, tags = list(), list()
-    for word_tag_str in splited_words:
-        word_tag_list = word_tag_str.split('_')
-        words.append(word_tag_list[0])
-        tags.append(word_tag_list[1])
 
-    return words, tags
+def templates_active_features(features_indices: Feature2Id, class100_templates, templates):
+    """
+    :param features_indices: object containing the features and their indices
+    :param class100_templates: class 100 templates - only the first that exists for a tag is fired
+    :param templates: all the other templates
+    :return: np arrays - tags (index in Y) and features indices of all the active features of the templates
+    """
+    templates_index_dict = features_indices.templates_index_dict
+    active_tags, active_indices = list(), list()
+
+    # class 100 - for each tag only the first template that exists
+    seen_tags = set()
+    for template in class100_templates:
+        template_entries = templates_index_dict.get(template)
+        if template_entries is not None:
+            for tag, index in zip(*template_entries):
+                if tag not in seen_tags:
+                    seen_tags.add(tag)
+                    active_tags.append(tag)
+                    active_indices.append(index)
+
+    for template in templates:
+        template_entries = templates_index_dict.get(template)
+        if template_entries is not None:
+            active_tags.extend(template_entries[0])
+            active_indices.extend(template_entries[1])
+
+    return np.array(active_tags, dtype=np.int64), np.array(active_indices, dtype=np.int64)
+
+
+def templates_scores(weights, features_indices: Feature2Id, class100_templates, templates):
+    """
+    :return: np array - sum of the weights of the active features of the templates, for every tag in Y
+    """
+    active_tags, active_indices = templates_active_features(features_indices, class100_templates, templates)
+    return np.bincount(active_tags, weights=weights[active_indices],
+                       minlength=len(features_indices.feature_statistics.Y))
 
 
-def q_params_aux(words, t, u, v, weights, features_indices):
+def f_xi_all_y(features_indices: Feature2Id, words, tags, i, shape_cache: WordShapeCache = None):
     """
-    auxiliary function for calculating q parameters for Viterbi algorithm
+    determine what features are fired for the given words, previous tags and location (history), for every tag in Y
+    at once. the tag independent work (building the features templates) is done once for all the tags
+    :param features_indices: object containing the features and their indices
+    :param words: words in sentence
+    :param tags: tags (tags[i] is not used)
+    :param i: location in sentence
+    :param shape_cache: WordShapeCache to take the words predicates from. None for the module default cache
+    :return: indptr, indices (CSR format) - the active features of the y-th tag in Y are
+             indices[indptr[y]:indptr[y + 1]], in the same order as f_xi_yi returns them
     """
-    # Notice that len(words) != len(tags) , but its ok
-    return sum(weights[f_xi_yi(features_indices, words=words, tags=[t, u, v], i=2)])
+    n_tags = len(features_indices.feature_statistics.Y)
+    active_tags, active_indices = templates_active_features(features_indices, *f_xi_templates(words, tags, i,
+                                                                                                shape_cache))
 
+    # group by tag, keeping the order of the features of every tag
+    order = np.argsort(active_tags, kind='stable')
+    indptr = np.zeros(n_tags + 1, dtype=np.int64)
+    np.cumsum(np.bincount(active_tags, minlength=n_tags), out=indptr[1:])
+    return indptr, active_indices[order]
 
-def q_params_calc(k, t, u, weights, features_indices: Feature2Id, words: list, class_statistics: ClassStatistics):
+
+def log_softmax(scores):
     """
-    calculate q parameters for Viterbi algorithm
+    :param scores: np array
+    :return: log of the softmax of scores (computed stably)
     """
-    Y = list(class_statistics.Y)
+    shifted = scores - np.max(scores)
+    return shifted - np.log(np.sum(np.exp(shifted)))
+
 
-    # set words list according to current k
+def q_params_words(words, k):
+    """
+    :return: the words around position k as q parameters are calculated with - [k-2, k-1, k, k+1] ('*' / 'STOP' out
+             of the sentence). the current word is in location 2
+    """
     if k == 0:
         try:
             tmp_words = ['*', '*', words[k], words[k + 1]]
@@ -1549,100 +2155,109 @@ def q_params_calc(k, t, u, weights, features_indices: Feature2Id, words: list, c
         tmp_words = [words[k - 2], words[k - 1], words[k], 'STOP']
     else:
         tmp_words = [words[k - 2], words[k - 1], words[k], words[k + 1]]
+    return tmp_words
 
-    softmax = special.softmax([q_params_aux(tmp_words, t, u, v, weights, features_indices) for v in Y])
 
-    q_params = dict()
-    for i in range(len(softmax)):
-        q_params[Y[i]] = softmax[i]
-
-    return q_params
+def q_params_words_part(k, weights, features_indices: Feature2Id, words: list, shape_cache: WordShapeCache = None):
+    """
+    calculate the part of the q parameters of position k that does not depend on the previous tags t, u
+    :return: np array - scores of the words templates for every tag v in Y, prefixes of the previous tag templates
+    """
+    class100_templates, templates, prev_tag_prefixes = f_xi_words_templates(q_params_words(words, k), 2, shape_cache)
+    return templates_scores(weights, features_indices, class100_templates, templates), prev_tag_prefixes
 
 
-def beam_search(B, candidates_dict):
+def q_params_calc(k, t, u, weights, features_indices: Feature2Id, words: list, class_statistics: ClassStatistics,
+                  words_part=None):
     """
-    :param B: the beam search parameter >= 1 . this is the number of elements to return.
-    :param candidates_dict: keys are (k, u, v) and values are the probabilities. we are search for the B keys of the
-    highest probabilities.
-    :return: list of B tuples [(k, u1, v1), (k, u2, v2)...]
+    calculate q parameters for Viterbi algorithm, for all the next tags v at once
+    :param words_part: result of q_params_words_part for k (it is the same for all t, u). None for calculating it
+    :return: np array - log q(v | t, u, words, k) for every tag v in Y (same order as Y)
     """
-    chosen_B_keys = set()  # if change to list, doesn't suppose to have problem. we expect unique values only
-    for key, value in {k: v for k, v in
-                       sorted(candidates_dict.items(), key=lambda item: item[1], reverse=True)}.items():
-        chosen_B_keys.add(key)
-        if len(chosen_B_keys) == B:
-            return list(chosen_B_keys)
+    if words_part is None:
+        words_part = q_params_words_part(k, weights, features_indices, words)
+    words_scores, prev_tag_prefixes = words_part
+    scores = words_scores + templates_scores(weights, features_indices, (),
+                                             prev_tags_templates(prev_tag_prefixes, t, u))
+    return log_softmax(scores)
+
 
-    return list(chosen_B_keys)
+def beam_search(B, candidates, margin=None):
+    """
+    choose the states to expand from a position. partial selection (np.argpartition), the candidates are not sorted
+    :param B: the beam search parameter >= 1 . this is the maximal number of elements to keep.
+    :param candidates: np array of log probabilities (-inf for states that are not candidates). we are search for the
+    B entries of the highest probabilities.
+    :param margin: if not None, keep only entries with log probability >= (highest log probability - margin)
+    :return: flat indices of the chosen <= B entries (not ordered)
+    """
+    flat = candidates.ravel()
+    chosen = np.flatnonzero(flat > -np.inf)
+    if margin is not None and len(chosen) > 0:
+        chosen = chosen[flat[chosen] >= np.max(flat[chosen]) - margin]
+    if B < len(chosen):
+        chosen = chosen[np.argpartition(-flat[chosen], int(B) - 1)[:int(B)]]
+    return chosen
 
 
-def memm_viterbi(weights, features_indices: Feature2Id, words: list, class_statistics: ClassStatistics, beam):
+def memm_viterbi(weights, features_indices: Feature2Id, words: list, class_statistics: ClassStatistics, beam,
+                 margin=None):
     """
+    Viterbi in log space. scores and back pointers are arrays indexed by tags ids (index in Y, len(Y) for '*')
     :param class_statistics: relevant ClassStatistics object
     :param weights: chosen weights vector. will not be changed while the viterbi algorithm
     :param features_indices: relevant Feature2Id object
     :param words: a sentence to tag
-    :param beam: number for beam search e.g: np.inf , 5, 10
+    :param beam: number for beam search e.g: np.inf , 5, 10. at most beam states are expanded from every position
+    :param margin: optional log probability margin for beam search - states with log probability lower than the best
+                   state of their position minus margin are not expanded. None for no margin
     :return: inference of tags sequence
     """
     Y = class_statistics.Y
+    n_tags = len(Y)
+    start = n_tags  # id of '*'
+    tags_names = list(Y) + ['*']
 
-    tags_infer = [None] * len(words)
-
-    # pi = {key: (k, u, v) : value = max prob a tag sequence ending in tags u, v at positions k-1, k}
-    pi = dict()
-    pi[(-1, "*", "*")] = 1
+    if not words:
+        return list()
 
-    # bp = {key: (k, u, v) : value: the t argmax of the corresponding key in pi dict. t is in position k-2}
-    bp = dict()
+    # pi[t, u] = max log prob of a tag sequence ending in tags t, u at positions k-1, k
+    pi = np.full((n_tags + 1, n_tags + 1), -np.inf)
+    pi[start, start] = 0
+    states = [(start, start)]  # (t, u) pairs that survived the beam at position k-1
 
-    before_u = dict({"*": ["*"]})
-    q_params = dict()  # {(k, t, u): {v: softmax result} }
+    # bp[k][u, v] = the t argmax of pi[u, v] at position k. t is in position k-2
+    bp = list()
 
     for k in range(0, len(words)):
-        pi_temporary, bp_temporary = dict(), dict()
-
-        for u, list_of_ts in before_u.items():
-            for v in Y:
-                max_t = -np.inf
-                argmax_t = None
-                for t in list_of_ts:
-                    if (k, t, u) not in q_params.keys():
-                        q_params[(k, t, u)] = q_params_calc(k, t, u, weights, features_indices, words,
-                                                            class_statistics)
-                    current = pi[(k - 1, t, u)] * q_params[(k, t, u)][v]
-                    if current > max_t:
-                        max_t = current
-                        argmax_t = t
-                if max_t != -np.inf:
-                    pi_temporary[(k, u, v)] = max_t
-                    bp_temporary[(k, u, v)] = argmax_t
-            chosen_B_keys = beam_search(beam, candidates_dict=pi_temporary)  # contains <=B elements like (k, u, v)
-            before_u = dict()
-            for key in chosen_B_keys:
-                pi[key] = pi_temporary[key]
-                bp[key] = bp_temporary[key]
-                if key[2] in before_u:
-                    before_u[key[2]].append(key[1])
-                else:
-                    before_u[key[2]] = list()
-                    before_u[key[2]].append(key[1])
+        pi_k = np.full((n_tags + 1, n_tags + 1), -np.inf)
+        bp_k = np.zeros((n_tags + 1, n_tags + 1), dtype=np.int16)
+
+        words_part = q_params_words_part(k, weights, features_indices, words)
+        for t, u in states:
+            current = pi[t, u] + q_params_calc(k, tags_names[t], tags_names[u], weights, features_indices, words,
+                                               class_statistics, words_part)
+            better = current > pi_k[u, :n_tags]
+            pi_k[u, :n_tags][better] = current[better]
+            bp_k[u, :n_tags][better] = t
+
+        chosen = beam_search(beam, pi_k, margin)  # contains <=B flat indices of (u, v)
+        pi = np.full((n_tags + 1, n_tags + 1), -np.inf)
+        pi.flat[chosen] = pi_k.flat[chosen]
+        states = [divmod(int(index), n_tags + 1) for index in chosen]
+        bp.append(bp_k)
 
     # set (t_n-1, t_n)
-    argmax_u_v = [None, None]
-    max_u_v = -np.inf
-    for v, list_of_us in before_u.items():  # suppose to have only one v ('.' or '"')
-        for u in list_of_us:
-            current = pi[(len(words) - 1, u, v)]
-            if current > max_u_v:
-                max_u_v = current
-                argmax_u_v = [u, v]  # tags in two last places
-
-    tags_infer[len(words) - 1] = argmax_u_v[1]
-    tags_infer[len(words) - 2] = argmax_u_v[0]
+    u, v = divmod(int(np.argmax(pi)), n_tags + 1)
+    tags_ids = [0] * len(words)
+    tags_ids[len(words) - 1] = v
+    if len(words) > 1:
+        tags_ids[len(words) - 2] = u  # tags in two last places
 
     for k in range(len(words) - 3, -1, -1):
-        tags_infer[k] = bp[(k + 2, tags_infer[k + 1], tags_infer[k + 2])]
+        tags_ids[k] = int(bp[k + 2][tags_ids[k + 1], tags_ids[k + 2]])
+
+    tags_infer = [tags_names[tag_id] for tag_id in tags_ids]
 
     # Deterministic tagging
     for i in range(len(words)):
@@ -1652,8 +2267,114 @@ def memm_viterbi(weights, features_indices: Feature2Id, words: list, class_stati
     return tags_infer
 
 
+def tag_sentences(sentences, weights, features_indices: Feature2Id, class_statistics: ClassStatistics, beam,
+                  margin=None):
+    """
+    lazily tag sentences one by one
+    :param sentences: iterable of sentences (list of words), can be a generator
+    :param beam: number for beam search e.g: np.inf , 5, 10
+    :param margin: optional log probability margin for beam search (see memm_viterbi)
+    :return: generator of tagged sentences - [(word, tag), ...] for every sentence
+    """
+    for words in sentences:
+        tags = memm_viterbi(weights=weights, features_indices=features_indices, words=words,
+                            class_statistics=class_statistics, beam=beam, margin=margin)
+        yield list(zip(words, tags))
+
+
+def tag_lines(lines, weights, features_indices: Feature2Id, class_statistics: ClassStatistics, beam, margin=None):
+    """
+    lazily tag lines of a .words (or .wtag) file
+    :param lines: iterable of lines, e.g. a file object or sys.stdin
+    :return: generator of lines in .wtag format. a line ends with '\n' only if the input line did
+    """
+    for line in lines:
+        splited_words = re.split(' |[\n]', line)
+        last_char = ""  # for the last line in the file
+        if splited_words[-1] == "":
+            del splited_words[-1]  # remove \n
+            last_char = '\n'
+        words = [w.split('_')[0] for w in splited_words]
+        for tagged in tag_sentences([words], weights, features_indices, class_statistics, beam, margin):
+            yield ' '.join(['_'.join(word_tag) for word_tag in tagged]) + last_char
+
+
+# model of the worker processes of parallel tagging - (weights, features_indices, class_statistics, beam, margin)
+_tagging_worker_model = None
+
+
+def _init_tagging_worker(weights, features_indices: Feature2Id, class_statistics: ClassStatistics, beam, margin):
+    global _tagging_worker_model
+    if weights is None:  # the weights of a memory mapped model file (see tag_sentences_parallel)
+        weights = np.frombuffer(features_indices.templates_index_dict.weights, dtype=np.float64)
+    _tagging_worker_model = (weights, features_indices, class_statistics, beam, margin)
+
+
+def tagging_worker_initargs(weights, features_indices: Feature2Id, class_statistics: ClassStatistics, beam,
+                            margin=None):
+    """
+    :return: initargs for a process pool with initializer _init_tagging_worker. the weights of a memory mapped model
+             file are not sent, the workers map them from the file too instead of getting a copy
+    """
+    templates_index = features_indices.templates_index_dict
+    if isinstance(templates_index, MappedTemplatesIndex) and np.shares_memory(
+            weights, np.frombuffer(templates_index.weights, dtype=np.float64)):
+        weights = None
+    return weights, features_indices, class_statistics, beam, margin
+
+
+def _tagging_worker(batch):
+    """
+    :param batch: list of (sentence index, words)
+    :return: list of (sentence index, tags)
+    """
+    weights, features_indices, class_statistics, beam, margin = _tagging_worker_model
+    return [(s, memm_viterbi(weights=weights, features_indices=features_indices, words=words,
+                             class_statistics=class_statistics, beam=beam, margin=margin)) for s, words in batch]
+
+
+def _tagging_worker_per_sentence(batch):
+    """
+    as _tagging_worker, but the error of a sentence fails only that sentence (for batches of several requests)
+    :param batch: list of (sentence index, words)
+    :return: list of (sentence index, tags, None), or (sentence index, None, exception) for a failed sentence
+    """
+    weights, features_indices, class_statistics, beam, margin = _tagging_worker_model
+    results = list()
+    for s, words in batch:
+        try:
+            results.append((s, memm_viterbi(weights=weights, features_indices=features_indices, words=words,
+                                            class_statistics=class_statistics, beam=beam, margin=margin), None))
+        except Exception as error:
+            results.append((s, None, error))
+    return results
+
+
+def tag_sentences_parallel(sentences, weights, features_indices: Feature2Id, class_statistics: ClassStatistics,
+                           beam, margin=None, n_jobs=2, batch_size=4):
+    """
+    tag sentences on worker processes. every worker gets the model once, the longest sentences are scheduled first.
+    with a memory mapped model (load_model(path, memory_map=True)) the workers share the pages of the model file
+    :param sentences: list of sentences (list of words)
+    :param n_jobs: number of worker processes
+    :param batch_size: number of sentences sent to a worker at once
+    :return: list of tags for every sentence, in the order of sentences
+    """
+    order = sorted(range(len(sentences)), key=lambda s: len(sentences[s]), reverse=True)
+    batches = [[(s, sentences[s]) for s in order[start:start + batch_size]]
+               for start in range(0, len(order), batch_size)]
+    results = [None] * len(sentences)
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_tagging_worker,
+                             initargs=tagging_worker_initargs(weights, features_indices, class_statistics, beam,
+                                                              margin)) as executor:
+        for batch_result in executor.map(_tagging_worker, batches):
+            for s, tags in batch_result:
+                results[s] = tags
+    return results
+
+
 def inference(path_file_to_tag: str, path_result: str, weights, features_indices: Feature2Id,
-              class_statistics: ClassStatistics, beam):
+              class_statistics: ClassStatistics, beam, margin=None, n_jobs=1, profiler: Profiler = None):
     """
     create a tagged POS file for the given file to tag
     :param path_file_to_tag: file to tag with sentences lines (can be tagged or not tagged)
@@ -1662,110 +2383,486 @@ def inference(path_file_to_tag: str, path_result: str, weights, features_indices
     :param features_indices: relevant Feature2Id object
     :param class_statistics: relevant ClassStatistics object
     :param beam: number for beam search e.g: np.inf , 5, 10
+    :param margin: optional log probability margin for beam search (see memm_viterbi)
+    :param n_jobs: number of worker processes to tag the sentences in (see tag_sentences_parallel). 1 for tagging
+                   in this process
+    :param profiler: Profiler for the stages 'read', 'decode_sentence' (every sentence, 'decode_parallel' for
+                     n_jobs > 1) and 'write' (every line). its report is printed at the end. None for no profiling
     :return: None
     """
+    profiler_ = profiler if profiler is not None else NO_PROFILER
+    with profiler_.stage('read'):
+        corpus = Corpus(path_file_to_tag)
+    if n_jobs > 1:
+        with profiler_.stage('decode_parallel'):
+            all_tags = tag_sentences_parallel([corpus.words(s) for s in range(len(corpus))], weights,
+                                              features_indices, class_statistics, beam, margin, n_jobs)
     with open(path_result, 'w') as write_file:
-        with open(path_file_to_tag) as read_file:
-            for line in read_file:
-                # prepare words list of 'line'
-                splited_words = re.split(' |[\n]', line)
-                last_char = ""  # for the last line in the file
-                if splited_words[-1] == "":
-                    del splited_words[-1]  # remove \n
-                    last_char = '\n'
-                words = [w.split('_')[0] for w in splited_words]
-                # get the predicted tags for the sentence
-                tags = memm_viterbi(weights=weights, features_indices=features_indices, words=words,
-                                    class_statistics=class_statistics, beam=beam)
-                # build the line to write and write it to result path
+        for s in range(len(corpus)):
+            words = corpus.words(s)
+            last_char = '\n' if s < len(corpus) - 1 or corpus.ends_with_newline else ""  # for the last line
+            # get the predicted tags for the sentence
+            if n_jobs > 1:
+                tags = all_tags[s]
+            else:
+                with profiler_.stage('decode_sentence'):
+                    tags = memm_viterbi(weights=weights, features_indices=features_indices, words=words,
+                                        class_statistics=class_statistics, beam=beam, margin=margin)
+            profiler_.count('sentences')
+            profiler_.count('tokens', len(words))
+            # build the line to write and write it to result path
+            with profiler_.stage('write'):
                 line_to_write = ' '.join(['_'.join(word_tag) for word_tag in list(zip(words, tags))]) + last_char
                 write_file.write(line_to_write)
+    profiler_.report()
+
+
+def _line_tag_ids(line: str, tag_to_id: dict, tags_list: list):
+    """
+    :param line: tagged line e.g. "The_DT Treasury_NNP is_VBZ still_RB ._.\n"
+    :return: [list of words in order], [list of tag ids in order]. new tags are added to tag_to_id and tags_list
+    """
+    words, tag_ids = list(), list()
+    for word_tag_str in line.rstrip('\n').split(' '):
+        word_tag_list = word_tag_str.split('_')
+        tag = word_tag_list[1]
+        if tag not in tag_to_id:
+            tag_to_id[tag] = len(tags_list)
+            tags_list.append(tag)
+        words.append(word_tag_list[0])
+        tag_ids.append(tag_to_id[tag])
+    return words, tag_ids
+
+
+def _confusion_accuracy(confusion: np.array):
+    """
+    :param confusion: confusion matrix - true tag id rows, predicted tag id columns
+    :return: fraction of the diagonal, nan for no words
+    """
+    n_tokens = confusion.sum()
+    return float(np.trace(confusion) / n_tokens) if n_tokens else float('nan')
+
+
+def evaluate_files(path_true: str, paths_predicted, tags=(), known_words=None, chunk_size=1 << 16):
+    """
+    score tagged files against the true file in one pass. the files are read line by line in lockstep and the
+    (true tag, predicted tag) pairs are counted into a confusion matrix of tag ids for every predicted file
+    :param path_true: path for tagged file with true labels
+    :param paths_predicted: list of paths for tagged files with predicted labels, of the same sentences
+    :param tags: first tags of the tag ids e.g. class_statistics.Y, other tags get the next ids when they are read
+    :param known_words: set of the words seen in training e.g. set(Corpus('train1.wtag').words_list). None for no
+                        known / unknown words breakdown
+    :param chunk_size: number of words that are counted into the matrices at once
+    :return: list of tags (tag id -> tag), list of dicts for every predicted file - 'path', 'n_tokens', 'accuracy',
+             'confusion' (numpy matrix, true tag id rows and predicted tag id columns) and when known_words is given
+             also 'n_unknown_tokens', 'known_accuracy', 'unknown_accuracy', 'confusion_known', 'confusion_unknown'
+    """
+    tags_list = list(tags)
+    tag_to_id = {tag: i for i, tag in enumerate(tags_list)}
+    counts = np.zeros((len(paths_predicted), 2, len(tags_list), len(tags_list)), dtype=np.int64)  # [file, unknown]
+
+    # words of the current chunk
+    true_ids, unknown, predicted_ids = list(), list(), [list() for _ in paths_predicted]
+
+    def count_chunk():
+        nonlocal counts
+        n_tags = len(tags_list)
+        if counts.shape[-1] < n_tags:  # tags that were not in tags
+            grow = n_tags - counts.shape[-1]
+            counts = np.pad(counts, ((0, 0), (0, 0), (0, grow), (0, grow)))
+        rows = (np.array(unknown, dtype=np.int64) * n_tags + np.array(true_ids, dtype=np.int64)) * n_tags
+        for k, file_predicted_ids in enumerate(predicted_ids):
+            counts[k] += np.bincount(rows + np.array(file_predicted_ids, dtype=np.int64),
+                                     minlength=2 * n_tags * n_tags).reshape(2, n_tags, n_tags)
+            file_predicted_ids.clear()
+        true_ids.clear()
+        unknown.clear()
+
+    with contextlib.ExitStack() as stack:
+        files = [stack.enter_context(open(path)) for path in [path_true, *paths_predicted]]
+        for line_number, lines in enumerate(itertools.zip_longest(*files), 1):
+            if None in lines:
+                raise ValueError(f'{[path_true, *paths_predicted][lines.index(None)]} ends at line {line_number}, '
+                                 f'the other files go on')
+            words, line_true_ids = _line_tag_ids(lines[0], tag_to_id, tags_list)
+            for k, line in enumerate(lines[1:]):
+                line_predicted_ids = _line_tag_ids(line, tag_to_id, tags_list)[1]
+                if len(line_predicted_ids) != len(line_true_ids):
+                    raise ValueError(f'line {line_number} of {paths_predicted[k]} has {len(line_predicted_ids)} '
+                                     f'words, {len(line_true_ids)} in {path_true}')
+                predicted_ids[k].extend(line_predicted_ids)
+            true_ids.extend(line_true_ids)
+            unknown.extend([word not in known_words for word in words] if known_words is not None
+                           else [False] * len(words))
+            if len(true_ids) >= chunk_size:
+                count_chunk()
+    count_chunk()
+
+    results = list()
+    for path_predicted, file_counts in zip(paths_predicted, counts):
+        confusion = file_counts.sum(axis=0)
+        result = {'path': path_predicted, 'n_tokens': int(confusion.sum()),
+                  'accuracy': _confusion_accuracy(confusion), 'confusion': confusion}
+        if known_words is not None:
+            result.update({'n_unknown_tokens': int(file_counts[1].sum()),
+                           'known_accuracy': _confusion_accuracy(file_counts[0]),
+                           'unknown_accuracy': _confusion_accuracy(file_counts[1]),
+                           'confusion_known': file_counts[0], 'confusion_unknown': file_counts[1]})
+        results.append(result)
+    return tags_list, results
+
+
+def confusion_matrix_dict(confusion: np.array, tags_list: list, n_full_tags=0) -> dict:
+    """
+    :param confusion: confusion matrix of tag ids (see evaluate_files)
+    :param tags_list: tag id -> tag
+    :param n_full_tags: the pairs of the first n_full_tags tags are all in the dict (also with 0 occurrences)
+    :return: dict of (true_tag, predicted_tag) keys with values number of occurrences
+    """
+    dict_for_confusion_matrix = {(t1, t2): int(confusion[i, j]) for i, t1 in enumerate(tags_list[:n_full_tags])
+                                 for j, t2 in enumerate(tags_list[:n_full_tags])}
+    for i, j in zip(*np.nonzero(confusion)):
+        dict_for_confusion_matrix[(tags_list[i], tags_list[j])] = int(confusion[i, j])
+    return dict_for_confusion_matrix
 
 
 def evaluate(path_true: str, path_predicted: str, class_statistics: ClassStatistics) -> (dict, float):
     """
     prepare a dictionary for (true_tag, predicted_tag) keys with values number of occurrences,
-    and calculate tagging accuracy
+    and calculate tagging accuracy (see evaluate_files for scoring several files in one pass)
     :param path_true: path for tagged file with true labels
     :param path_predicted: path for tagged file with predicted labels
     :param class_statistics: relevant ClassStatistics object
     :return: dict, float as described
     """
-    correct, wrong = 0, 0
-    # create dict for the confusion matrix -> {(true_tag, pred_tag) : number of occurrences}
-    dict_for_confusion_matrix = {(t1, t2): 0 for t1 in class_statistics.Y for t2 in class_statistics.Y}
+    # dict for the confusion matrix -> {(true_tag, pred_tag) : number of occurrences}, all the pairs of train tags
+    tags_list, (result,) = evaluate_files(path_true, [path_predicted], tags=class_statistics.Y)
+    return confusion_matrix_dict(result['confusion'], tags_list, len(class_statistics.Y)), result['accuracy']
 
-    true_sentences = [s for s in open(path_true)]
-    predicted_sentences = [s for s in open(path_predicted)]
 
-    for s in range(len(true_sentences)):
-        splited_true = re.split(' |[\n]', true_sentences[s])
-        splited_predicted = re.split(' |[\n]', predicted_sentences[s])
+def _encode_template(template):
+    """
+    :param template: feature key without the tag e.g: (100, 'word'), (109.13, 2), (103, 'NN', 'DT')
+    :return: str - the class number followed by the typed payload fields, separated by '\x1f'. a str field is
+             's<length>:<string>' (the string can have any character, also '\x1f'), an int field is 'i<number>'
+    """
+    fields = [repr(template[0])]
+    for field in template[1:]:
+        if isinstance(field, str):
+            fields.append(f's{len(field)}:{field}')
+        elif isinstance(field, int) and not isinstance(field, bool):
+            fields.append('i' + str(field))
+        else:
+            raise ValueError(f'can not save template {template}: unsupported field type {type(field).__name__}')
+    return '\x1f'.join(fields)
 
-        if splited_true[-1] == "":
-            del splited_true[-1]  # remove \n
 
-        if splited_predicted[-1] == "":
-            del splited_predicted[-1]  # remove \n
+def _decode_template(encoded):
+    """
+    :return: the template encoded by _encode_template
+    """
+    end = encoded.find('\x1f')
+    position = end if end >= 0 else len(encoded)
+    template = [float(encoded[:position]) if '.' in encoded[:position] else int(encoded[:position])]
+    while position < len(encoded):
+        if encoded[position] != '\x1f':
+            raise ValueError(f'malformed template key {encoded!r}')
+        kind, position = encoded[position + 1:position + 2], position + 2
+        if kind == 's':
+            colon = encoded.index(':', position)
+            end = colon + 1 + int(encoded[position:colon])
+            template.append(encoded[colon + 1:end])
+        elif kind == 'i':
+            end = encoded.find('\x1f', position)
+            end = end if end >= 0 else len(encoded)
+            template.append(int(encoded[position:end]))
+        else:
+            raise ValueError(f'malformed template key {encoded!r}')
+        position = end
+    return tuple(template)
+
+
+def _padding(size):
+    return b'\0' * (-size % 8)
+
+
+def _model_file_sections(path, buffer):
+    """
+    :param buffer: content of a model file (bytes or mmap)
+    :return: list of memoryviews over buffer (no copy) - weights, entries offsets, entries tags, entries indices,
+             keys offsets, hash slots, tags blob, keys blob (see save_model)
+    """
+    (magic, version, _, n_tags, n_templates, n_entries, n_features, n_slots, tags_size,
+     keys_size) = MODEL_FILE_HEADER.unpack_from(buffer)
+    if magic != MODEL_FILE_MAGIC:
+        raise ValueError(f'{path} is not a model file')
+    if version != MODEL_FILE_VERSION:
+        raise ValueError(f'{path} has model file version {version}, expected {MODEL_FILE_VERSION}')
+
+    view = memoryview(buffer)
+    offset = MODEL_FILE_HEADER.size
+    sections = list()
+    for section_format, count in [('d', n_features), ('q', n_templates + 1), ('i', n_entries), ('i', n_entries),
+                                  ('q', n_templates + 1), ('i', n_slots), ('B', tags_size), ('B', keys_size)]:
+        size = struct.calcsize(section_format) * count
+        sections.append(view[offset:offset + size].cast(section_format))
+        offset += size + len(_padding(size))
+    return sections
+
+
+def load_pickled_model(train_file_path_: str):
+    """
+    load the .pkl files saved by train_model_1 / train_model_2. the classes must be importable from __main__ as
+    they were pickled there (from main import ClassStatistics, Feature2Id)
+    :param train_file_path_: train file of the model e.g: 'train2.wtag'
+    :return: ClassStatistics object, Feature2Id object, weights
+    """
+    with open(rf'c_object_trained_on_{train_file_path_}.pkl', 'rb') as file:
+        c = pickle.load(file)
+    with open(rf'f_object_trained_on_{train_file_path_}.pkl', 'rb') as file:
+        f = pickle.load(file)
+    with open(rf'weights_trained_on_{train_file_path_}.pkl', 'rb') as file:
+        weights = pickle.load(file)
+    return c, f, weights
 
-        tags_true = [w.split('_')[1] for w in splited_true]
-        tags_predicted = [w.split('_')[1] for w in splited_predicted]
-        for true, predicted in zip(tags_true, tags_predicted):
-            if true != predicted:
-                wrong += 1
-            else:
-                correct += 1
-
-            if (true, predicted) in dict_for_confusion_matrix:
-                dict_for_confusion_matrix[(true, predicted)] += 1
-            else:  # for the case where we have some tag in the test that we didn't see during train
-                dict_for_confusion_matrix[(true, predicted)] = 1
-
-    return dict_for_confusion_matrix, float(correct / (correct + wrong))
-
-
-def train_model_1(train_file_path_: str, factr_, lambda_):
-    # in case of several runs in the same code
-    initialize_global_variables()
-
-    # create statistics object
-    c = ClassStatistics(train_file_path_)
-    c.set_class100_dict()
-    c.set_class101_dict()
-    c.set_class102_dict()
-    c.set_class103_dict()
-    c.set_class104_dict()
-    c.set_class105_dict()
-    c.set_class106_dict()
-    c.set_class107_dict()
-    c.set_class108_dict()
-    c.set_class109_dict()
-    c.set_class110_dict()
-
-    # create features from statistics
-    f = Feature2Id(c)
-    f.set_index_class100()
-    f.set_index_class101()
-    f.set_index_class102()
-    f.set_index_class103()
-    f.set_index_class104()
-    f.set_index_class105()
-    f.set_index_class106()
-    f.set_index_class107()
-    f.set_index_class108()
-    f.set_index_class109()
-    f.set_index_class110()
-
-    # build the final features dictionary after thresholds
-    f.build_all_classes_feature_index_dict()
+
+def save_model(path: str, class_statistics: ClassStatistics, features_indices: Feature2Id, weights):
+    """
+    write only what decoding needs (tags, features templates index and weights) to a binary model file.
+    layout: header (MODEL_FILE_HEADER), then 8 bytes aligned sections - weights (float64), templates entries offsets
+    (int64), entries tags (int32, index in Y), entries features indices (int32), templates keys offsets (int64),
+    hash slots (int32, open addressing by crc32 of the key, -1 for empty), tags ('\n' separated utf-8), templates
+    keys (utf-8, see _encode_template)
+    :param path: path of the model file to write
+    :param class_statistics: relevant ClassStatistics object
+    :param features_indices: relevant Feature2Id object
+    :param weights: model weights
+    :return: None
+    """
+    templates_index_dict = features_indices.templates_index_dict
+    entries_offsets = np.zeros(len(templates_index_dict) + 1, dtype=np.int64)
+    entries_offsets[1:] = np.cumsum([len(tags) for tags, _ in templates_index_dict.values()])
+    entries_tags = np.fromiter((tag for tags, _ in templates_index_dict.values() for tag in tags), dtype=np.int32,
+                               count=entries_offsets[-1])
+    entries_indices = np.fromiter((index for _, indices in templates_index_dict.values() for index in indices),
+                                  dtype=np.int32, count=entries_offsets[-1])
+    keys = list()
+    for template in templates_index_dict:
+        encoded = _encode_template(template)
+        if _decode_template(encoded) != template:  # it would never be found when the model is loaded
+            raise ValueError(f'can not save template {template!r}: it is read back as {_decode_template(encoded)!r}')
+        keys.append(encoded.encode('utf-8'))
+    keys_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    keys_offsets[1:] = np.cumsum([len(key) for key in keys])
+
+    # hash table of the templates rows, at most half full
+    n_slots = 2
+    while n_slots < 2 * len(keys):
+        n_slots *= 2
+    slots = np.full(n_slots, -1, dtype=np.int32)
+    for row, key in enumerate(keys):
+        slot = zlib.crc32(key) & (n_slots - 1)
+        while slots[slot] >= 0:
+            slot = (slot + 1) & (n_slots - 1)
+        slots[slot] = row
+
+    tags_blob = '\n'.join(class_statistics.Y).encode('utf-8')
+    keys_blob = b''.join(keys)
+    weights = np.ascontiguousarray(weights, dtype=np.float64)
+
+    with open(path, 'wb') as file:
+        file.write(MODEL_FILE_HEADER.pack(MODEL_FILE_MAGIC, MODEL_FILE_VERSION, 0, len(class_statistics.Y),
+                                          len(keys), int(entries_offsets[-1]), len(weights), n_slots,
+                                          len(tags_blob), len(keys_blob)))
+        for section in [weights.tobytes(), entries_offsets.tobytes(), entries_tags.tobytes(),
+                        entries_indices.tobytes(), keys_offsets.tobytes(), slots.tobytes(), tags_blob, keys_blob]:
+            file.write(section + _padding(len(section)))
+
+
+class MappedTemplatesIndex:
+    """
+    read only templates index over a memory mapped model file - same lookups as Feature2Id.templates_index_dict
+    without loading the keys. processes that map the same file share its pages. pickled as the file path only, so
+    worker processes map the file again instead of copying the tables
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (self.weights, self.entries_offsets, self.entries_tags, self.entries_indices, self.keys_offsets, self.slots,
+         self.tags_blob, self.keys_blob) = _model_file_sections(path, self.mapping)
+        self.slots_mask = len(self.slots) - 1
+
+    def get(self, template, default=None):
+        """
+        :return: (tags indices, features indices) of the template as memoryviews, default if it is not in the index
+        """
+        key = _encode_template(template).encode('utf-8')
+        slot = zlib.crc32(key) & self.slots_mask
+        row = self.slots[slot]
+        while row >= 0:
+            if self.keys_blob[self.keys_offsets[row]:self.keys_offsets[row + 1]] == key:
+                start, end = self.entries_offsets[row], self.entries_offsets[row + 1]
+                return self.entries_tags[start:end], self.entries_indices[start:end]
+            slot = (slot + 1) & self.slots_mask
+            row = self.slots[slot]
+        return default
+
+    def __contains__(self, template):
+        return self.get(template) is not None
+
+    def __getitem__(self, template):
+        value = self.get(template)
+        if value is None:
+            raise KeyError(template)
+        return value
+
+    def __len__(self):
+        return len(self.keys_offsets) - 1
+
+    def items(self):
+        """
+        :return: generator of (template, (tags indices, features indices)) of all the templates, in the saved order
+        """
+        for row in range(len(self)):
+            template = _decode_template(bytes(self.keys_blob[self.keys_offsets[row]:self.keys_offsets[row + 1]])
+                                        .decode('utf-8'))
+            start, end = self.entries_offsets[row], self.entries_offsets[row + 1]
+            yield template, (self.entries_tags[start:end], self.entries_indices[start:end])
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+def load_model(path: str, memory_map=False):
+    """
+    read a model file written by save_model
+    :param path: path of the model file
+    :param memory_map: map the file read only instead of reading it - the weights and the templates index
+                       (MappedTemplatesIndex) are views of the file pages, shared by all the processes that map it
+    :return: ClassStatistics object (only Y), Feature2Id object (only the templates index and the number of
+             features) and weights - enough for memm_viterbi / inference
+    """
+    if memory_map:
+        templates_index = MappedTemplatesIndex(path)
+        weights_view, tags_blob = templates_index.weights, templates_index.tags_blob
+    else:
+        with open(path, 'rb') as file:
+            buffer = file.read()
+        (weights_view, entries_offsets, entries_tags, entries_indices, keys_offsets, _, tags_blob,
+         keys_blob) = _model_file_sections(path, buffer)
+        entries_offsets, entries_tags, entries_indices, keys_offsets = (entries_offsets.tolist(), entries_tags.tolist(),
+                                                                        entries_indices.tolist(), keys_offsets.tolist())
+        keys_blob = bytes(keys_blob)
+        templates_index = {
+            _decode_template(keys_blob[keys_offsets[row]:keys_offsets[row + 1]].decode('utf-8')):
+                (tuple(entries_tags[entries_offsets[row]:entries_offsets[row + 1]]),
+                 tuple(entries_indices[entries_offsets[row]:entries_offsets[row + 1]]))
+            for row in range(len(keys_offsets) - 1)}
+
+    class_statistics = ClassStatistics(file_path=None)
+    class_statistics.Y = bytes(tags_blob).decode('utf-8').split('\n') if len(tags_blob) else list()
+    features_indices = Feature2Id(class_statistics)
+    features_indices.n_total_features = len(weights_view)
+    features_indices.templates_index_dict = templates_index
+    return class_statistics, features_indices, np.frombuffer(weights_view, dtype=np.float64)
+
+
+def warm_start_weights(features_indices: Feature2Id, init_features_indices: Feature2Id, init_weights):
+    """
+    initial weights for training a model from the weights of another trained model (e.g. trained on a part of the
+    corpus) - every feature gets the weight of the feature with the same key in the trained model, the new features
+    start at 0
+    :param features_indices: Feature2Id object of the model to train
+    :param init_features_indices: Feature2Id object of the trained model (also from load_model)
+    :param init_weights: weights of the trained model
+    :return: np array - initial weights vector for features_indices
+    """
+    if isinstance(features_indices, HashedFeature2Id) or isinstance(init_features_indices, HashedFeature2Id):
+        # the bucket of a feature depends only on its key, same number of buckets means same indices
+        if not (isinstance(features_indices, HashedFeature2Id) and isinstance(init_features_indices, HashedFeature2Id)
+                and features_indices.n_bits == init_features_indices.n_bits):
+            raise ValueError('hashed features can be warm started only from hashed features with the same n_bits')
+        return np.array(init_weights, dtype=np.float64)
+
+    x0 = np.zeros(features_indices.n_total_features)
+    tag_to_index = {tag: y for y, tag in enumerate(features_indices.feature_statistics.Y)}
+    init_Y = init_features_indices.feature_statistics.Y
+    templates_index_dict = features_indices.templates_index_dict
+    for template, (init_tags, init_indices) in init_features_indices.templates_index_dict.items():
+        template_entries = templates_index_dict.get(template)
+        if template_entries is None:
+            continue
+        tag_to_feature = dict(zip(*template_entries))  # {tag index: feature index} of the template in the new model
+        for init_tag, init_index in zip(init_tags, init_indices):
+            y = tag_to_index.get(init_Y[init_tag])
+            if y in tag_to_feature:
+                x0[tag_to_feature[y]] = init_weights[init_index]
+    return x0
+
+
+def train_model_1(train_file_path_: str, factr_, lambda_, n_jobs=1, n_hash_bits=None, profiler: Profiler = None,
+                  init_model=None):
+    """
+    :param n_jobs: number of worker processes for evaluating the objective function (see Trainer)
+    :param n_hash_bits: None for the regular features index (Feature2Id), or the number of bits of the hashed
+                        features index (HashedFeature2Id - 2 ** n_hash_bits weights, no features counts are kept)
+    :param profiler: Profiler for the stages 'read', 'statistics', 'indexing', 'save' and the stages of Trainer,
+                     and the counters of the hashed features buckets (see HashedFeature2Id.collision_statistics).
+                     its report is printed at the end. None for no profiling
+    :param init_model: (features_indices, weights) of a trained model to warm start from (see warm_start_weights),
+                       e.g. the model of a part of the train corpus. None for random initial weights
+    """
+    profiler_ = profiler if profiler is not None else NO_PROFILER
+    with profiler_.stage('read'):
+        corpus = Corpus(train_file_path_)
+    c = ClassStatistics(train_file_path_, corpus)
+    if n_hash_bits is not None:
+        # hashed features from the train corpus, only the tags are collected
+        with profiler_.stage('statistics'):
+            c.set_Y()
+        with profiler_.stage('indexing'):
+            f = HashedFeature2Id(c, n_bits=n_hash_bits, classes=MODEL_1_CLASSES)
+            f.set_seen_features(corpus)
+        collisions = f.collision_statistics()
+        profiler_.count('hashed_weights', collisions['n_weights'])
+        profiler_.count('hashed_used_buckets', collisions['n_used'])
+        profiler_.count('hashed_collided_buckets', collisions['n_collided'])
+    else:
+        # create statistics object
+        with profiler_.stage('statistics'):
+            c.set_all_classes_dicts(MODEL_1_CLASSES)
+
+        # create features from statistics
+        with profiler_.stage('indexing'):
+            f = Feature2Id(c)
+            f.set_index_class100()
+            f.set_index_class101()
+            f.set_index_class102()
+            f.set_index_class103()
+            f.set_index_class104()
+            f.set_index_class105()
+            f.set_index_class106()
+            f.set_index_class107()
+            f.set_index_class108()
+            f.set_index_class109()
+            f.set_index_class110()
+
+            # build the final features dictionary after thresholds
+            f.build_all_classes_feature_index_dict()
 
     # create initial weights vector
-    x0 = np.random.randn(f.n_total_features)
+    if init_model is not None:
+        x0 = warm_start_weights(f, *init_model)
+    else:
+        x0 = np.random.randn(f.n_total_features)
 
     # run optimization
-    # args= (file_path, lambda , feature_statistics, features_indices)
-    args = (train_file_path_, lambda_, c, f)
-    optimal_params = optimize.fmin_l_bfgs_b(func=function_l_and_gradient_l, x0=x0, args=args, factr=factr_)
+    optimal_params = Trainer(corpus, lambda_, c, f, n_jobs=n_jobs, profiler=profiler).train(x0=x0, factr=factr_)
 
     # save .pkl file for statistics, features and weights objects (only for later use in generate_comp_tagged.py)
     c_path = rf'c_object_trained_on_{train_file_path_}.pkl'
@@ -1775,59 +2872,81 @@ def train_model_1(train_file_path_: str, factr_, lambda_):
     # extract weights
     weights = optimal_params[0]
 
-    # write to .pkl
-    with open(c_path, 'wb') as file:
-        pickle.dump(c, file)
-    with open(f_path, 'wb') as file:
-        pickle.dump(f, file)
-    with open(weights_path, 'wb') as file:
-        pickle.dump(weights, file)
+    with profiler_.stage('save'):
+        # write to .pkl
+        with open(c_path, 'wb') as file:
+            pickle.dump(c, file)
+        with open(f_path, 'wb') as file:
+            pickle.dump(f, file)
+        with open(weights_path, 'wb') as file:
+            pickle.dump(weights, file)
+
+        # inference only model file (see save_model). hashed features have no keys to save, only the .pkl files
+        if n_hash_bits is None:
+            save_model(rf'model_trained_on_{train_file_path_}.memm', c, f, weights)
+    profiler_.report()
 
     return c, f, weights
 
 
-def train_model_2(train_file_path_: str, lambda_):
-    # in case of several runs in the same code
-    initialize_global_variables()
-
-    # create statistics object
-    c = ClassStatistics(train_file_path_)
-    c.set_class100_dict()
-    c.set_class101_dict()
-    c.set_class102_dict()
-    c.set_class103_dict()
-    c.set_class104_dict()
-    c.set_class105_dict()
-    c.set_class106_dict()
-    c.set_class107_dict()
-    c.set_class108_dict()
-    c.set_class109_dict()
-    c.set_class111_dict()
-
-    # create features from statistics
-    f = Feature2Id(c)
-    f.set_index_class100()
-    f.set_index_class101()
-    f.set_index_class102()
-    f.set_index_class103()
-    f.set_index_class104()
-    f.set_index_class105()
-    f.set_index_class106()
-    f.set_index_class107()
-    f.set_index_class108()
-    f.set_index_class109()
-    f.set_index_class111()
-
-    # build the final features dictionary after thresholds
-    f.build_all_classes_feature_index_dict()
+def train_model_2(train_file_path_: str, lambda_, n_jobs=1, n_hash_bits=None, profiler: Profiler = None,
+                  init_model=None):
+    """
+    :param n_jobs: number of worker processes for evaluating the objective function (see Trainer)
+    :param n_hash_bits: None for the regular features index (Feature2Id), or the number of bits of the hashed
+                        features index (HashedFeature2Id - 2 ** n_hash_bits weights, no features counts are kept)
+    :param profiler: Profiler for the stages 'read', 'statistics', 'indexing', 'save' and the stages of Trainer,
+                     and the counters of the hashed features buckets (see HashedFeature2Id.collision_statistics).
+                     its report is printed at the end. None for no profiling
+    :param init_model: (features_indices, weights) of a trained model to warm start from (see warm_start_weights),
+                       e.g. the model of a part of the train corpus. None for random initial weights
+    """
+    profiler_ = profiler if profiler is not None else NO_PROFILER
+    with profiler_.stage('read'):
+        corpus = Corpus(train_file_path_)
+    c = ClassStatistics(train_file_path_, corpus)
+    if n_hash_bits is not None:
+        # hashed features from the train corpus, only the tags are collected
+        with profiler_.stage('statistics'):
+            c.set_Y()
+        with profiler_.stage('indexing'):
+            f = HashedFeature2Id(c, n_bits=n_hash_bits, classes=MODEL_2_CLASSES)
+            f.set_seen_features(corpus)
+        collisions = f.collision_statistics()
+        profiler_.count('hashed_weights', collisions['n_weights'])
+        profiler_.count('hashed_used_buckets', collisions['n_used'])
+        profiler_.count('hashed_collided_buckets', collisions['n_collided'])
+    else:
+        # create statistics object
+        with profiler_.stage('statistics'):
+            c.set_all_classes_dicts(MODEL_2_CLASSES)
+
+        # create features from statistics
+        with profiler_.stage('indexing'):
+            f = Feature2Id(c)
+            f.set_index_class100()
+            f.set_index_class101()
+            f.set_index_class102()
+            f.set_index_class103()
+            f.set_index_class104()
+            f.set_index_class105()
+            f.set_index_class106()
+            f.set_index_class107()
+            f.set_index_class108()
+            f.set_index_class109()
+            f.set_index_class111()
+
+            # build the final features dictionary after thresholds
+            f.build_all_classes_feature_index_dict()
 
     # create initial weights vector
-    x0 = np.random.randn(f.n_total_features)
+    if init_model is not None:
+        x0 = warm_start_weights(f, *init_model)
+    else:
+        x0 = np.random.randn(f.n_total_features)
 
     # run optimization
-    # args= (file_path, lambda , feature_statistics, features_indices)
-    args = (train_file_path_, lambda_, c, f)
-    optimal_params = optimize.fmin_l_bfgs_b(func=function_l_and_gradient_l, x0=x0, args=args)
+    optimal_params = Trainer(corpus, lambda_, c, f, n_jobs=n_jobs, profiler=profiler).train(x0=x0)
 
     # save .pkl file for statistics, features and weights objects (only for later use in generate_comp_tagged.py)
     c_path = rf'c_object_trained_on_{train_file_path_}.pkl'
@@ -1837,13 +2956,19 @@ def train_model_2(train_file_path_: str, lambda_):
     # extract weights
     weights = optimal_params[0]
 
-    # write to .pkl
-    with open(c_path, 'wb') as file:
-        pickle.dump(c, file)
-    with open(f_path, 'wb') as file:
-        pickle.dump(f, file)
-    with open(weights_path, 'wb') as file:
-        pickle.dump(weights, file)
+    with profiler_.stage('save'):
+        # write to .pkl
+        with open(c_path, 'wb') as file:
+            pickle.dump(c, file)
+        with open(f_path, 'wb') as file:
+            pickle.dump(f, file)
+        with open(weights_path, 'wb') as file:
+            pickle.dump(weights, file)
+
+        # inference only model file (see save_model). hashed features have no keys to save, only the .pkl files
+        if n_hash_bits is None:
+            save_model(rf'model_trained_on_{train_file_path_}.memm', c, f, weights)
+    profiler_.report()
 
     return c, f, weights
 
@@ -1855,8 +2980,8 @@ def create_files_leave_one_out_model_2(train_file_path='train2.wtag'):
     :return: None, writes the files to directory: 'kfold_loo'
     """
     # prepare sentences list from tagged file
-    with open(train_file_path) as file:
-        sentences = [line for line in file]
+    corpus = Corpus(train_file_path)
+    sentences = [corpus.line(s) for s in range(len(corpus))]
     np.random.shuffle(sentences)  # shuffle the data before performing leave-one-out
 
     size = len(sentences)  # 250 for train2.wtag
@@ -1874,67 +2999,211 @@ def create_files_leave_one_out_model_2(train_file_path='train2.wtag'):
                 file.write(sentences[idx])
 
 
-def run_leave_one_out_model_2():
+def cross_validation_fold(corpus: Corpus, test_indices, classes, lambda_, beam, factr=1e7, seed=0,
+                          full_statistics: ClassStatistics = None):
+    """
+    train a model on all the sentences of the corpus but the test sentences and tag the test sentences with it
+    :param corpus: tagged Corpus
+    :param test_indices: indices of the held out sentences
+    :param classes: features classes of the model e.g: MODEL_2_CLASSES
+    :param seed: seed of the random initial weights
+    :param full_statistics: ClassStatistics of the whole corpus (classes counted). the fold statistics are then the
+                            full counts minus the counts of the test sentences (see ClassStatistics.subtract).
+                            None for counting the train sentences
+    :return: dict of (true_tag, predicted_tag) keys with values number of occurrences in the test sentences
+    """
+    train_indices = np.setdiff1d(np.arange(len(corpus)), test_indices)
+    train_corpus = corpus.subset(train_indices)
+    if full_statistics is not None:
+        held_out_statistics = ClassStatistics(corpus.file_path, corpus.subset(test_indices))
+        held_out_statistics.set_all_classes_dicts(classes)
+        c = full_statistics.subtract(held_out_statistics)
+    else:
+        c = ClassStatistics(corpus.file_path, train_corpus)
+        c.set_all_classes_dicts(classes)
+    f = Feature2Id(c)  # thresholds (also the mean based) are computed from the fold counts
+    f.set_all_classes_index(classes)
+
+    x0 = np.random.RandomState(seed).randn(f.n_total_features)
+    weights = Trainer(train_corpus, lambda_, c, f).train(x0=x0, factr=factr)[0]
+
+    confusion = dict()
+    for s in test_indices:
+        words, tags_true = corpus.sentence(s)
+        tags_predicted = memm_viterbi(weights=weights, features_indices=f, words=words, class_statistics=c, beam=beam)
+        for true, predicted in zip(tags_true, tags_predicted):
+            confusion[(true, predicted)] = confusion.get((true, predicted), 0) + 1
+    return confusion
+
+
+# (corpus, classes, lambda_, beam, factr, full_statistics) of the worker processes of cross_validate
+_cross_validation_worker_setup = None
+
+
+def _init_cross_validation_worker(corpus: Corpus, classes, lambda_, beam, factr, full_statistics):
+    global _cross_validation_worker_setup
+    _cross_validation_worker_setup = (corpus, classes, lambda_, beam, factr, full_statistics)
+
+
+def _cross_validation_worker(fold):
+    """
+    :param fold: (fold number, test indices)
+    """
+    corpus, classes, lambda_, beam, factr, full_statistics = _cross_validation_worker_setup
+    fold_number, test_indices = fold
+    return cross_validation_fold(corpus, test_indices, classes, lambda_, beam, factr, fold_number, full_statistics)
+
+
+def cross_validate(corpus: Corpus, classes, lambda_, beam, k=None, factr=1e7, n_jobs=1, seed=0):
+    """
+    k-fold cross validation on one parsed corpus, the folds are built in memory. every fold trains a model on the
+    other folds and tags its sentences (see cross_validation_fold). the folds run on n_jobs worker processes
+    :param corpus: tagged Corpus
+    :param classes: features classes of the model e.g: MODEL_2_CLASSES
+    :param lambda_: regularization parameter
+    :param beam: number for beam search
+    :param k: number of folds, None for leave-one-out (a fold for every sentence)
+    :param factr: fmin_l_bfgs_b convergence parameter
+    :param n_jobs: number of worker processes, 1 for running the folds in this process
+    :param seed: seed of the shuffle of the sentences (the fold number is the seed of its initial weights)
+    :return: dict - 'accuracy' (all the words of all the folds), 'folds_accuracies', 'confusion' (dict of
+             (true_tag, predicted_tag) keys with values number of occurrences, as evaluate returns)
+    """
+    order = np.random.RandomState(seed).permutation(len(corpus))
+    folds = list(enumerate(np.array_split(order, k if k is not None else len(corpus))))
+    folds = [(fold_number, test_indices) for fold_number, test_indices in folds if len(test_indices)]
+
+    # counted once, every fold subtracts the counts of its test sentences
+    full_statistics = ClassStatistics(corpus.file_path, corpus)
+    full_statistics.set_all_classes_dicts(classes)
+
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_cross_validation_worker,
+                                 initargs=(corpus, classes, lambda_, beam, factr, full_statistics)) as executor:
+            folds_confusions = list(executor.map(_cross_validation_worker, folds))
+    else:
+        folds_confusions = [cross_validation_fold(corpus, test_indices, classes, lambda_, beam, factr, fold_number,
+                                                  full_statistics)
+                            for fold_number, test_indices in folds]
+
+    confusion, folds_accuracies = dict(), list()
+    for fold_confusion in folds_confusions:
+        correct = sum(n for (true, predicted), n in fold_confusion.items() if true == predicted)
+        folds_accuracies.append(correct / sum(fold_confusion.values()))
+        for key, n in fold_confusion.items():
+            confusion[key] = confusion.get(key, 0) + n
+    correct = sum(n for (true, predicted), n in confusion.items() if true == predicted)
+    return {'accuracy': correct / sum(confusion.values()), 'folds_accuracies': folds_accuracies,
+            'confusion': confusion}
+
+
+def run_leave_one_out_model_2(train_file_path='train2.wtag', n_jobs=None):
     """
-    call this function after 'create_files_leave_one_out_model_2' called
     evaluate leave-one-out accuracy for model 2
     we used this in order to get the most accurate prediction we can on model 2 performance
+    the folds are built in memory from the train file (create_files_leave_one_out_model_2 is not needed) and run on
+    n_jobs worker processes (None for the number of cpus)
     """
-    accuracies = list()
-    for i in range(1, 251):
-        initialize_global_variables()  # in case of several runs in the same code
-        train_file_path = os.path.join("kfold_loo", f'train2_{i}.txt')
-        test_file_path = os.path.join("kfold_loo", f'test2_{i}.txt')
-
-        lambda_ = 0.02
-        beam_ = 50
-        result_file_path = f'{test_file_path.split(".")[0]}_tagged_{int(time.time())}.txt'
-
-        c = ClassStatistics(train_file_path)
-        c.set_class100_dict()
-        c.set_class101_dict()
-        c.set_class102_dict()
-        c.set_class103_dict()
-        c.set_class104_dict()
-        c.set_class105_dict()
-        c.set_class106_dict()
-        c.set_class107_dict()
-        c.set_class108_dict()
-        c.set_class109_dict()
-        c.set_class111_dict()
-
-        f = Feature2Id(c)
-        f.set_index_class100()
-        f.set_index_class101()
-        f.set_index_class102()
-        f.set_index_class103()
-        f.set_index_class104()
-        f.set_index_class105()
-        f.set_index_class106()
-        f.set_index_class107()
-        f.set_index_class108()
-        f.set_index_class109()
-        f.set_index_class111()
-
-        f.build_all_classes_feature_index_dict()
-
-        args = (train_file_path, lambda_, c, f)
-        x0 = np.random.randn(f.n_total_features)
+    result = cross_validate(Corpus(train_file_path), MODEL_2_CLASSES, lambda_=0.02, beam=50, k=None,
+                            n_jobs=n_jobs if n_jobs is not None else os.cpu_count())
+    for i, accuracy in enumerate(result['folds_accuracies']):
+        print(f'accuracy for run {i + 1} = {accuracy}')
 
-        optimal_params = optimize.fmin_l_bfgs_b(func=function_l_and_gradient_l, x0=x0, args=args)
-        v_star = optimal_params[0]
+    print(f'ACCURACY FOR LEAVE-ONE-OUT MODEL 2 = {np.mean(result["folds_accuracies"])}')
+    return result
 
-        inference(path_file_to_tag=test_file_path, path_result=result_file_path, weights=v_star,
-                  features_indices=f, class_statistics=c, beam=beam_)
 
-        conf_mat_dict, accuracy = evaluate(path_true=test_file_path, path_predicted=result_file_path,
-                                           class_statistics=c)
-        accuracies.append(accuracy)
-
-        print(f'accuracy for run {i} = {accuracy}')
-        print(f'avg accuracy for {i} runs = {np.mean(accuracies)}\n')
+def sweep_lambda_path(trainer: Trainer, lambdas, factr, eval_sentences, beams, seed=0):
+    """
+    train along a path of regularization values, every model is warm started from the weights of the previous one
+    and is evaluated with every beam. the features matrix of the trainer is built once for the whole path
+    :param trainer: Trainer of the train corpus, its lam is set for every model
+    :param lambdas: regularization values in the order of the path
+    :param factr: fmin_l_bfgs_b convergence parameter
+    :param eval_sentences: list of (words, true tags) for the accuracy
+    :param beams: numbers for beam search
+    :param seed: seed of the random initial weights of the first model
+    :return: list of dicts, one for every (lambda, beam)
+    """
+    runs = list()
+    x0 = np.random.RandomState(seed).randn(trainer.features_indices.n_total_features)
+    for step, lambda_ in enumerate(lambdas):
+        trainer.lam = lambda_
+        start = time.perf_counter()
+        weights, objective, info = trainer.train(x0=x0, factr=factr)
+        train_seconds = time.perf_counter() - start
+        x0 = weights
+
+        for beam in beams:
+            start = time.perf_counter()
+            correct, total = 0, 0
+            for words, tags_true in eval_sentences:
+                tags_predicted = memm_viterbi(weights=weights, features_indices=trainer.features_indices,
+                                              words=words, class_statistics=trainer.feature_statistics, beam=beam)
+                correct += sum(true == predicted for true, predicted in zip(tags_true, tags_predicted))
+                total += len(tags_true)
+            runs.append({'lambda': lambda_, 'factr': factr, 'beam': beam, 'accuracy': correct / total,
+                         'train_seconds': train_seconds, 'decode_seconds': time.perf_counter() - start,
+                         'objective': float(objective), 'n_iterations': int(info['nit']),
+                         'n_function_calls': int(info['funcalls']), 'warm_start': step > 0})
+    return runs
+
+
+# (trainer, lambdas, eval_sentences, beams, seed) of the worker processes of sweep
+_sweep_worker_setup = None
+
+
+def _init_sweep_worker(trainer: Trainer, lambdas, eval_sentences, beams, seed):
+    global _sweep_worker_setup
+    _sweep_worker_setup = (trainer, lambdas, eval_sentences, beams, seed)
+
+
+def _sweep_worker(factr):
+    trainer, lambdas, eval_sentences, beams, seed = _sweep_worker_setup
+    return sweep_lambda_path(trainer, lambdas, factr, eval_sentences, beams, seed)
+
+
+def sweep(train_file_path: str, classes, lambdas, factrs=(1e7,), beams=(50,), eval_file_path: str = None, n_jobs=1,
+          seed=0):
+    """
+    hyperparameters grid search. the statistics, the features index and the features matrix are built once for the
+    train file, then a model is trained for every (lambda, factr) and evaluated with every beam.
+    for every factr the lambdas are a path from the strongest regularization down, every model is warm started from
+    the previous one (see sweep_lambda_path). with n_jobs > 1 the paths of the factrs run on worker processes, with
+    a single factr the n_jobs evaluate the objective function instead (see Trainer)
+    :param classes: features classes of the model e.g: MODEL_2_CLASSES
+    :param lambdas: regularization values
+    :param factrs: fmin_l_bfgs_b convergence parameters
+    :param beams: numbers for beam search
+    :param eval_file_path: tagged file for the accuracy (.wtag). None for the train file
+    :param seed: seed of the random initial weights of the first model of every path
+    :return: dict - 'build_seconds', 'n_features', 'runs' (dict for every (lambda, factr, beam) with 'accuracy',
+             'train_seconds', 'decode_seconds', 'objective', 'n_iterations', 'n_function_calls', 'warm_start')
+    """
+    start = time.perf_counter()
+    corpus = Corpus(train_file_path)
+    c = ClassStatistics(train_file_path, corpus)
+    c.set_all_classes_dicts(classes)
+    f = Feature2Id(c)
+    f.set_all_classes_index(classes)
+    trainer = Trainer(corpus, lambdas[0], c, f, n_jobs=n_jobs)
+    trainer.build()
+    build_seconds = time.perf_counter() - start
+
+    eval_corpus = Corpus(eval_file_path) if eval_file_path is not None else corpus
+    eval_sentences = [eval_corpus.sentence(s) for s in range(len(eval_corpus))]
+    lambdas = sorted(lambdas, reverse=True)
+
+    if n_jobs > 1 and len(factrs) > 1:
+        trainer.n_jobs = 1  # a path for every worker
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(factrs)), initializer=_init_sweep_worker,
+                                 initargs=(trainer, lambdas, eval_sentences, beams, seed)) as executor:
+            paths = list(executor.map(_sweep_worker, factrs))
+    else:
+        paths = [sweep_lambda_path(trainer, lambdas, factr, eval_sentences, beams, seed) for factr in factrs]
 
-    print(f'ACCURACY FOR LEAVE-ONE-OUT MODEL 2 = {np.mean(accuracies)}')
+    return {'build_seconds': build_seconds, 'n_features': f.n_total_features,
+            'runs': [run for path in paths for run in path]}
 
 
 def main():
@@ -1980,8 +3249,10 @@ def main():
     """ ########## TRAIN MODEL 1 ON train1test1.wtag AND INFERENCE ON: [train1test1.wtag, comp1.words] ########## """
 
     # train model 1 on train1test1.wtag ->> this file is train1.wtag + test1.wtag together
+    # (f, weights are still the model 1 trained on train1.wtag)
     start = time.time()
-    c, f, weights = train_model_1(train_file_path_=r'train1test1.wtag', factr_=1e11, lambda_=0.2)
+    c, f, weights = train_model_1(train_file_path_=r'train1test1.wtag', factr_=1e11, lambda_=0.2,
+                                  init_model=(f, weights))  # warm start from the model of train1.wtag
     stop = time.time()
     print(f'MODEL 1 TRAINING ON FILE train1test1.wtag TOOK {stop - start} SECS')
 
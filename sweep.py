@@ -0,0 +1,41 @@
+import argparse
+import json
+import sys
+import main
+
+if __name__ == "__main__":
+    """ --------------------------------------------------- """
+    """ GRID SEARCH OF LAMBDA, FACTR AND BEAM ON ONE CORPUS """
+    # e.g. python sweep.py --train-file train1.wtag --eval-file test1.wtag --model 1 --lambdas 1 0.5 0.2 0.1
+    #      --factrs 1e7 1e11 --beams 5 50 --n-jobs 2
+
+    parser = argparse.ArgumentParser(description='train and evaluate a model for every combination of '
+                                                 'hyperparameters, the features are built once')
+    parser.add_argument('--train-file', required=True, help='tagged train file, e.g. train2.wtag')
+    parser.add_argument('--eval-file', default=None, help='tagged file for the accuracy (default the train file)')
+    parser.add_argument('--model', type=int, choices=[1, 2], default=2, help='features classes of model 1 or 2')
+    parser.add_argument('--lambdas', type=float, nargs='+', required=True, help='regularization values')
+    parser.add_argument('--factrs', type=float, nargs='+', default=[1e7], help='L-BFGS convergence parameters')
+    parser.add_argument('--beams', type=int, nargs='+', default=[50], help='beam sizes for Viterbi')
+    parser.add_argument('--n-jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random initial weights')
+    parser.add_argument('--output', default=None, help='path of a JSON results file, - for stdout')
+    args = parser.parse_args()
+
+    classes = main.MODEL_1_CLASSES if args.model == 1 else main.MODEL_2_CLASSES
+    results = main.sweep(args.train_file, classes, args.lambdas, args.factrs, args.beams, args.eval_file,
+                         n_jobs=args.n_jobs, seed=args.seed)
+
+    print(f'built {results["n_features"]} features in {results["build_seconds"]:.2f} secs', file=sys.stderr)
+    print(f'{"lambda":>10} {"factr":>10} {"beam":>6} {"accuracy":>9} {"train s":>9} {"decode s":>9} {"calls":>6}',
+          file=sys.stderr)
+    for run in results['runs']:
+        print(f'{run["lambda"]:>10g} {run["factr"]:>10g} {run["beam"]:>6} {run["accuracy"]:>9.4f} '
+              f'{run["train_seconds"]:>9.2f} {run["decode_seconds"]:>9.2f} {run["n_function_calls"]:>6}',
+              file=sys.stderr)
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+    elif args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import json
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+import main
+from main import ClassStatistics  # needed for loading the pickled objects
+from main import Feature2Id  # needed for loading the pickled objects
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error'}
+
+
+class TaggingService:
+    """
+    local HTTP tagging service. sentences of concurrent requests are collected into micro batches (everything that
+    arrives within batch_window seconds of the first sentence, up to max_batch_size sentences) and every batch is
+    tagged on a process pool, with at most n_jobs batches in flight.
+        POST /tag {"sentences": [["The", "dog", "barks"], "A sentence as one string", ...]}
+            -> {"tags": [["DT", "NN", "VBZ"], [...], ...], "latency_ms": time from receiving to answering}
+        GET /health -> {"status": "ok"}
+    """
+
+    def __init__(self, weights, features_indices: Feature2Id, class_statistics: ClassStatistics, beam, margin=None,
+                 n_jobs=2, batch_window=0.005, max_batch_size=32, shutdown_timeout=10):
+        """
+        :param beam: number for beam search e.g: np.inf , 5, 10
+        :param margin: optional log probability margin for beam search (see memm_viterbi)
+        :param n_jobs: number of worker processes
+        :param batch_window: seconds to wait for more sentences after the first sentence of a batch
+        :param max_batch_size: maximal number of sentences in a batch
+        :param shutdown_timeout: seconds to wait for the batches in flight when stopping, then they are cancelled
+        """
+        self.n_jobs = n_jobs
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.shutdown_timeout = shutdown_timeout
+        self.executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=main._init_tagging_worker,
+                                            initargs=main.tagging_worker_initargs(weights, features_indices,
+                                                                                  class_statistics, beam, margin))
+        self.queue = None  # (words, future) of every sentence waiting for a batch
+        self.in_flight = None  # limits the number of batches that are tagged at once
+        self.tasks = set()  # run_batch tasks in flight, the event loop keeps only weak references to tasks
+        self.n_batches, self.n_sentences = 0, 0
+
+    async def tag(self, sentences):
+        """
+        :param sentences: list of sentences (list of words)
+        :return: list of tags for every sentence
+        """
+        loop = asyncio.get_running_loop()
+        futures = list()
+        for words in sentences:
+            futures.append(loop.create_future())
+            await self.queue.put((words, futures[-1]))
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):  # a sentence of this request failed
+                raise result
+        return results
+
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.in_flight.acquire()
+            task = loop.create_task(self.run_batch(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            self.n_batches += 1
+            self.n_sentences += len(batch)
+            # the error of a sentence fails only its own request, not the other requests of the batch
+            results = await loop.run_in_executor(self.executor, main._tagging_worker_per_sentence,
+                                                 [(k, words) for k, (words, _) in enumerate(batch)])
+            for k, tags, error in results:
+                if error is not None:
+                    batch[k][1].set_exception(error)
+                else:
+                    batch[k][1].set_result(tags)
+        except Exception as error:  # the pool failed, e.g. a worker process died
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        except asyncio.CancelledError:  # stopping
+            for _, future in batch:
+                future.cancel()
+            raise
+        finally:
+            self.in_flight.release()
+
+    async def handle_request(self, method, path, body):
+        """
+        :return: HTTP status, response JSON object
+        """
+        if path == '/health':
+            return 200, {'status': 'ok', 'batches': self.n_batches, 'sentences': self.n_sentences}
+        if path != '/tag':
+            return 404, {'error': f'unknown path {path}'}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+
+        start = time.perf_counter()
+        try:
+            sentences = json.loads(body)['sentences']
+        except (ValueError, KeyError, TypeError) as error:
+            return 400, {'error': f'expected {{"sentences": [...]}}: {error}'}
+        if not isinstance(sentences, list) or not all(
+                isinstance(sentence, str) or (isinstance(sentence, list) and all(isinstance(word, str)
+                                                                                 for word in sentence))
+                for sentence in sentences):
+            return 400, {'error': 'every sentence should be a string or a list of strings (words)'}
+        sentences = [sentence.split() if isinstance(sentence, str) else sentence for sentence in sentences]
+        tags = await self.tag(sentences)
+        return 200, {'tags': tags, 'latency_ms': (time.perf_counter() - start) * 1000}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        HTTP/1.1 connection, requests are answered one after another while the client keeps the connection alive
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                    content_length = int(headers.get('content-length', 0))
+                    if content_length < 0:
+                        raise ValueError(f'negative Content-Length {content_length}')
+                except ValueError as error:
+                    # the body can not be found, answer and close the connection
+                    await self.write_response(writer, 400, {'error': f'malformed request: {error}'}, False)
+                    break
+                body = await reader.readexactly(content_length)
+
+                try:
+                    status, response = await self.handle_request(method, path, body)
+                except Exception as error:
+                    status, response = 500, {'error': repr(error)}
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                await self.write_response(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def write_response(writer: asyncio.StreamWriter, status, response, keep_alive):
+        """
+        :param status: HTTP status
+        :param response: response JSON object
+        :param keep_alive: whether the connection stays open for the next request
+        """
+        payload = json.dumps(response).encode('utf-8')
+        writer.write(f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(payload)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + payload)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        self.queue = asyncio.Queue()
+        self.in_flight = asyncio.Semaphore(self.n_jobs)
+        loop = asyncio.get_running_loop()
+        batcher = loop.create_task(self.batcher())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        loop.add_signal_handler(signal.SIGTERM, server.close)  # stop serving and shut the workers down
+        print(f'tagging on http://{host}:{port}/tag', flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # no new batches, let the batches in flight finish (or cancel them) before the workers are shut down
+            batcher.cancel()
+            if self.tasks:
+                _, pending = await asyncio.wait(set(self.tasks), timeout=self.shutdown_timeout)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+            self.executor.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    """ ------------------------------------- """
+    """ SERVE A TRAINED MODEL ON LOCAL HTTP """
+    # e.g. python tag_server.py --model model_trained_on_train2.wtag.memm --n-jobs 4
+    #      curl -d '{"sentences": ["The cells were grown in vitro ."]}' http://127.0.0.1:8080/tag
+
+    parser = argparse.ArgumentParser(description='local HTTP tagging service with micro batching')
+    model_group = parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument('--trained-on',
+                             help='train file name of the model, e.g. train2.wtag (reads the .pkl files saved by '
+                                  'training)')
+    model_group.add_argument('--model', help='model file saved by training, e.g. model_trained_on_train2.wtag.memm')
+    parser.add_argument('--memory-map', action='store_true',
+                        help='map the --model file read only instead of reading it (the workers share its pages)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--n-jobs', type=int, default=2, help='number of worker processes')
+    parser.add_argument('--beam', type=int, default=50, help='number for beam search')
+    parser.add_argument('--margin', type=float, default=None, help='log probability margin for beam search')
+    parser.add_argument('--batch-window-ms', type=float, default=5, help='time to collect a micro batch')
+    parser.add_argument('--max-batch-size', type=int, default=32, help='maximal number of sentences in a batch')
+    args = parser.parse_args()
+
+    # Load trained weights (and extra objects needed) for our model
+    if args.model is not None:
+        c, f, weights = main.load_model(args.model, memory_map=args.memory_map)
+    else:
+        c, f, weights = main.load_pickled_model(args.trained_on)
+
+    service = TaggingService(weights, f, c, beam=args.beam, margin=args.margin, n_jobs=args.n_jobs,
+                             batch_window=args.batch_window_ms / 1000, max_batch_size=args.max_batch_size)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,40 @@
+import argparse
+import sys
+import main
+from main import ClassStatistics  # needed for loading the pickled objects
+from main import Feature2Id  # needed for loading the pickled objects
+
+if __name__ == "__main__":
+    """ --------------------------------------------------------- """
+    """ TAG .words LINES FROM STDIN AND WRITE .wtag LINES TO STDOUT """
+    # e.g. python tag_stream.py --trained-on train2.wtag --beam 50 < comp2.words > comp2.wtag
+    #      python tag_stream.py --model model_trained_on_train2.wtag.memm < comp2.words > comp2.wtag
+
+    parser = argparse.ArgumentParser(description='tag .words lines from stdin, write .wtag lines to stdout')
+    model_group = parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument('--trained-on',
+                             help='train file name of the model, e.g. train2.wtag (reads the .pkl files saved by '
+                                  'training)')
+    model_group.add_argument('--model', help='model file saved by training, e.g. model_trained_on_train2.wtag.memm')
+    parser.add_argument('--memory-map', action='store_true',
+                        help='map the --model file read only instead of reading it (processes share its pages)')
+    parser.add_argument('--beam', type=int, default=50, help='number for beam search')
+    parser.add_argument('--margin', type=float, default=None, help='log probability margin for beam search')
+    parser.add_argument('--line-buffered', action='store_true',
+                        help='flush every tagged line (for interactive pipes). by default stdout is flushed every '
+                             'line only if it is a terminal')
+    args = parser.parse_args()
+
+    # Load trained weights (and extra objects needed) for our model
+    if args.model is not None:
+        c, f, weights = main.load_model(args.model, memory_map=args.memory_map)
+    else:
+        c, f, weights = main.load_pickled_model(args.trained_on)
+
+    # one line in memory at a time, the output is block buffered unless every line is needed right away
+    flush_every_line = args.line_buffered or sys.stdout.isatty()
+    for line in main.tag_lines(sys.stdin, weights=weights, features_indices=f, class_statistics=c, beam=args.beam,
+                               margin=args.margin):
+        sys.stdout.write(line)
+        if flush_every_line:
+            sys.stdout.flush()